@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+"""
+Runtime mode with one asyncio event loop instead of the jobs of the shared Scheduler (taupunkt.py --asyncio).
+
+Responsibility:
+- drive the sensors, the LCD, and the refresh of the switches as coroutines:
+-- DHT22 and DS18B20 every READ_TICK seconds, aligned to the wall clock
+-- RD200 at the poll times of RD200Scheduler
+-- View every second, aligned to the wall clock; Model.on_time every 5 seconds
+-- refresh of the switches every REPEAT_INTERVAL seconds
+- blocking calls are executed by small executors: the sensor reads by WORKERS threads, one per sensor coroutine,
+  thus the reads that are due at the same time never queue; the I2C writes of the LCD by their own thread, thus the
+  display is not delayed by long sensor reads
+- the averaging (Dewpoint, DS18B20) and all updates of the Model and the lines of the View are executed on the
+  event loop, thus the sensor callbacks, Model.on_time, and the View never run concurrently
+- an exception of one tick is printed, the coroutine keeps running
+- shutdown is a structured cancellation: stop() cancels all coroutines of the TaskGroup, then the components are
+  stopped and the flush of the database is awaited
+
+Architecture:
+- the components are the same as in the threaded mode, they are started with scheduled=False and their blocking
+  parts are called directly: DHT22.capture_data, DS18B20.capture_data, RD200.get_radon_value, View.update(lines)
+- the writes to the database only enqueue the points (see Storage), they do not block the event loop
+- the transmission of the switch codes stays in the thread of RpiRfGpiod, a request only notifies it
+- SIGINT and SIGTERM stop the runtime
+- main is for demonstration
+"""
+
+import asyncio
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from DHT22 import READ_TICK
+from RD200Scheduler import DENSE_INTERVAL
+from Switch import REPEAT_INTERVAL
+
+
+WORKERS = 3  # sensor reads: DHT22, DS18B20, RD200, each coroutine waits for its read
+ALIGNED_LATE = 0.002  # seconds, see Scheduler
+
+
+class Shutdown(Exception):
+    pass
+
+
+async def sleep_aligned(interval):
+    """Sleep until the next multiple of interval seconds of the wall clock."""
+    now = time.time()
+    await asyncio.sleep(interval - (now % interval) + ALIGNED_LATE)
+
+
+class AsyncRuntime():
+    def __init__(self, view, model, controller, workers=WORKERS):
+        self.view = view
+        self.model = model
+        self.controller = controller
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="AsyncRuntime")
+        self.view_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AsyncRuntimeView")
+        self.loop = None
+        self.should_stop = None  # asyncio.Event, created on the event loop
+        self.stats = {}  # name of the coroutine -> {"ticks", "errors"}
+
+    async def blocking(self, function, *args):
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    async def display(self, function, *args):
+        """I2C writes of the LCD, not queued behind the sensor reads"""
+        return await self.loop.run_in_executor(self.view_executor, function, *args)
+
+    async def tick(self, name, coroutine):
+        """One tick of a coroutine, returns its result; exceptions are printed, the result is None then."""
+        stats = self.stats.setdefault(name, {"ticks": 0, "errors": 0})
+        stats["ticks"] += 1
+        try:
+            return await coroutine
+        except Exception as e:
+            stats["errors"] += 1
+            print("{}:".format(name), e)
+        return None
+
+    async def read_DHT22(self):
+        dewpoint = self.controller.DHT22
+        data = await self.blocking(dewpoint.sensors.capture_data)
+        dewpoint.callback(data)  # averaging and Model update on the event loop
+
+    async def read_DS18B20(self):
+        ds = self.controller.DS18B20
+        data = await self.blocking(ds.capture_data)
+        ds.average_data(data)
+        ds.on_update(ds.averaged)
+
+    async def read_RD200(self):
+        rd200 = self.controller.RD200
+        Bq = await self.blocking(rd200.get_radon_value)
+        return rd200.on_poll(Bq)
+
+    async def update_view(self):
+        self.view.on_change_time()
+        if 0 == int(time.time()) % 5:
+            self.model.on_time()
+        lines = self.view.get_lines()  # copy, the lines are only changed on the event loop
+        await self.display(self.view.update, lines)
+
+    async def refresh_switches(self):
+        self.view.switch_out_fan.rpi_rf_gpiod.refresh()
+
+    async def run_DHT22(self):
+        while True:
+            await sleep_aligned(READ_TICK)
+            await self.tick("DHT22", self.read_DHT22())
+
+    async def run_DS18B20(self):
+        while True:
+            await sleep_aligned(READ_TICK)
+            await self.tick("DS18B20", self.read_DS18B20())
+
+    async def run_RD200(self):
+        while True:
+            t_next_read = await self.tick("RD200", self.read_RD200())
+            if t_next_read is None:
+                t_next_read = time.time() + DENSE_INTERVAL
+            await asyncio.sleep(max(0.0, t_next_read - time.time()))
+
+    async def run_view(self):
+        while True:
+            await sleep_aligned(1)
+            await self.tick("View", self.update_view())
+
+    async def run_switches(self):
+        while True:
+            await asyncio.sleep(REPEAT_INTERVAL)
+            await self.tick("switches", self.refresh_switches())
+
+    async def wait_for_stop(self):
+        await self.should_stop.wait()
+        raise Shutdown()  # cancels all other coroutines of the TaskGroup
+
+    def stop(self):
+        """May be called from any thread."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.should_stop.set)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.should_stop = asyncio.Event()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            try:
+                self.loop.add_signal_handler(sig, self.should_stop.set)
+            except (ValueError, RuntimeError):
+                pass  # not in the main thread
+        self.view.start(scheduled=False)
+        self.controller.start(scheduled=False)
+        try:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(self.wait_for_stop())
+                group.create_task(self.run_view())
+                group.create_task(self.run_DHT22())
+                group.create_task(self.run_DS18B20())
+                group.create_task(self.run_RD200())
+                group.create_task(self.run_switches())
+        except* Shutdown:
+            pass
+        finally:
+            await self.display(self.view.stop)
+            await self.blocking(self.controller.stop)
+            await self.blocking(self.model.stop)  # flush the points queued for the database
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.view_executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        asyncio.run(self.main())
+
+    def get_stats(self):
+        return {name: dict(stats) for name, stats in self.stats.items()}
+
+
+def main():
+    import threading
+    from Model import Model
+    from View import View
+    from Controller import Controller
+    view = View()
+    model = Model(view)
+    controller = Controller(model)
+    runtime = AsyncRuntime(view, model, controller)
+    threading.Timer(70, runtime.stop).start()
+    runtime.run()
+    print(runtime.get_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+Batched, non-blocking write pipeline, used by Database to decouple the sensor threads from the InfluxDB.
+
+Responsibility:
+- accept records from the sensor threads without blocking them
+- collect the records in a bounded in-memory queue
+- flush the queue when FLUSH_SIZE records are queued or FLUSH_INTERVAL seconds have passed since the first queued record
+- in case the queue is full or a flush fails, hand the records over to a fallback function (no record is lost silently);
+  if the exception of the write function has the attribute records, only these records failed and are handed over
+- provide counters for the queue depth and the flush latency
+
+Architecture:
+- executed in a background (daemon) thread
+- put() never blocks: a record that does not fit into the queue is put aside in an overflow list (O(1), no I/O),
+  the background thread hands the overflow over to the fallback (i.e. the write-ahead log, which may fsync)
+- the caller registers a write function and a fallback function uppon instantiation
+- both functions get a list of records
+- main is for demonstration
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+
+QUEUE_SIZE = 10000     # maximum number of records waiting for a flush
+FLUSH_SIZE = 100       # flush as soon as this number of records is queued
+FLUSH_INTERVAL = 10.0  # flush at the latest this number of seconds after the first record was queued
+
+
+class BatchWriter(threading.Thread):
+    def __init__(self, write, fallback, queue_size=QUEUE_SIZE, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        threading.Thread.__init__(self, daemon=True)
+        self.write = write
+        self.fallback = fallback
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.q = queue.Queue(maxsize=queue_size)
+        self.overflow = deque()  # records that did not fit into the queue, handed to the fallback by the thread
+        self.should_stop = threading.Event() # create an unset event on init
+        self.lock = threading.Lock()
+        self.stats = {
+            "queued": 0,             # records accepted by put()
+            "written": 0,            # records successfully written
+            "overflows": 0,          # records handed to the fallback because the queue was full
+            "failed": 0,             # records handed to the fallback because the flush failed
+            "flushes": 0,            # number of flushes (successful or not)
+            "failed_flushes": 0,     # number of failed flushes
+            "last_flush_latency": None,  # seconds
+            "max_flush_latency": None,   # seconds
+        }
+
+    def put(self, record):
+        """Never blocks. Returns False if the record did not fit into the queue and is handed over to the fallback."""
+        try:
+            self.q.put_nowait(record)
+        except queue.Full:
+            self.overflow.append(record)  # thread-safe, the fallback is called by the background thread
+            with self.lock:
+                self.stats["overflows"] += 1
+            return False
+        with self.lock:
+            self.stats["queued"] += 1
+        return True
+
+    def drain_overflow(self):
+        records = []
+        while True:
+            try:
+                records.append(self.overflow.popleft())
+            except IndexError:
+                break
+        if records:
+            self.call_fallback(records)
+
+    def call_fallback(self, records):
+        try:
+            self.fallback(records)
+        except Exception as e:
+            print(e)
+
+    def flush(self, records):
+        t_start = time.monotonic()
+        failed = []
+        try:
+            self.write(records)
+        except Exception as e:
+            print(e)
+            failed = getattr(e, "records", records)  # i.e. only the rollups failed, the sensor values are written
+            self.call_fallback(failed)
+        latency = time.monotonic() - t_start
+        with self.lock:
+            self.stats["flushes"] += 1
+            self.stats["last_flush_latency"] = latency
+            if (self.stats["max_flush_latency"] is None) or (self.stats["max_flush_latency"] < latency):
+                self.stats["max_flush_latency"] = latency
+            if failed:
+                self.stats["failed_flushes"] += 1
+                self.stats["failed"] += len(failed)
+            self.stats["written"] += len(records) - len(failed)
+
+    def collect(self):
+        """Wait for the first record, then collect until the batch is full or the flush interval passed."""
+        records = []
+        try:
+            records.append(self.q.get(timeout=1))  # wake up once a second in order to stop asap
+        except queue.Empty:
+            return records
+        t_flush = time.monotonic() + self.flush_interval
+        while len(records) < self.flush_size:
+            t_wait = t_flush - time.monotonic()
+            if t_wait <= 0 or self.should_stop.is_set():
+                break
+            try:
+                records.append(self.q.get(timeout=t_wait))
+            except queue.Empty:
+                break
+        return records
+
+    def run(self):
+        while not self.should_stop.is_set():
+            records = self.collect()
+            if records:
+                self.flush(records)
+            self.drain_overflow()
+        # flush what is left after stop()
+        records = []
+        while True:
+            try:
+                records.append(self.q.get_nowait())
+            except queue.Empty:
+                break
+            if len(records) >= self.flush_size:
+                self.flush(records)
+                records = []
+        if records:
+            self.flush(records)
+        self.drain_overflow()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self.q.qsize()
+        stats["overflow_depth"] = len(self.overflow)
+        return stats
+
+    def stop(self, timeout=None):
+        self.should_stop.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+def main():
+    def write(records):
+        time.sleep(0.5)  # simulate a slow InfluxDB
+        print("write", len(records), records[0], "..", records[-1])
+
+    def fallback(records):
+        print("fallback", records)
+
+    writer = BatchWriter(write, fallback, queue_size=50, flush_size=20, flush_interval=2)
+    writer.start()
+    for i in range(100):
+        t_start = time.monotonic()
+        writer.put(i)
+        if 0.01 < time.monotonic() - t_start:
+            print("put() blocked")
+        time.sleep(0.02)
+    writer.stop()
+    print(writer.get_stats())
+
+
+if __name__ == '__main__':
+    main()
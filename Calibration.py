@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Calibration model of a DHT22 sensor, the offsets of DHT22.json compiled for fast lookups.
+
+Responsibility:
+- hold the calibration points of one sensor: (temperature, humidity) -> (temperature offset, humidity offset)
+- find the offset for a measured temperature and humidity
+-- "nearest": offset of the nearest calibration point
+-- "idw": inverse distance weighted mean of the offsets of the NEIGHBOURS nearest calibration points,
+   smoother corrections between the calibration points
+- distances are measured in normalized coordinates, the whole sensor range maps to 0..1:
+  temperature -40 °C .. +80 °C -> (temperature + 40) / 120, humidity 0 % .. 100 % -> humidity / 100
+
+Architecture:
+- built once when the configuration is loaded, the lookup is a k-d tree search, O(log n) for n calibration points
+- immutable after construction, can be shared between threads
+- main is for demonstration
+"""
+
+import heapq
+import math
+
+
+T_MIN = -40.0
+T_MAX = +80.0
+H_MIN = 0.0
+H_MAX = 100.0
+
+METHOD = "nearest"  # "nearest" or "idw"
+NEIGHBOURS = 4      # idw: number of calibration points that are interpolated
+POWER = 2           # idw: weight = 1 / distance ** POWER
+
+
+def normalize(temperature, humidity):
+    return ((temperature - T_MIN) / (T_MAX - T_MIN), (humidity - H_MIN) / (H_MAX - H_MIN))
+
+
+class KdTree():
+    """2-dimensional k-d tree of (coordinates, value) points."""
+
+    def __init__(self, points):
+        self.root = self.build(list(points), 0)
+
+    def build(self, points, axis):
+        if not points:
+            return None
+        points.sort(key=lambda point: point[0][axis])
+        median = len(points) // 2
+        return (points[median], axis, self.build(points[:median], 1 - axis), self.build(points[median + 1:], 1 - axis))
+
+    def nearest(self, coordinates, k=1):
+        """The k nearest points as list of (squared distance, value), nearest first."""
+        best = []  # heap of (-squared distance, counter, value), the farthest of the k nearest on top
+        counter = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (point, value), axis, left, right = node
+            d_sq = (point[0] - coordinates[0]) ** 2 + (point[1] - coordinates[1]) ** 2
+            if len(best) < k:
+                heapq.heappush(best, (-d_sq, counter, value))
+            elif d_sq < -best[0][0]:
+                heapq.heapreplace(best, (-d_sq, counter, value))
+            counter += 1
+            delta = coordinates[axis] - point[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            if (len(best) < k) or (delta * delta < -best[0][0]):
+                stack.append(far)  # the other side may contain nearer points
+            stack.append(near)  # searched first (LIFO)
+        return [(-d_sq, value) for d_sq, _, value in sorted(best, reverse=True)]
+
+
+class Calibration():
+    def __init__(self, offsets, method=METHOD, neighbours=NEIGHBOURS, power=POWER):
+        """offsets as in DHT22.json: {temperature: {humidity: {"temperature": offset, "humidity": offset}}}"""
+        assert method in ["nearest", "idw"]
+        self.method = method
+        self.neighbours = neighbours
+        self.power = power
+        points = []
+        for t in offsets:
+            for h in offsets[t]:
+                offset = offsets[t][h]
+                points.append((normalize(float(t), float(h)), (offset["temperature"], offset["humidity"])))
+        self.size = len(points)
+        self.tree = KdTree(points)
+
+    def __len__(self):
+        return self.size
+
+    def get_offset(self, temperature, humidity):
+        """(temperature offset, humidity offset), (0.0, 0.0) without calibration points."""
+        if not self.size:
+            return 0.0, 0.0
+        coordinates = normalize(temperature, humidity)
+        if self.method == "nearest":
+            return self.tree.nearest(coordinates)[0][1]
+
+        neighbours = self.tree.nearest(coordinates, self.neighbours)
+        if neighbours[0][0] == 0.0:
+            return neighbours[0][1]  # exactly on a calibration point
+        sum_w = 0.0
+        sum_t = 0.0
+        sum_h = 0.0
+        for d_sq, (t_offset, h_offset) in neighbours:
+            w = 1.0 / math.pow(d_sq, self.power / 2)
+            sum_w += w
+            sum_t += w * t_offset
+            sum_h += w * h_offset
+        return sum_t / sum_w, sum_h / sum_w
+
+
+def main():
+    import json
+    import random
+    import time
+
+    with open("DHT22.json") as f:
+        config = json.load(f)
+
+    for key in config:
+        nearest = Calibration(config[key]["offset"])
+        idw = Calibration(config[key]["offset"], method="idw")
+        print(key, len(nearest), "calibration points")
+        for t, h in [(5.0, 80.0), (10.0, 65.0), (15.0, 60.0)]:
+            print("    {:5.1f}°C {:5.1f}%  nearest {:+.2f}°C {:+.2f}%  idw {:+.2f}°C {:+.2f}%".format(t, h, *nearest.get_offset(t, h), *idw.get_offset(t, h)))
+
+    # brute force check of the k-d tree
+    points = [((random.random(), random.random()), i) for i in range(1000)]
+    tree = KdTree(points)
+    start = time.perf_counter()
+    for _ in range(1000):
+        c = (random.random(), random.random())
+        expected = sorted((p[0] - c[0]) ** 2 + (p[1] - c[1]) ** 2 for p, _ in points)[:4]
+        assert [d_sq for d_sq, _ in tree.nearest(c, 4)] == expected
+    print("k-d tree ok, {:.1f} ms per check".format((time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    main()
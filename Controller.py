@@ -6,21 +6,22 @@ The controller receives the input, optionally validates it and then passes the i
 
 Responsibility:
 - Collects the environmental data of the RD200, the DHT22, and the DS18B20 sensors and forwards it to the model.
+
+Architecture:
+- the sensors are driven by jobs of the shared Scheduler, the controller has no thread of its own
+- AsyncRuntime drives the sensors from coroutines instead, see start(scheduled=False)
 """
 
 
-import threading
 import time
 from RD200 import RD200
 from Dewpoint import Dewpoint
 from DS18B20 import DS18B20
 
 
-class Controller(threading.Thread):
+class Controller():
     def __init__(self, model):
-        threading.Thread.__init__(self)
         self.model = model
-        self.should_stop = threading.Event() # create an unset event on init
         self.RD200 = RD200(self.on_update_RD200)
         self.DHT22 = Dewpoint(self.on_update_DHT22)
         self.DS18B20 = DS18B20(self.on_update_DS18B20)
@@ -34,18 +35,18 @@ class Controller(threading.Thread):
     def on_update_DS18B20(self, averaged):
         self.model.on_update_air_stream_temperatures(averaged)
 
-    def run(self):
-        self.RD200.start()
-        self.DHT22.start()
-        self.DS18B20.start()
-        while not self.should_stop.is_set():
-            time.sleep(1)
+    def start(self, scheduled=True):
+        """scheduled=False: the sensors are not read by jobs of the Scheduler, the caller drives the reads (i.e. AsyncRuntime)"""
+        if scheduled:
+            self.RD200.start()
+        self.DHT22.start(scheduled)
+        if scheduled:
+            self.DS18B20.start()
 
     def stop(self):
         self.RD200.stop()
         self.DHT22.stop()
         self.DS18B20.stop()
-        self.should_stop.set()
 
 
 def main():
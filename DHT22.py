@@ -8,26 +8,50 @@ Responsibility:
 - for each DHT22 sensor:
 -- cyclically read the sensor every READ_TICK seconds
 -- add sensor specific offsets to the raw raw temparature and relative humidity data
+  (nearest calibration point or interpolated between the nearest calibration points, see Calibration)
 -- in case of read error for a sensor, immediate retries lead to invalid data, thus no immediate retries
 -- in case all retries failed, set an error flag
 - a callback is called every READ_TICK seconds with the data as dictionary
+- parallel mode: the sensors are read concurrently, a sensor that is not read within READ_DEADLINE seconds
+  is marked as error, thus one flaky sensor does not delay the others
 
 Architecture:
-- excuted in a timer
+- excuted by the shared Scheduler every READ_TICK seconds, aligned to the wall clock; with scheduled=False the caller
+  drives the reads with update_data or capture_data (i.e. AsyncRuntime)
 - the caller registers a callback uppon instantiation
+- parallel mode: one worker thread per sensor (pin), the scheduler job waits for the workers until the deadline;
+  a sensor whose read of the previous tick is still running is not read again but marked as error;
+  a read that finishes after the deadline is dropped, the tick already reported the sensor as error
+  and counted it as failure in the health
+- exit waits for the running capture and reads before the devices are released
+- the devices are created by create_device(key, pin), default are adafruit_dht devices,
+  SimulatedDHT22 provides simulated devices to test without GPIO
 - main is for calibration and demonstration
 """
 
-from TimeSyncedTimer import TimeSyncedTimer
-import math
+from Scheduler import get_scheduler
+from Calibration import Calibration
+from SensorHealth import SensorHealth
 import time
 import json
-import board
-import adafruit_dht
+import threading
+import random
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone
+try:
+    import board
+    import adafruit_dht
+except ImportError:  # no GPIO, i.e. simulated devices on a PC
+    board = None
+    adafruit_dht = None
 
 
 READ_TICK = 20  # read every n seconds
+READ_DEADLINE = 10.0  # parallel mode: seconds after the start of a tick, sensors not read by then are marked as error
+READ_TRIES = 3
+RETRY_DELAY_MIN = 2.0  # seconds, the sensor needs 2 seconds between two transfers
+RETRY_DELAY_MAX = 4.0
+CALIBRATION_METHOD = "nearest"  # "nearest" or "idw", see Calibration
 CONFIG_FILE = r"DHT22.json"
 
 
@@ -65,11 +89,19 @@ def id2pin(id):
     return lookup[id]  # explode if not found
 
 
+def create_adafruit_device(key, pin):
+    if adafruit_dht is None:
+        raise ImportError("adafruit_dht is not installed, use simulated devices (SimulatedDHT22)")
+    return adafruit_dht.DHT22(id2pin(pin))
+
+
 class DHT22():
-    def __init__(self, callback, offset_correction=True, verbose=False):
+    def __init__(self, callback, offset_correction=True, verbose=False, parallel=True, deadline=READ_DEADLINE, create_device=create_adafruit_device, calibration_method=CALIBRATION_METHOD, scheduled=True):
         self.callback = callback
         self.offset_correction = offset_correction
         self.verbose = verbose
+        self.parallel = parallel
+        self.deadline = deadline
         with open(CONFIG_FILE) as f:
             self.config = json.load(f)
 
@@ -78,43 +110,34 @@ class DHT22():
             for temperature in self.config[key]["offset"]:
                 self.config[key]["offset"][temperature] = {float(k): v for k, v in self.config[key]["offset"][temperature].items()}
 
+        # compile the offsets once, see Calibration
+        self.calibration = {}
+        for key in self.config:
+            if "offset" in self.config[key]:
+                self.calibration[key] = Calibration(self.config[key]["offset"], method=calibration_method)
+
         # Initial the dht devices, with data pins connected to:
         self.dhtDevice = {}
         for key in self.config:
-            self.dhtDevice[key] = adafruit_dht.DHT22(id2pin(self.config[key]["pin"]))
+            self.dhtDevice[key] = create_device(key, self.config[key]["pin"])
 
-        self.timer = TimeSyncedTimer(READ_TICK, self.update_data)
-        self.timer.start()
+        self.health = {key: SensorHealth(key) for key in self.dhtDevice}
+        self.executor = ThreadPoolExecutor(max_workers=len(self.dhtDevice), thread_name_prefix="DHT22")
+        self.pending = {}  # key -> future of a read that is still running
+        self.capture_lock = threading.Lock()  # exit waits for a running capture
+        self.closed = False
 
-    def get_offset(self, key, temperature, humidity):
-        # temperature range -40 °C .. + 80 °C
-        # humidity range: 0% .. 100%
-        # temperature normalization: t_normalized = (temperature + 40) / (80 - -40) = (temperature + 40) / 120
-        # humidity normalization:    h_normalized = (humidity - 0 ) / (100 - 0) = humidity / 100
+        self.job = None
+        if scheduled:
+            self.job = get_scheduler().every(READ_TICK, self.update_data, aligned=True)
 
+    def get_offset(self, key, temperature, humidity):
         t_offset = 0.0
         h_offset = 0.0
 
-        if (key in self.config) and ("offset" in self.config[key]):
-            if len(self.config[key]["offset"]):
-                t_delta = +80 - (-40)  # maximum temperature delta
-                h_delta = 100 - 0    # maximum humidity delta
-                max_distance = math.sqrt((t_delta * t_delta) + (h_delta * h_delta))
-                t_index = None
-                h_index = None
-
-                for t in self.config[key]["offset"]:
-                    for h in self.config[key]["offset"][t]:
-                        t_delta = t - temperature
-                        h_delta = h - humidity
-                        distance = math.sqrt((t_delta * t_delta) + (h_delta * h_delta))
-                        if max_distance >= distance:
-                            max_distance = distance
-                            t_index = t
-                            h_index = h
-                if t_index is not None:
-                    t_offset = self.config[key]["offset"][t_index][h_index]["temperature"]
-                    h_offset = self.config[key]["offset"][t_index][h_index]["humidity"]
+        if key in self.calibration:
+            if len(self.calibration[key]):
+                t_offset, h_offset = self.calibration[key].get_offset(temperature, humidity)
             else:
                 print("ERROR: no offsets available")
                 pass
@@ -123,44 +146,120 @@ class DHT22():
             pass  # no data available, keep default
         return t_offset, h_offset
 
-    def update_data(self):
+    def read_sensor(self, key, deadline=None):
+        """deadline: monotonic time, no retry is started that would start after it"""
+        data, error, latency = self.read_device(key, deadline)
+        self.record_health(key, data, error, latency)
+        return data
+
+    def read_device(self, key, deadline=None):
+        """reads without touching the health, returns (data, error, latency)"""
+        start = time.monotonic()
         data = {}
+        error = None
+        try_again = True
+        tries = 0
+        while try_again:
+            try_again = False
+            tries += 1
+            try:
+                data["temperature"] = self.dhtDevice[key].temperature
+                data["humidity"] = self.dhtDevice[key].humidity
+                if (0.0 == data["temperature"]) and (0.0 == data["humidity"]):
+                    print(f"Nonsense data, most likely [0x00, 0x00, 0x00, 0x00, 0x00] has been 'received' from a non present sensor at '{key}'")
+                    raise Exception(f"Nonsense data, most likely [0x00, 0x00, 0x00, 0x00, 0x00] has been 'received' from a non present sensor at '{key}'")
+                if (-40.0 > data["temperature"]) or (+45 < data["temperature"]):
+                    print(f"temperature {data['temperature']} is out of range for sensor at '{key}'")
+                    raise Exception(f"temperature {data['temperature']} is out of range for sensor at '{key}'")
+                if self.verbose:
+                    print("{:18.7f} {:3s} {:5.2f}°C {:5.2f}%".format(time.time(), key, data["temperature"], data["humidity"]))
+                if self.offset_correction:
+                    t_offset, h_offset = self.get_offset(key, data["temperature"], data["humidity"])
+                    data["temperature"] += t_offset
+                    data["humidity"] += h_offset
+                data["utc"] = datetime.now(timezone.utc)
+                data["error"] = False
+            except Exception as e:
+                # Errors happen fairly often, DHT's are hard to read, ensure the data is set to invalud
+                data = {"temperature": None, "humidity": None, "utc": None, "error": True}
+                error = e
+                if ("Try again" in str(e)) and (tries < READ_TRIES):
+                    delay = random.uniform(RETRY_DELAY_MIN, RETRY_DELAY_MAX)
+                    if (deadline is None) or (time.monotonic() + delay < deadline):
+                        try_again = True
+                        time.sleep(delay)
+                if self.verbose:
+                    print(key, e)
+
+        return data, error, time.monotonic() - start
+
+    def record_health(self, key, data, error, latency):
+        if data["error"]:
+            self.health[key].failure(error, latency)
+        else:
+            self.health[key].success(latency)
+
+    def capture_data(self):
+        with self.capture_lock:
+            if self.closed:  # a tick that was already dispatched when exit was called
+                return {key: {"temperature": None, "humidity": None, "utc": None, "error": True} for key in self.dhtDevice}
+            return self.capture()
+
+    def capture(self):
+        data = {}
+        deadline = time.monotonic() + self.deadline
+        keys = []  # sensors to read in this tick
         for key in self.dhtDevice:
-            data[key] = {}
-            try_again = True
-            tries = 0
-            while try_again:
-                try_again = False
-                tries += 1
-                try:
-                    data[key]["temperature"] = self.dhtDevice[key].temperature
-                    data[key]["humidity"] = self.dhtDevice[key].humidity
-                    if (0.0 == data[key]["temperature"]) and (0.0 == data[key]["humidity"]):
-                        print(f"Nonsense data, most likely [0x00, 0x00, 0x00, 0x00, 0x00] has been 'received' from a non present sensor at '{key}'")
-                        raise Exception(f"Nonsense data, most likely [0x00, 0x00, 0x00, 0x00, 0x00] has been 'received' from a non present sensor at '{key}'")
-                    if (-40.0 > data[key]["temperature"]) or (+45 < data[key]["temperature"]):
-                        print(f"temperature {data[key]['temperature']} is out of range for sensor at '{key}'")
-                        raise Exception(f"temperature {data[key]['temperature']} is out of range for sensor at '{key}'")
+            if self.health[key].should_read():
+                keys.append(key)
+            elif self.verbose:
+                print(key, "is not read, backoff after {} failed reads".format(self.health[key].consecutive_failures))
+
+        if self.parallel:
+            for key in list(self.pending):
+                if self.pending[key].done():
+                    del self.pending[key]  # late result of a previous tick, outdated, dropped
+            futures = {}
+            for key in keys:
+                if key in self.pending:
                     if self.verbose:
-                        print("{:18.7f} {:3s} {:5.2f}°C {:5.2f}%".format(time.time(), key, data[key]["temperature"], data[key]["humidity"]))
-                    if self.offset_correction:
-                        t_offset, h_offset = self.get_offset(key, data[key]["temperature"], data[key]["humidity"])
-                        data[key]["temperature"] += t_offset
-                        data[key]["humidity"] += h_offset
-                    data[key]["utc"] = datetime.now(timezone.utc)
-                    data[key]["error"] = False
-                except Exception as e:
-                    # Errors happen fairly often, DHT's are hard to read, ensure the data is set to invalud
+                        print(key, "read of a previous tick is still running")
+                else:
+                    futures[key] = self.executor.submit(self.read_device, key, deadline)
+            wait(futures.values(), timeout=self.deadline)
+            for key in self.dhtDevice:
+                future = futures.get(key)
+                if (future is not None) and future.done():
+                    data[key], error, latency = future.result()
+                    self.record_health(key, data[key], error, latency)
+                else:
+                    if future is not None:
+                        if self.verbose:
+                            print(key, "missed the deadline of {} s".format(self.deadline))
+                        self.health[key].failure(TimeoutError("missed the deadline of {} s".format(self.deadline)), self.deadline)
+                        self.pending[key] = future
                     data[key] = {"temperature": None, "humidity": None, "utc": None, "error": True}
-                    if ("Try again" in str(e)) and (tries < 3):
-                        try_again = True
-                    if self.verbose:
-                        print(key, e)
+        else:
+            for key in self.dhtDevice:
+                if key in keys:
+                    data[key] = self.read_sensor(key, deadline)
+                else:
+                    data[key] = {"temperature": None, "humidity": None, "utc": None, "error": True}
+        return data
+
+    def update_data(self):
+        self.callback(self.capture_data())
 
-        self.callback(data)
+    def get_health(self):
+        return {key: self.health[key].get_stats() for key in self.health}
 
     def exit(self):
-        self.timer.cancel()
+        if self.job is not None:
+            self.job.cancel()
+        with self.capture_lock:
+            self.closed = True
+            # reads still running after their deadline hold the devices, wait for them before the release
+            self.executor.shutdown(wait=True, cancel_futures=True)
         for key in self.dhtDevice:
             self.dhtDevice[key].exit()
 
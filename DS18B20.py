@@ -12,16 +12,25 @@ The sensors share one common bus. They are connected to
 - 3.3V   (RPi header pin 1 or 17)
 - GPIO_4 (RPi header pin 7)
 - A 4.7k pullup resistor is connected between GPIO_4 and 3.3V.
-One trunaround time to capture all 5 sensors is about 5 seconds.
+One trunaround time to capture all 5 sensors is about 5 seconds when the sensors are converted one after the other.
+With the bulk read of w1-therm all sensors convert simultaneously, one turnaround takes about one conversion time (750 ms).
 
 Responsibility:
 - for each DS18B20 sensor
--- calculate a moving average for one minute for the temperature in °C
+-- calculate a moving average for one minute (or the given window) for the temperature in °C
 - a callback is called on minute change to announce the averaged values of the last minute
 
 Architecture:
 - uses data provided in the file system that is provided by the modules w1-gpio in cooperation with w1-therm
-- action is driven by ...
+- if the bus master provides therm_bulk_read, one simultaneous conversion is triggered and the per sensor
+  temperature files are read, otherwise (older kernels) each sensor is converted by reading its w1_slave file
+- FakeW1 provides a fake file system tree to run without the 1-wire bus
+- each sensor is read by its own worker within READ_BUDGET seconds and at most READ_RETRIES reads with a failed
+  CRC check, the tick waits at most TICK_DEADLINE seconds; thus one bad sensor does not stall the others
+- a sensor whose read of the previous tick is still running is not read again, dead sensors are tried again
+  after a backoff (see SensorHealth); latency and CRC failures per sensor are provided by get_stats()
+- uses RingBuffer for the moving average, O(1) per sample independent of the window size
+- action is driven by the shared Scheduler every READ_TICK seconds, aligned to the wall clock
 - the caller registers a callback uppon instantiation
 - main is for demonstration
 
@@ -29,13 +38,16 @@ Model responsibility:
 - The "Fortluft" temperature is relevant to judge whether the heat exchanger is about to freeze. If so, the heater is to be enabled.
 """
 
-from TimeSyncedTimer import TimeSyncedTimer
+from Scheduler import get_scheduler
 import os
 #import glob
 import time
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone
-from Dewpoint import calc_avg
+from RingBuffer import RingBuffer
+from SensorHealth import SensorHealth
 
 #os.system('modprobe w1-gpio')
 #os.system('modprobe w1-therm')
@@ -43,22 +55,65 @@ from Dewpoint import calc_avg
 
 READ_TICK = 20                 # read every n seconds
 assert(0 == (60 % READ_TICK))  # ensure the seconds of a minute can be evenly divided by the seconds between two reads
-NUM_SAMPLES = 60 // READ_TICK  # number of samples regarded for averaging
 
 CONFIG_FILE = r"DS18B20.json"
 
 DEVICE_DIR = '/sys/bus/w1/devices/'
+BULK_CONVERSION_TIMEOUT = 1.0  # seconds, a conversion with 12 bit resolution takes 750 ms
+BULK_POLL_INTERVAL = 0.05      # seconds
+READ_BUDGET = 3.0              # seconds per sensor, no further retry after this time; a conversion takes 750 ms
+READ_RETRIES = 3               # reads of w1_slave with a failed CRC check
+TICK_DEADLINE = 10.0           # seconds, sensors not read by then are marked as error
 
 
 class DS18B20():
-    def __init__(self, on_update, verbose=False):
+    def __init__(self, on_update, verbose=False, window=60, device_dir=DEVICE_DIR):
+        assert 0 == (window % READ_TICK)
         self.on_update = on_update
         self.verbose = verbose
+        self.device_dir = device_dir
+        self.bulk_read_file = self.find_bulk_read_file()
+        self.num_samples = window // READ_TICK  # number of samples regarded for averaging
         with open(CONFIG_FILE) as f:
             self.config = json.load(f)
         self.raw_data = {}
         self.averaged = {}
-        self.timer = TimeSyncedTimer(READ_TICK, self.update_data)
+        self.lock = threading.Lock()
+        self.crc_failures = {}  # sensor -> number of failed CRC checks
+        self.health = {sensor: SensorHealth(self.config[sensor]["short"]) for sensor in self.config}
+        self.executor = ThreadPoolExecutor(max_workers=len(self.config), thread_name_prefix="DS18B20")
+        self.pending = {}  # sensor -> future of a read that is still running
+        self.job = None
+
+    def find_bulk_read_file(self):
+        if os.path.isdir(self.device_dir):
+            for name in sorted(os.listdir(self.device_dir)):
+                path = os.path.join(self.device_dir, name, "therm_bulk_read")
+                if name.startswith("w1_bus_master") and os.path.isfile(path):
+                    return path
+        return None
+
+    def bulk_convert(self):
+        """
+        Trigger a simultaneous conversion of all sensors of the bus, returns True as soon as the conversion is done.
+        therm_bulk_read reads -1 while the conversion is in progress.
+        """
+        with open(self.bulk_read_file, "w") as f:
+            f.write("trigger\n")
+        timeout = time.monotonic() + BULK_CONVERSION_TIMEOUT
+        while True:
+            with open(self.bulk_read_file) as f:
+                status = f.read().strip()
+            if status != "-1":
+                return True
+            if time.monotonic() > timeout:
+                return False
+            time.sleep(BULK_POLL_INTERVAL)
+
+    def read_temperature_file(self, temperature_file):
+        """Temperature of the last conversion in °C, the kernel reports an error if the CRC failed."""
+        with open(temperature_file) as f:
+            return int(f.read().strip()) / 1000.0
 
     def read_temp_raw(self, device_file):
         f = open(device_file, 'r')
@@ -66,11 +121,20 @@ class DS18B20():
         f.close()
         return lines
 
-    def read_temp(self, device_file):
+    def read_temp(self, device_file, sensor=None, timeout=None):
+        """
+        The CRC check of w1-therm fails from time to time, the file is read again up to READ_RETRIES times,
+        but not after the timeout (monotonic time). A sensor with a permanent CRC error raises an exception.
+        """
         lines = self.read_temp_raw(device_file)
+        tries = 1
         while lines[0].strip()[-3:] != 'YES':
+            self.count_crc_failure(sensor)
+            if (tries >= READ_RETRIES) or ((timeout is not None) and (time.monotonic() > timeout)):
+                raise Exception("CRC check failed {} times".format(tries))
             time.sleep(0.2)
             lines = self.read_temp_raw(device_file)
+            tries += 1
         equals_pos = lines[1].find('t=')
         if equals_pos != -1:
             temp_string = lines[1][equals_pos+2:]
@@ -78,46 +142,105 @@ class DS18B20():
             # temp_f = temp_c * 9.0 / 5.0 + 32.0
             return temp_c #, temp_f
 
+    def count_crc_failure(self, sensor):
+        with self.lock:
+            self.crc_failures[sensor] = self.crc_failures.get(sensor, 0) + 1
+
+    def read_sensor(self, sensor, bulk):
+        """Executed by a worker, reads one sensor within READ_BUDGET seconds."""
+        start = time.monotonic()
+        timeout = start + READ_BUDGET
+        device_file = os.path.join(self.device_dir, sensor, "w1_slave")
+        temperature_file = os.path.join(self.device_dir, sensor, "temperature")
+        long_name = self.config[sensor]["long"]
+        short_name = self.config[sensor]["short"]
+        try:
+            temp_c = None
+            if bulk and os.path.isfile(temperature_file):
+                try:
+                    temp_c = self.read_temperature_file(temperature_file)
+                    device_file = temperature_file
+                except Exception as e:
+                    if self.verbose:
+                        print(sensor, temperature_file, e, "reading", device_file)
+            if device_file != temperature_file:
+                temp_c = self.read_temp(device_file, sensor, timeout)
+            data = {
+                "temperature": temp_c,
+                "error": False,
+            }
+            self.health[sensor].success(time.monotonic() - start)
+            if self.verbose:
+                print(sensor, device_file, os.path.isfile(device_file), short_name, long_name, temp_c)
+        except Exception as e:
+            data = {
+                "temperature": None,
+                "error": True,
+            }
+            self.health[sensor].failure(e, time.monotonic() - start)
+            if self.verbose:
+                print(sensor, device_file, os.path.isfile(device_file), short_name, long_name, e)
+        return data
+
     def capture_data(self):
         data = {}
-        for sensor in self.config:
-            device_file = os.path.join(DEVICE_DIR, sensor, "w1_slave")
-            long_name = self.config[sensor]["long"]
-            short_name = self.config[sensor]["short"]
+        deadline = time.monotonic() + TICK_DEADLINE
+        bulk = False
+        if self.bulk_read_file is not None:
             try:
-                temp_c = self.read_temp(device_file)
-                data[short_name] = {
-                    "temperature": temp_c,
-                    "error": False,
-                }
-                if self.verbose:
-                    print(sensor, device_file, os.path.isfile(device_file), short_name, long_name, temp_c)
+                bulk = self.bulk_convert()
             except Exception as e:
+                print("bulk conversion failed, reading the sensors one by one:", e)
+
+        for sensor in list(self.pending):
+            if self.pending[sensor].done():
+                del self.pending[sensor]  # late result of a previous tick, outdated
+        futures = {}
+        for sensor in self.config:
+            if (sensor not in self.pending) and self.health[sensor].should_read():
+                futures[sensor] = self.executor.submit(self.read_sensor, sensor, bulk)
+            elif self.verbose:
+                print(sensor, self.config[sensor]["short"], "is not read, previous read still running or backoff")
+        wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+        for sensor in self.config:
+            short_name = self.config[sensor]["short"]
+            future = futures.get(sensor)
+            if (future is not None) and future.done():
+                data[short_name] = future.result()
+            else:
+                if future is not None:
+                    print(sensor, short_name, "missed the deadline of the tick")
+                    self.pending[sensor] = future
                 data[short_name] = {
                     "temperature": None,
                     "error": True,
                 }
-                if self.verbose:
-                    print(sensor, device_file, os.path.isfile(device_file), short_name, long_name, e)
         return data
 
+    def get_stats(self):
+        """Health, latency, and CRC failures per sensor, by short name."""
+        stats = {}
+        with self.lock:
+            crc_failures = dict(self.crc_failures)
+        for sensor in self.config:
+            stats[self.config[sensor]["short"]] = dict(self.health[sensor].get_stats(), crc_failures=crc_failures.get(sensor, 0))
+        return stats
+
     def average_data(self, data):
         for key in data:
             if key not in self.averaged:
                 self.averaged[key] = {}
             if key not in self.raw_data:
                 self.raw_data[key] = {
-                    "temperature": [None] * NUM_SAMPLES,
+                    "temperature": RingBuffer(self.num_samples),
                 }
             if not data[key]["error"]:
-                self.raw_data[key]["temperature"].append(data[key]["temperature"])
+                self.raw_data[key]["temperature"].push(data[key]["temperature"])
             else:
-                self.raw_data[key]["temperature"].append(None)
-            self.raw_data[key]["temperature"].pop(0)
-            assert NUM_SAMPLES == len(self.raw_data[key]["temperature"])
+                self.raw_data[key]["temperature"].push(None)
 
         for key in self.raw_data:
-            temperature = calc_avg(self.raw_data[key]["temperature"])
+            temperature = self.raw_data[key]["temperature"].mean()
             if (temperature is not None):
                 self.averaged[key]["temperature"] = round(temperature, 1)
                 self.averaged[key]["error"] = False
@@ -131,10 +254,12 @@ class DS18B20():
         self.on_update(self.averaged)
 
     def start(self):
-        self.timer.start()
+        self.job = get_scheduler().every(READ_TICK, self.update_data, aligned=True)
 
     def stop(self):
-        self.timer.cancel()
+        if self.job is not None:
+            self.job.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 
 def demo(minutes):
@@ -2,26 +2,125 @@
 
 import os
 import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone
-from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client import InfluxDBClient, WritePrecision, BucketRetentionRules
 from influxdb_client.client.write_api import SYNCHRONOUS
-from Formulas import get_lim, get_absolute_humidity
+import numpy as np
+from Formulas import get_lim_array, get_absolute_humidity_array
+from LineProtocol import line_DHT22, line_DS18B20, line_RD200, line_ventilation, line_switches, LineBuffer
+from BatchWriter import BatchWriter
+from WriteAheadLog import WriteAheadLog, WalReplayer
+from Rollup import Rollup, LEVELS as ROLLUP_LEVELS, FIELDS as ROLLUP_FIELDS
+from Storage import Storage, TOKEN_FILE
+
+
+POINTS_FILE = r"/home/taupunkt/points.txt"  # legacy backup file, migrated into the write-ahead log on startup
+WAL_DIR = r"/home/taupunkt/wal"
+ROLLUP_STATE_FILE = r"/home/taupunkt/rollup-state.json"  # open rollup windows, continued after a restart
+EXPORT_FILE = r"/home/taupunkt/points-export.txt"
+EXPORT_CHECKPOINT_FILE = r"/home/taupunkt/points-export.checkpoint.json"
+EXPORT_WINDOW = 24 * 60 * 60  # seconds of history queried at once, bounds the memory needed for an export
 
+MEASUREMENTS = ["DHT22", "DS18B20", "RD200", "ventilation", "switches"]
 
-POINTS_FILE = r"/home/taupunkt/points.txt"
-EXPORT_FILE = r"/home/taupunkt/points-export.txt"
+IMPORT_BATCH_SIZE = 5000     # lines per write request
+IMPORT_WRITERS = 2           # number of parallel write requests
+IMPORT_RETRIES = 3           # retries per batch before it is handed over to the write-ahead log
+IMPORT_PROGRESS_INTERVAL = 10.0  # seconds between two progress reports
+
+BUCKET_MARKER = "#"  # a record "#<bucket> <line>" is written into <bucket> instead of the default bucket (# is a comment in line protocol)
+
+
+class PartialWriteError(Exception):
+    """Some buckets could not be written, records are the records of these buckets (with their bucket markers)."""
+    def __init__(self, error, records):
+        Exception.__init__(self, str(error))
+        self.records = records
+        self.status = getattr(error, "status", None)  # HTTP status of the first error, see WriteAheadLog.is_permanent
+
+
+def now():
+    """Current time as integer seconds, the timestamp of the points."""
+    return int(time.time())
+
+
+def rfc3339(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def enhance_DHT22(records):
+    """
+    Enhance the values of DHT22 records (old format and new format) in place:
+    rH is taken from humidity in the old format, aH and lim are (re)calculated for all records at once.
+    """
+    for values in records:
+        # old format
+        humidity = values.get("humidity")
+
+        # new format
+        rH = values.get("rH")
+
+        # select the right one
+        if (rH is None) and (humidity is not None):
+            values["rH"] = humidity
+
+    if records:
+        temperatures = np.array([np.nan if values.get("temperature") is None else values["temperature"] for values in records], dtype=float)
+        rHs = np.array([np.nan if values.get("rH") is None else values["rH"] for values in records], dtype=float)
+        lims = get_lim_array(temperatures)
+        aHs = get_absolute_humidity_array(temperatures, rHs)
+        for values, lim, aH in zip(records, lims.tolist(), aHs.tolist()):
+            values["lim"] = None if lim != lim else lim  # NaN -> None
+            values["aH"] = None if aH != aH else aH
 
 
-def x2float(x):
-    try:
-        x = float(x)
-    except:
-        x = float("NaN")
-    return x
+def export_line_DHT22(values):
+    """values have been enhanced with enhance_DHT22()"""
+    return line_DHT22(values["key"], values.get("temperature"), values.get("rH"), values.get("dewpoint"), values.get("aH"), values.get("lim"), values.get("error"), int(values["_time"].timestamp()))
 
 
-class Database():
-    def __init__(self, url="http://localhost:8086", org="taupunkt_org", bucket="taupunkt_bucket", token_file=r"/home/taupunkt/influxdb.python.token"):
+def export_line_DS18B20(values):
+    return line_DS18B20(values["key"], values.get("temperature"), values.get("error"), int(values["_time"].timestamp()))
+
+
+def export_line_RD200(values):
+    return line_RD200(values.get("radon"), values.get("error"), int(values["_time"].timestamp()))
+
+
+def export_line_ventilation(values):
+    return line_ventilation({
+        "radon_request": values.get("radon_request"),
+        "humidity_request": values.get("humidity_request"),
+        "heater_request": values.get("heater_request"),
+        "dewpoint_granted": values.get("dewpoint_granted"),
+        "internal_temp_granted": values.get("internal_temp_granted"),
+        "external_temp_granted": values.get("external_temp_granted"),
+    }, int(values["_time"].timestamp()))
+
+
+def export_line_switches(values):
+    return line_switches({
+        "out_fan_on": values.get("out_fan_on"),
+        "in_fan_on": values.get("in_fan_on"),
+        "heater_on": values.get("heater_on"),
+    }, int(values["_time"].timestamp()))
+
+
+EXPORT_LINE = {
+    "DHT22": export_line_DHT22,
+    "DS18B20": export_line_DS18B20,
+    "RD200": export_line_RD200,
+    "ventilation": export_line_ventilation,
+    "switches": export_line_switches,
+}
+
+
+class Database(Storage):
+    def __init__(self, url="http://localhost:8086", org="taupunkt_org", bucket="taupunkt_bucket", token_file=TOKEN_FILE, wal_dir=WAL_DIR):
         self.url = url
         self.org = org
         self.bucket = bucket
@@ -35,268 +134,347 @@ class Database():
         self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
         self.query_api = self.client.query_api()
 
-    def write_DHT22(self, key, temperature, rH, dewpoint, aH, lim, error):
-        point = (
-            Point("DHT22")
-            .tag("key", key)
-            .field("temperature", x2float(temperature))
-            .field("rH", x2float(rH))
-            .field("dewpoint", x2float(dewpoint))
-            .field("aH", x2float(aH))
-            .field("lim", x2float(lim))
-            .field("error", True if error else False)
-            .time(datetime.now(timezone.utc).replace(microsecond=0))
-        )
-        self.write_point(point=point, time_precission="s")
+        # points that could not be written are kept in the write-ahead log and replayed in the background
+        self.wal = WriteAheadLog(wal_dir)
+        self.migrate_points_file()
+        self.replayer = WalReplayer(self.wal, self.write_records)
+        self.replayer.start()
+
+        # the SYNCHRONOUS write_api is only used from the background threads
+        self.writer = BatchWriter(self.write_points, self.backup_points)
+        self.writer.start()
+
+        # 1 minute, 1 hour, and 1 day aggregates of the sensor values, each level in its own bucket
+        # the buckets are created on the first write of a rollup, and again after a write failed with "not found"
+        self.rollup_buckets = {name: "{}_{}".format(self.bucket, name) for name, _, _ in ROLLUP_LEVELS}
+        self.rollup_buckets_ready = False
+        self.bucket_lock = threading.Lock()
+        self.rollup = Rollup(self.write_rollup, state_file=ROLLUP_STATE_FILE)
+
+    def create_rollup_buckets(self):
+        """Create the missing rollup buckets, raises in case of errors (i.e. InfluxDB not running)."""
+        with self.bucket_lock:
+            if self.rollup_buckets_ready:
+                return
+            buckets_api = self.client.buckets_api()
+            for name, _, retention in ROLLUP_LEVELS:
+                bucket = self.rollup_buckets[name]
+                if buckets_api.find_bucket_by_name(bucket) is None:
+                    buckets_api.create_bucket(
+                        bucket_name=bucket,
+                        retention_rules=BucketRetentionRules(type="expire", every_seconds=retention),
+                        org=self.org,
+                    )
+                    print("bucket '{}' created".format(bucket))
+            self.rollup_buckets_ready = True
+
+    def write_rollup(self, name, line):
+        self.write_point("{}{} {}".format(BUCKET_MARKER, self.rollup_buckets[name], line))
+
+    def close(self):
+        """Flush the queued points and stop the background threads."""
+        self.rollup.save()  # the open windows are continued after the restart
+        self.writer.stop()
+        self.replayer.stop()
+        self.wal.close()
+        self.client.close()
+
+    def get_stats(self):
+        """Counters of the batch writer, i.e. queue depth and flush latency."""
+        return self.writer.get_stats()
+
+    def write_DHT22(self, key, temperature, rH, dewpoint, aH, lim, error, timestamp=None):
+        if timestamp is None:
+            timestamp = now()
+        self.write_point(line_DHT22(key, temperature, rH, dewpoint, aH, lim, error, timestamp))
+        self.rollup.add("DHT22", key, {"temperature": temperature, "rH": rH, "dewpoint": dewpoint, "aH": aH}, timestamp)
 
     def export_DHT22(self):
-        format = "%Y-%m-%dT%H:%M:%S.%fZ"
-        start = datetime.fromtimestamp(0).strftime(format)
-        query = f'from(bucket:"taupunkt_bucket")\
-|> range(start: {start})\
-|> filter(fn:(r) => r._measurement == "DHT22")\
-|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\
-'
-        tables = self.query_api.query(query)
-        with open(EXPORT_FILE, "a") as f:
-            for table in tables:
-                for record in table.records:
-                    # old format
-                    if "humidity" in record.values:
-                        humidity = record.values["humidity"]
-                    else:
-                        humidity = None
-
-                    # new format
-                    if "rH" in record.values:
-                        rH = record.values["rH"]
-                    else:
-                        rH = None
-
-                    # select the right one
-                    if (rH is None) and (humidity is not None):
-                        rH = humidity
-
-                    temperature = record.values["temperature"]
-                    lim = None
-                    aH = None
-                    if temperature is not None:
-                        lim = get_lim(temperature)
-                        if rH is not None:
-                            aH = get_absolute_humidity(temperature, rH)
-
-                    point = '{},key={} '.format(
-                        record.values["_measurement"],
-                        record.values["key"]
-                    )
-                    if temperature is not None:
-                        point += 'temperature={},'.format(temperature)
-                    if rH is not None:
-                        point += 'rH={},'.format(rH)
-                    if record.values["dewpoint"] is not None:
-                        point += 'dewpoint={},'.format(record.values["dewpoint"])
-                    if aH is not None:
-                        point += 'aH={},'.format(aH)
-                    if lim is not None:
-                        point += 'lim={},'.format(lim)
-                    point += 'error={}'.format(True if record.values["error"] else False)
-                    point += ' {}\n'.format(int(record.values["_time"].timestamp()))
-                    f.write(point)
-
-    def write_DS18B20(self, key, temperature, error):
-        point = (
-            Point("DS18B20")
-            .tag("key", key)
-            .field("temperature", x2float(temperature))
-            .field("error", True if error else False)
-            .time(datetime.now(timezone.utc).replace(microsecond=0))
-        )
-        self.write_point(point=point, time_precission="s")
+        self.export(["DHT22"])
+
+    def write_DS18B20(self, key, temperature, error, timestamp=None):
+        if timestamp is None:
+            timestamp = now()
+        self.write_point(line_DS18B20(key, temperature, error, timestamp))
+        self.rollup.add("DS18B20", key, {"temperature": temperature}, timestamp)
 
     def export_DS18B20(self):
-        format = "%Y-%m-%dT%H:%M:%S.%fZ"
-        start = datetime.fromtimestamp(0).strftime(format)
-        query = f'from(bucket:"taupunkt_bucket")\
-|> range(start: {start})\
-|> filter(fn:(r) => r._measurement == "DS18B20")\
-|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\
-'
-        tables = self.query_api.query(query)
-        with open(EXPORT_FILE, "a") as f:
-            for table in tables:
-                for record in table.records:
-                    temperature = record.values["temperature"]
-                    point = '{},key={} '.format(
-                        record.values["_measurement"],
-                        record.values["key"]
-                    )
-                    if temperature is not None:
-                        point += 'temperature={},'.format(temperature)
-                    point += 'error={}'.format(True if record.values["error"] else False)
-                    point += ' {}\n'.format(int(record.values["_time"].timestamp()))
-                    f.write(point)
-
-    def write_RD200(self, radon, error):
-        point = (
-            Point("RD200")
-            .field("radon", x2float(radon))
-            .field("error", True if error else False)
-            .time(datetime.now(timezone.utc).replace(microsecond=0))
-        )
-        self.write_point(point=point, time_precission="m")
+        self.export(["DS18B20"])
+
+    def write_RD200(self, radon, error, timestamp=None):
+        if timestamp is None:
+            timestamp = now()
+        self.write_point(line_RD200(radon, error, timestamp))
 
     def export_RD200(self):
-        format = "%Y-%m-%dT%H:%M:%S.%fZ"
-        start = datetime.fromtimestamp(0).strftime(format)
-        query = f'from(bucket:"taupunkt_bucket")\
-|> range(start: {start})\
-|> filter(fn:(r) => r._measurement == "RD200")\
-|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\
-'
-        tables = self.query_api.query(query)
-        with open(EXPORT_FILE, "a") as f:
-            for table in tables:
-                for record in table.records:
-                    point = '{} '.format(
-                        record.values["_measurement"],
-                    )
-                    if record.values["radon"] is not None:
-                        point += 'radon={},'.format(record.values["radon"])
-                    point += 'error={}'.format(True if record.values["error"] else False)
-                    point += ' {}\n'.format(int(record.values["_time"].timestamp()))
-                    f.write(point)
-
-    def write_ventilation(self, ventilation):
-        point = (
-            Point("ventilation")
-            .field("radon_request", True if ventilation["radon_request"] else False)
-            .field("humidity_request", True if ventilation["humidity_request"] else False)
-            .field("heater_request", True if ventilation["heater_request"] else False)
-            .field("dewpoint_granted", True if ventilation["dewpoint_granted"] else False)
-            .field("internal_temp_granted", True if ventilation["internal_temp_granted"] else False)
-            .field("external_temp_granted", True if ventilation["external_temp_granted"] else False)
-            .time(datetime.now(timezone.utc).replace(microsecond=0))
-        )
-        self.write_point(point=point, time_precission="s")
+        self.export(["RD200"])
+
+    def write_ventilation(self, ventilation, timestamp=None):
+        if timestamp is None:
+            timestamp = now()
+        self.write_point(line_ventilation(ventilation, timestamp))
 
     def export_ventilation(self):
-        format = "%Y-%m-%dT%H:%M:%S.%fZ"
-        start = datetime.fromtimestamp(0).strftime(format)
-        query = f'from(bucket:"taupunkt_bucket")\
-|> range(start: {start})\
-|> filter(fn:(r) => r._measurement == "ventilation")\
-|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\
-'
-        tables = self.query_api.query(query)
-        with open(EXPORT_FILE, "a") as f:
-            for table in tables:
-                for record in table.records:
-                    point = '{} '.format(
-                        record.values["_measurement"],
-                    )
-                    point += 'radon_request={},'.format(True if record.values["radon_request"] else False)
-                    point += 'humidity_request={},'.format(True if record.values["humidity_request"] else False)
-                    point += 'heater_request={},'.format(True if record.values["heater_request"] else False)
-                    point += 'dewpoint_granted={},'.format(True if record.values["dewpoint_granted"] else False)
-                    point += 'internal_temp_granted={},'.format(True if record.values["internal_temp_granted"] else False)
-                    point += 'external_temp_granted={}'.format(True if record.values["external_temp_granted"] else False)
-                    point += ' {}\n'.format(int(record.values["_time"].timestamp()))
-                    f.write(point)
-
-    def write_switches(self, switches):
-        point = (
-            Point("switches")
-            .field("out_fan_on", True if switches["out_fan_on"] else False)
-            .field("in_fan_on", True if switches["in_fan_on"] else False)
-            .field("heater_on", True if switches["heater_on"] else False)
-            .time(datetime.now(timezone.utc).replace(microsecond=0))
-        )
-        self.write_point(point=point, time_precission="s")
+        self.export(["ventilation"])
+
+    def write_switches(self, switches, timestamp=None):
+        if timestamp is None:
+            timestamp = now()
+        self.write_point(line_switches(switches, timestamp))
 
     def export_switches(self):
-        format = "%Y-%m-%dT%H:%M:%S.%fZ"
-        start = datetime.fromtimestamp(0).strftime(format)
-        query = f'from(bucket:"taupunkt_bucket")\
-|> range(start: {start})\
-|> filter(fn:(r) => r._measurement == "switches")\
+        self.export(["switches"])
+
+    def query_recent(self, measurement, seconds, key=None):
+        key_filter = ' and r.key == "{}"'.format(key) if key is not None else ""
+        query = f'from(bucket:"{self.bucket}")\
+|> range(start: -{int(seconds)}s)\
+|> filter(fn:(r) => r._measurement == "{measurement}"{key_filter})\
 |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\
+|> drop(columns: ["_start", "_stop", "_measurement"])\
+|> group()\
+|> sort(columns: ["_time"])\
 '
-        tables = self.query_api.query(query)
-        with open(EXPORT_FILE, "a") as f:
-            for table in tables:
-                for record in table.records:
-                    point = '{} '.format(
-                        record.values["_measurement"],
-                    )
-                    point += 'out_fan_on={},'.format(True if record.values["out_fan_on"] else False)
-                    point += 'in_fan_on={}'.format(True if record.values["in_fan_on"] else False)
-                    point += 'heater_on={}'.format(True if record.values["heater_on"] else False)
-                    point += ' {}\n'.format(int(record.values["_time"].timestamp()))
-                    f.write(point)
-
-    def backup_point(self, point):
-        with open(POINTS_FILE, "a") as f:
-            f.write("{}\n".format(point))
-
-    def write_point(self, point, time_precission):
-        try:
-            self.write_api.write(bucket=self.bucket, org=self.org, record=point, write_precision=WritePrecision.S, time_precission=time_precission)
-            self.rewrite_points() # it worked, check whether there is something to rewrite
-        except Exception as e:
-            print(e)
-            self.backup_point(point)
-
-    def rewrite_point(self, point):
-        try:
-            if point.startswith("RD200"):
-                time_precission="m"
-            else:
-                time_precission="s"
-            self.write_api.write(bucket=self.bucket, org=self.org, record=point, write_precision=WritePrecision.S, time_precission=time_precission)
-            return True
-        except Exception as e:
-            print(e)
-            return False
-
-    def rewrite_points(self):
+        result = []
+        for record in self.query_api.query_stream(query):
+            values = {k: v for k, v in record.values.items() if not k.startswith("_") and k not in ("result", "table")}
+            values["time"] = int(record.values["_time"].timestamp())
+            result.append(values)
+        return result
+
+    def flux_filter(self, measurements):
+        return " or ".join('r._measurement == "{}"'.format(m) for m in measurements)
+
+    def get_first_timestamp(self, measurements):
+        """Unix timestamp of the oldest point of the given measurements, None if there is none."""
+        query = f'from(bucket:"{self.bucket}")\
+|> range(start: {rfc3339(0)})\
+|> filter(fn:(r) => {self.flux_filter(measurements)})\
+|> first()\
+|> keep(columns: ["_time"])\
+'
+        first = None
+        for record in self.query_api.query_stream(query):
+            timestamp = int(record.values["_time"].timestamp())
+            if (first is None) or (first > timestamp):
+                first = timestamp
+        return first
+
+    def stream_window(self, measurements, start, stop):
+        """Streams the pivoted records of the given measurements in the time window [start, stop) one by one."""
+        query = f'from(bucket:"{self.bucket}")\
+|> range(start: {rfc3339(start)}, stop: {rfc3339(stop)})\
+|> filter(fn:(r) => {self.flux_filter(measurements)})\
+|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\
+'
+        return self.query_api.query_stream(query)
+
+    def export(self, measurements=MEASUREMENTS, window=EXPORT_WINDOW, export_file=EXPORT_FILE, checkpoint_file=EXPORT_CHECKPOINT_FILE):
+        """
+        Export the given measurements in one pass as line protocol into export_file (appending).
+        The history is queried in windows of the given number of seconds, the records of one window are enhanced at once
+        and streamed into the file.
+        After each window a checkpoint is saved. An interrupted export with the same measurements is resumed from there.
+        """
+        checkpoint = None
+        if os.path.isfile(checkpoint_file):
+            with open(checkpoint_file) as f:
+                checkpoint = json.load(f)
+            if checkpoint["measurements"] != list(measurements):
+                checkpoint = None
+
+        if checkpoint is not None:
+            start = checkpoint["next"]
+            stop = checkpoint["stop"]
+            print("resume export of {} at {}".format(", ".join(measurements), rfc3339(start)))
+        else:
+            stop = int(datetime.now(timezone.utc).timestamp()) + 1
+            start = self.get_first_timestamp(measurements)
+            if start is None:
+                return  # nothing to export
+
+        with open(export_file, "a") as f:
+            if checkpoint is not None:
+                f.truncate(checkpoint["size"])  # drop the lines of an incomplete window
+            buffer = LineBuffer(f)
+            while start < stop:
+                end = min(start + window, stop)
+                records = [record.values for record in self.stream_window(measurements, start, end)]
+                enhance_DHT22([values for values in records if values["_measurement"] == "DHT22"])
+                for values in records:
+                    buffer.append(EXPORT_LINE[values["_measurement"]](values))
+                buffer.flush()
+                start = end
+                with open(checkpoint_file + ".tmp", "w") as f_checkpoint:
+                    json.dump({"measurements": list(measurements), "next": start, "stop": stop, "size": f.tell()}, f_checkpoint)
+                os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+        if os.path.isfile(checkpoint_file):
+            os.remove(checkpoint_file)  # export complete
+
+    def backup_points(self, points):
+        self.wal.append(points)
+
+    def migrate_points_file(self):
+        """Move the content of the legacy backup file into the write-ahead log."""
         if os.path.isfile(POINTS_FILE):
-            points = []
-            failed = []
+            records = []
             with open(POINTS_FILE, 'r') as f:
-                data = f.read().split('\n')
-                for line in data:
+                for line in f:
                     line = line.strip()
                     if line:
                         if line.endswith("000000000"):
-                            line = line[0:-9]
-                        points.append(line)
-            for point in points:
-                if not self.rewrite_point(point):
-                    failed.append(point)
-            if failed:
-                print("ERROR: These could not be written")
-                with open(POINTS_FILE, "W") as f:
-                    for point in failed:
-                        print(point)
-                        f.write("{}\n".format(point))
+                            line = line[0:-9]  # nanoseconds to seconds
+                        records.append(line)
+                        if len(records) >= 1000:
+                            self.wal.append(records)
+                            records = []
+            self.wal.append(records)
+            self.wal.sync()
+            try:
+                os.remove(POINTS_FILE)
+            except Exception as e:
+                print(e)
+
+    def write_point(self, point):
+        """Non-blocking, the point (line protocol in seconds precision) is written by the batch writer."""
+        self.writer.put(point)
+
+    def write_points(self, points):
+        """Called by the batch writer, raises in case of errors."""
+        self.write_records(points)
+        if not self.wal.is_empty():
+            self.replayer.wake() # it worked, replay what has been logged during the outage
+
+    def write_records(self, records):
+        """
+        Write line protocol records in seconds precision, grouped by bucket. Each bucket is written independently,
+        raises PartialWriteError with the records of the buckets that could not be written.
+        """
+        buckets = {self.bucket: ([], [])}  # bucket -> (lines, records)
+        for record in records:
+            if record.startswith(BUCKET_MARKER):
+                bucket, line = record[len(BUCKET_MARKER):].split(" ", 1)
+                lines, originals = buckets.setdefault(bucket, ([], []))
+                lines.append(line)
+                originals.append(record)
             else:
-                try:
-                    os.remove(POINTS_FILE)
-                except Exception as e:
-                    print(e)
-
-    def import_all(self):
-        if os.path.isfile(EXPORT_FILE):
-            with open(POINTS_FILE, "a") as f_out:
-                with open(EXPORT_FILE, 'r') as f_in:
-                    lines = f_in.readlines(1000)
-                    while lines:
-                        for line in lines:
-                            point = line.strip()
-                            if point:
-                                if not self.rewrite_point(point):
-                                    f_out.write("{}\n".format(point))
-                        lines = f_in.readlines(1000)
+                buckets[self.bucket][0].append(record)
+                buckets[self.bucket][1].append(record)
+        error = None
+        failed = []
+        for bucket, (lines, originals) in buckets.items():
+            if not lines:
+                continue
+            try:
+                if bucket != self.bucket:
+                    self.create_rollup_buckets()
+                self.write_api.write(bucket=bucket, org=self.org, record=lines, write_precision=WritePrecision.S)
+            except Exception as e:
+                if (bucket != self.bucket) and (getattr(e, "status", None) == 404):
+                    self.rollup_buckets_ready = False  # i.e. deleted meanwhile, create it again on the next write
+                if error is None:
+                    error = e
+                failed.extend(originals)
+        if failed:
+            raise PartialWriteError(error, failed)
+
+    def import_batch(self, batch, retries):
+        """Write one batch of line protocol records, retry with backoff. Returns the records that could not be written."""
+        for attempt in range(retries + 1):
+            try:
+                self.write_records(batch)
+                return []
+            except Exception as e:
+                print(e)
+                batch = getattr(e, "records", batch)  # only the buckets that failed are retried
+                if attempt < retries:
+                    time.sleep(2 ** attempt)
+        return batch
+
+    def import_all(self, batch_size=IMPORT_BATCH_SIZE, writers=IMPORT_WRITERS, retries=IMPORT_RETRIES, export_file=EXPORT_FILE):
+        """
+        Bulk import of an export file. The lines are sent in batches of batch_size lines by writers parallel requests.
+        The records of a batch that still fail after the retries are appended to the write-ahead log and replayed later.
+        """
+        stats = {"lines": 0, "batches": 0, "failed_batches": 0, "failed_lines": 0}
+        if not os.path.isfile(export_file):
+            return stats
+
+        pending = {}  # future -> batch
+        t_start = time.monotonic()
+        t_progress = t_start + IMPORT_PROGRESS_INTERVAL
+
+        def report(pending, final=False):
+            t = time.monotonic() - t_start
+            print("{} lines in {} batches ({} failed) in {:.0f} s, {:.0f} lines/s, {} batches in flight{}".format(
+                stats["lines"], stats["batches"], stats["failed_batches"], t, stats["lines"] / t if t else 0.0, len(pending), ", done" if final else ""))
+
+        def collect(futures):
+            for future in futures:
+                batch, failed = pending.pop(future), future.result()
+                stats["batches"] += 1
+                stats["lines"] += len(batch)
+                if failed:
+                    stats["failed_batches"] += 1
+                    stats["failed_lines"] += len(failed)
+                    self.wal.append(failed)
+
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            with open(export_file, 'r') as f_in:
+                batch = []
+                for line in f_in:
+                    point = line.strip()
+                    if point:
+                        batch.append(point)
+                    if len(batch) >= batch_size:
+                        if len(pending) >= 2 * writers:  # bounded memory, wait for a free writer
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            collect(done)
+                        pending[executor.submit(self.import_batch, batch, retries)] = batch
+                        batch = []
+                        if time.monotonic() >= t_progress:
+                            t_progress += IMPORT_PROGRESS_INTERVAL
+                            report(pending)
+                if batch:
+                    pending[executor.submit(self.import_batch, batch, retries)] = batch
+            done, _ = wait(pending)
+            collect(done)
+        self.wal.sync()
+        report(pending, final=True)
+        return stats
+
+    def backfill_rollups(self, window=EXPORT_WINDOW, batch_size=IMPORT_BATCH_SIZE):
+        """Build the rollups from the existing history, streamed in windows of the given number of seconds."""
+        batch = []
+        def emit(name, line):
+            batch.append("{}{} {}".format(BUCKET_MARKER, self.rollup_buckets[name], line))
+
+        def write():
+            failed = self.import_batch(batch, IMPORT_RETRIES)
+            if failed:
+                self.wal.append(failed)
+            batch.clear()
+
+        measurements = list(ROLLUP_FIELDS)
+        start = self.get_first_timestamp(measurements)
+        if start is None:
+            return  # nothing to backfill
+        stop = now() + 1
+        rollup = Rollup(emit)
+        while start < stop:
+            end = min(start + window, stop)
+            records = [record.values for record in self.stream_window(measurements, start, end)]
+            enhance_DHT22([values for values in records if values["_measurement"] == "DHT22"])  # i.e. aH of the old format
+            for values in records:
+                rollup.add(values["_measurement"], values["key"], values, int(values["_time"].timestamp()))
+                if len(batch) >= batch_size:
+                    write()
+            print("rollups until {}".format(rfc3339(end)))
+            start = end
+        rollup.flush()
+        write()
+        self.wal.sync()
 
 
 def create_test_data():
@@ -341,11 +519,12 @@ def create_test_data():
         })
         toggle = not toggle
         time.sleep(20)
+    db.close()
 
 
 def delete_test_data():
     import subprocess
-    token_file=r"/home/taupunkt/influxdb.python.token"
+    token_file = TOKEN_FILE
     if os.path.isfile(token_file):
         with open(token_file) as f:
             token = f.read().strip()
@@ -376,7 +555,7 @@ def delete_minute(timestamp):
     print("UTC", start)
     print("UTC", stop)
 
-    token_file=r"/home/taupunkt/influxdb.python.token"
+    token_file = TOKEN_FILE
     if os.path.isfile(token_file):
         with open(token_file) as f:
             token = f.read().strip()
@@ -392,19 +571,23 @@ def delete_minute(timestamp):
 
 
 def export_bucket():
-    if os.path.isfile(EXPORT_FILE):
-        os.remove(EXPORT_FILE)
+    if os.path.isfile(EXPORT_FILE) and not os.path.isfile(EXPORT_CHECKPOINT_FILE):
+        os.remove(EXPORT_FILE)  # fresh export, otherwise the interrupted export is resumed
+    db = Database()
+    db.export(MEASUREMENTS)  # all measurements in one pass
+    db.close()
+
+
+def import_bucket(batch_size=IMPORT_BATCH_SIZE, writers=IMPORT_WRITERS):
     db = Database()
-    db.export_DHT22()
-    db.export_DS18B20()
-    db.export_RD200()
-    db.export_ventilation()
-    db.export_switches()
+    db.import_all(batch_size=batch_size, writers=writers)
+    db.close()
 
 
-def import_bucket():
+def backfill_rollups():
     db = Database()
-    db.import_all()
+    db.backfill_rollups()
+    db.close()
 
 
 def main():
@@ -417,10 +600,13 @@ def main():
         help="Delete data of the given minute. Local time in the format 'yyyy-mm-dd HH:MM:SS'",
         type=lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
     )
-    parser.add_argument('--export-bucket', action='store_true', help="export bucket (old format and enhance with aH and lim).")
+    parser.add_argument('--export-bucket', action='store_true', help="export bucket (old format and enhance with aH and lim). An interrupted export is resumed.")
     parser.add_argument('--import-bucket', action='store_true', help="import bucket (delete and re-create taupunkt_bucket before execution)")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="lines per write request for --import-bucket")
+    parser.add_argument('--writers', type=int, default=IMPORT_WRITERS, help="parallel write requests for --import-bucket")
+    parser.add_argument('--backfill-rollups', action='store_true', help="build the 1m, 1h, and 1d rollups from the existing history")
     args = parser.parse_args()
-    if (args.create_test_data == False) and (args.delete_test_data == False) and (args.delete_minute is None) and (args.export_bucket == False) and (args.import_bucket == False):
+    if (args.create_test_data == False) and (args.delete_test_data == False) and (args.delete_minute is None) and (args.export_bucket == False) and (args.import_bucket == False) and (args.backfill_rollups == False):
         parser.print_help()
     elif args.create_test_data:
         create_test_data()
@@ -431,7 +617,9 @@ def main():
     elif args.export_bucket:
         export_bucket()
     elif args.import_bucket:
-        import_bucket()
+        import_bucket(batch_size=args.batch_size, writers=args.writers)
+    elif args.backfill_rollups:
+        backfill_rollups()
 
 
 if __name__ == '__main__':
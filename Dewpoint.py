@@ -5,13 +5,14 @@ The module delivers the averaged temperature and relative humidity of the extern
 
 Responsibility:
 - for each DHT22 sensor:
--- calculate a moving average for one minute for the temperature in °C
--- calculate a moving average for one minute for the relative humidity in % as float
+-- calculate a moving average for one minute (or the given window) for the temperature in °C
+-- calculate a moving average for one minute (or the given window) for the relative humidity in % as float
 -- calculate the dewpoint based on the averaged temperature and relative humidity in °C
 - a callback is called on minute change to announce the averaged values of the last minute
 
 Architecture:
 - uses DHT22 to capture the raw data
+- uses RingBuffer for the moving averages, O(1) per sample independent of the window size
 - action is driven by the callback that is cyclically called from DHT22 uppon data update
 - the caller registers a callback uppon instantiation
 - main is for demonstration
@@ -19,52 +20,23 @@ Architecture:
 
 
 import time
-import numpy as np
 from datetime import datetime, timedelta, timezone
 from DHT22 import DHT22, READ_TICK
+from RingBuffer import RingBuffer
+from Formulas import Taupunkt
 
 assert(0 == (60 % READ_TICK))  # ensure the seconds of a minute can be evenly divided by the seconds between two reads
-NUM_SAMPLES = 60 // READ_TICK  # number of samples regarded for averaging
 
 
 def calc_dewpoint(t: float, r: float) -> float:
-    if (t >= 0):
-        a = 7.5
-        b = 237.3
-    else:
-        a = 7.6
-        b = 240.7
-
-    # Sättigungsdampfdruck in hPa
-    sdd = 6.1078 * np.power(10, (a*t)/(b+t))
-
-    # Dampfdruck in hPa
-    dd = sdd * (r/100)
-
-    # v-Parameter
-    v = np.log10(dd/6.1078)
-
-    # Taupunkttemperatur (°C)
-    tt = (b*v) / (a-v)
-    return float(tt)
-
-
-def calc_avg(a_list):
-    sum = 0.0
-    cnt = 0
-    for val in a_list:
-        if val is not None:
-            sum += val
-            cnt += 1
-    if cnt:
-        return sum / cnt
-    else:
-        return None
+    return float(Taupunkt(t, r))
 
 
 class Dewpoint():
-    def __init__(self, on_update):
+    def __init__(self, on_update, window=60):
+        assert 0 == (window % READ_TICK)
         self.on_update = on_update
+        self.num_samples = window // READ_TICK  # number of samples regarded for averaging
         self.sensors = None
         self.raw_data = {}
         self.averaged = {}
@@ -77,23 +49,19 @@ class Dewpoint():
                 self.averaged[key] = {}
             if key not in self.raw_data:
                 self.raw_data[key] = {
-                    "temperature": [None] * NUM_SAMPLES,
-                    "humidity": [None] * NUM_SAMPLES,
+                    "temperature": RingBuffer(self.num_samples),
+                    "humidity": RingBuffer(self.num_samples),
                 }
             if not data[key]["error"]:
-                self.raw_data[key]["temperature"].append(data[key]["temperature"])
-                self.raw_data[key]["humidity"].append(data[key]["humidity"])
+                self.raw_data[key]["temperature"].push(data[key]["temperature"])
+                self.raw_data[key]["humidity"].push(data[key]["humidity"])
             else:
-                self.raw_data[key]["temperature"].append(None)
-                self.raw_data[key]["humidity"].append(None)
-            self.raw_data[key]["temperature"].pop(0)
-            self.raw_data[key]["humidity"].pop(0)
-            assert NUM_SAMPLES == len(self.raw_data[key]["temperature"])
-            assert NUM_SAMPLES == len(self.raw_data[key]["humidity"])
+                self.raw_data[key]["temperature"].push(None)
+                self.raw_data[key]["humidity"].push(None)
 
         for key in self.raw_data:
-            temperature = calc_avg(self.raw_data[key]["temperature"])
-            humidity = calc_avg(self.raw_data[key]["humidity"])
+            temperature = self.raw_data[key]["temperature"].mean()
+            humidity = self.raw_data[key]["humidity"].mean()
             if (temperature is not None) and (humidity is not None):
                 self.averaged[key]["temperature"] = round(temperature, 1)
                 self.averaged[key]["humidity"] = round(humidity, 1)
@@ -107,8 +75,8 @@ class Dewpoint():
 
         self.on_update(self.averaged)
 
-    def start(self):
-        self.sensors = DHT22(self.callback)
+    def start(self, scheduled=True):
+        self.sensors = DHT22(self.callback, scheduled=scheduled)
 
     def stop(self):
        self.sensors.exit()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Fake sysfs tree of the 1-wire bus, to run DS18B20 without the w1-gpio and w1-therm kernel modules.
+
+Responsibility:
+- create a directory that looks like /sys/bus/w1/devices/ with
+-- w1_bus_master1/therm_bulk_read (optional, as in kernels without bulk read support)
+-- <sensor id>/w1_slave in the format of w1-therm: "... crc=xx YES" and "... t=<milli °C>"
+-- <sensor id>/temperature (optional) with the temperature in milli °C
+- set the temperature of a sensor, simulate CRC errors and missing sensors
+
+Architecture:
+- plain files in a temporary directory, the status of therm_bulk_read is always "0" (conversion done)
+  until DS18B20 writes "trigger" into it, which is accepted as done as well
+- main is for demonstration
+"""
+
+import os
+import shutil
+import tempfile
+
+
+class FakeW1():
+    def __init__(self, sensors, bulk_read=True, temperature_files=True):
+        """sensors: dict sensor id -> temperature in °C"""
+        self.directory = tempfile.mkdtemp(prefix="w1_")
+        self.temperature_files = temperature_files
+        if bulk_read:
+            master = os.path.join(self.directory, "w1_bus_master1")
+            os.makedirs(master)
+            with open(os.path.join(master, "therm_bulk_read"), "w") as f:
+                f.write("0\n")
+        for sensor, temperature in sensors.items():
+            self.set_temperature(sensor, temperature)
+
+    def set_temperature(self, sensor, temperature, crc_ok=True):
+        directory = os.path.join(self.directory, sensor)
+        os.makedirs(directory, exist_ok=True)
+        milli = int(round(temperature * 1000))
+        raw = milli * 16 // 1000 & 0xffff
+        data = "{:02x} {:02x} 4b 46 7f ff 0c 10 1c".format(raw & 0xff, raw >> 8)
+        with open(os.path.join(directory, "w1_slave"), "w") as f:
+            f.write("{} : crc=1c {}\n".format(data, "YES" if crc_ok else "NO"))
+            f.write("{} t={}\n".format(data, milli))
+        if self.temperature_files:
+            with open(os.path.join(directory, "temperature"), "w") as f:
+                f.write("{}\n".format(milli) if crc_ok else "")
+
+    def remove(self, sensor):
+        shutil.rmtree(os.path.join(self.directory, sensor), ignore_errors=True)
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def main():
+    import json
+    import time
+    from DS18B20 import DS18B20, CONFIG_FILE
+
+    with open(CONFIG_FILE) as f:
+        config = json.load(f)
+
+    for bulk_read in [True, False]:
+        w1 = FakeW1({sensor: 10.0 + i for i, sensor in enumerate(config)}, bulk_read=bulk_read)
+        w1.set_temperature(list(config)[1], 11.0, crc_ok=False)  # permanent CRC error
+        w1.remove(list(config)[2])
+        ds = DS18B20(print, device_dir=w1.directory)
+        start = time.monotonic()
+        print("bulk read" if bulk_read else "w1_slave", ds.capture_data(), "{:.1f} s".format(time.monotonic() - start))
+        print(ds.get_stats())
+        ds.stop()
+        w1.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,20 @@
 #!/usr/bin/env python3
 
+"""
+Formulas for dewpoint, absolute humidity, and mould growth (LIM).
+
+All formulas accept scalars as well as NumPy arrays. For arrays the branch on the temperature
+is done with np.where, the results are identical to the scalar results.
+The *_array functions round like their scalar get_* counterparts and are meant for whole columns of historic data.
+The get_* functions cache their results in bounded, thread-safe LRU caches (see get_cache_stats).
+"""
+
 import numpy as np
+from LruCache import LruCache
+
+
+LIM_CACHE_SIZE = 1000                 # temperatures outside of LIM_TABLE are rare
+ABSOLUTE_HUMIDITY_CACHE_SIZE = 20000  # (temperature, rH) pairs, i.e. 10 K x 20 % at 0.1 resolution
 
 
 def Myzelwachstum(relative_humidity, temperature):
@@ -21,41 +35,86 @@ def LIM(T):
     """
     Berechnung der maximalen reativen Luftfeuchtigkeit in Abhängigkeit von der Temperatur
     die nötig ist, damit gesundheitsschädliche Schimmelpilze wachsen.
-    """
-    for rH in range(0, 1001):
-        v = Myzelwachstum(rH/10, T)
-        if v >= 0.0:
-            return (rH - 1) / 10
-            break
-    return None
 
-
-lim_cache = {}
+    Same result as scanning rH from 0 to 100 % in steps of 0.1 % for the first rH with Myzelwachstum >= 0:
+    the equation is solved for phi, the step is found with ceil() and corrected with the exact
+    Myzelwachstum expression (rounding errors of the solution). Accepts scalars and arrays, NaN for None.
+    """
+    T = np.asarray(T, dtype=float)
+    with np.errstate(over="ignore", invalid="ignore"):
+        phi = 0.244 * np.exp(-0.12 * T) + 0.775
+        steps = np.ceil(np.minimum(phi, 2.0) * 1000) - 2  # two steps below the solution, the scan stops at 1000 anyway
+    steps = np.clip(np.nan_to_num(steps, nan=1001), 0, 1001)
+    for _ in range(4):
+        below = (steps <= 1000) & (Myzelwachstum(steps / 10, T) < 0.0)
+        steps = np.where(below, steps + 1, steps)
+    lim = np.where(steps <= 1000, (steps - 1) / 10, np.nan)
+    if lim.ndim == 0:
+        return None if np.isnan(lim) else float(lim)
+    return lim
+
+
+# get_lim for -40.0 .. +80.0 °C in steps of 0.1 °C, index = (temperature + 40) * 10, NaN for None
+LIM_TABLE_MIN = -40.0
+LIM_TABLE_MAX = 80.0
+LIM_TABLE_SIZE = int(round((LIM_TABLE_MAX - LIM_TABLE_MIN) * 10)) + 1
+LIM_TABLE_TEMPERATURES = np.array([round((i + LIM_TABLE_MIN * 10) / 10, 1) for i in range(LIM_TABLE_SIZE)])
+LIM_TABLE = np.array([np.nan if np.isnan(lim) else round(float(lim), 1) for lim in LIM(LIM_TABLE_TEMPERATURES)])
+
+
+def calc_lim(temperature):
+    lim = LIM(temperature)
+    if lim is None:
+        return lim
+    return round(lim, 1)
+
+
+lim_cache = LruCache(LIM_CACHE_SIZE)  # temperatures outside of LIM_TABLE
 def get_lim(temperature):
-    global lim_cache
     temperature = round(float(temperature), 1)
-    if temperature not in lim_cache:
-        lim = LIM(temperature)
-        if lim is None:
-            lim_cache[temperature] = lim
-        else:
-            lim_cache[temperature] = round(lim, 1)
-    return lim_cache[temperature]
+    if LIM_TABLE_MIN <= temperature <= LIM_TABLE_MAX:
+        lim = LIM_TABLE[int(round((temperature - LIM_TABLE_MIN) * 10))]
+        return None if np.isnan(lim) else float(lim)
+    return lim_cache.get(temperature, calc_lim)
+
+
+def Magnus(t_Celsius):
+    """Parameters a and b of the Magnus formula, over water for t >= 0 °C, over ice below."""
+    a = np.where(t_Celsius >= 0, 7.5, 7.6)
+    b = np.where(t_Celsius >= 0, 237.3, 240.7)
+    return a, b
 
 
 def Saettigungsdampfdruck(t_Celsius):
-    if (t_Celsius >= 0):
-        a = 7.5
-        b = 237.3
-    else:
-        a = 7.6
-        b = 240.7
+    a, b = Magnus(t_Celsius)
 
     # Sättigungsdampfdruck in kPa
     sdd = 6.1078 * np.power(10, (a*t_Celsius)/(b+t_Celsius)) / 10
     return sdd
 
 
+def Taupunkt(t, r):
+    """
+    t in °C
+    r relative humidity in %
+    dewpoint in °C
+    """
+    a, b = Magnus(t)
+
+    # Sättigungsdampfdruck in hPa
+    sdd = 6.1078 * np.power(10, (a*t)/(b+t))
+
+    # Dampfdruck in hPa
+    dd = sdd * (r/100)
+
+    # v-Parameter
+    v = np.log10(dd/6.1078)
+
+    # Taupunkttemperatur (°C)
+    tt = (b*v) / (a-v)
+    return tt
+
+
 def Saettigungsmenge(t_Celsius, Psat):
     t_Kelvin = t_Celsius + 273.1
     roh = Psat / (461.5 * t_Kelvin) * 1000000 # in g/m³ Luft
@@ -66,14 +125,72 @@ def Wassergehalt(t_Celsius, rH):
     return rH/100 * Saettigungsmenge(t_Celsius, Saettigungsdampfdruck(t_Celsius))
 
 
-absolute_humidity_cache = {}
+def calc_absolute_humidity(key):
+    temperature, rH = key
+    return round(Wassergehalt(temperature, rH), 1)
+
+
+absolute_humidity_cache = LruCache(ABSOLUTE_HUMIDITY_CACHE_SIZE)
 def get_absolute_humidity(temperature, rH):
     temperature = round(float(temperature), 1)
     rH = round(float(rH), 1)
-    key = (temperature, rH)
-    if key not in absolute_humidity_cache:
-        absolute_humidity_cache[key] = round(Wassergehalt(temperature, rH), 1)
-    return absolute_humidity_cache[key]
+    return absolute_humidity_cache.get((temperature, rH), calc_absolute_humidity)
+
+
+def warm_up_absolute_humidity(t_min, t_max, rH_min=0.0, rH_max=100.0):
+    """
+    Precompute get_absolute_humidity for all temperatures and relative humidities of the ranges at 0.1 resolution,
+    i.e. for the typical range of a sensor. The pairs that do not fit into the cache are not stored.
+    """
+    temperatures = np.arange(int(round(t_min * 10)), int(round(t_max * 10)) + 1) / 10
+    rHs = np.arange(int(round(rH_min * 10)), int(round(rH_max * 10)) + 1) / 10
+    temperatures, rHs = np.meshgrid(temperatures, rHs, indexing="ij")
+    temperatures = temperatures.ravel()[:absolute_humidity_cache.maxsize]
+    rHs = rHs.ravel()[:absolute_humidity_cache.maxsize]
+    aHs = get_absolute_humidity_array(temperatures, rHs)
+    absolute_humidity_cache.warm_up(((float(t), float(r)), aH) for t, r, aH in zip(temperatures, rHs, aHs))
+
+
+def get_cache_stats():
+    return {
+        "lim": lim_cache.get_stats(),
+        "absolute_humidity": absolute_humidity_cache.get_stats(),
+    }
+
+
+def round_array(x, ndigits):
+    """Python round() for each element, NaN stays NaN. Only the distinct values are rounded."""
+    x = np.asarray(x, dtype=float)
+    unique, inverse = np.unique(x, return_inverse=True)
+    rounded = np.array([v if np.isnan(v) else round(float(v), ndigits) for v in unique], dtype=float)
+    return rounded[inverse].reshape(x.shape)
+
+
+def get_lim_array(temperatures):
+    """get_lim for a column of temperatures, NaN for missing temperatures and for None results."""
+    temperatures = round_array(temperatures, 1)
+    lims = np.full(temperatures.shape, np.nan)
+    with np.errstate(invalid="ignore"):
+        in_table = (temperatures >= LIM_TABLE_MIN) & (temperatures <= LIM_TABLE_MAX)
+    lims[in_table] = LIM_TABLE[np.rint((temperatures[in_table] - LIM_TABLE_MIN) * 10).astype(int)]
+    outside = ~in_table & ~np.isnan(temperatures)
+    if outside.any():
+        lims[outside] = [np.nan if lim is None else lim for lim in map(get_lim, temperatures[outside])]
+    return lims
+
+
+def get_absolute_humidity_array(temperatures, rHs):
+    """get_absolute_humidity for columns of temperatures and relative humidities, NaN if one of both is missing."""
+    temperatures = round_array(temperatures, 1)
+    rHs = round_array(rHs, 1)
+    with np.errstate(invalid="ignore"):
+        return round_array(Wassergehalt(temperatures, rHs), 1)
+
+
+def get_dewpoint_array(temperatures, rHs):
+    """Dewpoint for columns of temperatures and relative humidities, NaN if one of both is missing."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return Taupunkt(np.asarray(temperatures, dtype=float), np.asarray(rHs, dtype=float))
 
 
 def main():
@@ -90,6 +207,10 @@ def main():
     print(get_absolute_humidity(7.7, 81.5), "g/m³")
     print(get_absolute_humidity(8.4, 74.5), "g/m³")
 
+    warm_up_absolute_humidity(8.0, 12.0, 50.0, 90.0)
+    print(get_absolute_humidity(10.6, 62.2), "g/m³")
+    print(get_cache_stats())
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+"""
+Framebuffer of the 20x4 character LCD, only the changed characters are sent to the display.
+
+Responsibility:
+- remember what is shown on the display
+- on render: find the runs of changed characters per row and send only a cursor move and the characters of each run
+- adaptive batching: two runs of a row are merged into one if rewriting the unchanged characters in between
+  is cheaper than the cursor move of the second run (cost model of the driver)
+- count the I2C transactions, per render and in total
+- after a display error or a clear the content is unknown, the next render writes all characters
+
+Architecture:
+- a driver moves the cursor (move) and writes characters (write) and provides the costs of both in I2C transactions
+-- I2cDriver: HD44780 with PCF8574 on the I2C bus, uses i2c_HD44780.lcd of RPi_GPIO_i2c_LCD directly
+   (the HD44780 class of the package rewrites all lines in an endless loop of its own thread);
+   all calls of the library are in I2cDriver, their signatures are checked on instantiation (see LIBRARY_INTERFACE);
+   if the library does not match, whole lines are written with its display_string
+-- AdafruitDriver: wrapper of Adafruit_CharLCD, the I2C transactions depend on its GPIO adapter (PCF8574_GPIO writes
+   every pin change, thus the number per byte depends on its bits), they are counted at the adapter (CountingGpio)
+   instead of a fixed number per byte; a cursor move and a character are one byte each, thus they have the same cost
+-- FakeLcd: display in memory for tests, same cost model as I2cDriver
+- not thread-safe, used by the job of View only
+- main is for demonstration
+"""
+
+import inspect
+
+
+COLUMNS = 20
+ROWS = 4
+ROW_OFFSETS = [0x00, 0x40, 0x14, 0x54]  # DDRAM address of the first column of each row of a 20x4 HD44780
+
+# HD44780 in 4 bit mode behind a PCF8574: one command or character = 2 nibbles of 3 I2C writes each (data, strobe high, strobe low)
+TRANSACTIONS_PER_BYTE = 6
+
+# RPi_GPIO_i2c_LCD 0.1.3, i2c_HD44780.lcd: method -> leading parameters used by I2cDriver
+# write(cmd, mode=0): one byte in two nibbles, mode 0b00000001 for a character (RS), otherwise a command
+# backlight(state): "on" or "off", effective with the next write
+# clear(): initialization sequence including "clear display"
+# display_string(string, line): line 1..4, the public function of the library, used as fallback
+LIBRARY_INTERFACE = {
+    "write": ["cmd", "mode"],
+    "backlight": ["state"],
+    "clear": [],
+}
+CHARACTER_MODE = 0b00000001
+DISPLAY_ON = 0x08 | 0x04  # display on, cursor off
+
+
+def has_interface(obj, interface):
+    for name, parameters in interface.items():
+        try:
+            signature = inspect.signature(getattr(obj, name))
+        except (AttributeError, TypeError, ValueError):
+            return False
+        if list(signature.parameters)[:len(parameters)] != parameters:
+            return False
+    return True
+
+
+class I2cDriver():
+    move_cost = TRANSACTIONS_PER_BYTE
+    char_cost = TRANSACTIONS_PER_BYTE
+
+    def __init__(self, address):
+        from RPi_GPIO_i2c_LCD import i2c_HD44780
+        self.lcd = i2c_HD44780.lcd(address)
+        self.transactions = 0
+        self.direct = has_interface(self.lcd, LIBRARY_INTERFACE)
+        if not self.direct:
+            print("RPi_GPIO_i2c_LCD: unexpected interface, whole lines are written with display_string")
+            self.move_cost = (1 + COLUMNS) * TRANSACTIONS_PER_BYTE  # each run costs a whole line,
+            self.char_cost = 0                                      # thus all runs of a row are merged into one
+        self.lines = [[" "] * COLUMNS for _ in range(ROWS)]  # content for the line mode
+        self.row = 0
+        self.column = 0
+
+    def command(self, byte):
+        self.lcd.write(byte)
+        self.transactions += TRANSACTIONS_PER_BYTE
+
+    def character(self, c):
+        self.lcd.write(ord(c), CHARACTER_MODE)
+        self.transactions += TRANSACTIONS_PER_BYTE
+
+    def display_line(self, row):
+        self.lcd.display_string("".join(self.lines[row]), row + 1)
+        self.transactions += (1 + COLUMNS) * TRANSACTIONS_PER_BYTE
+
+    def move(self, column, row):
+        self.row, self.column = row, column
+        if self.direct:
+            self.command(0x80 | (ROW_OFFSETS[row] + column))
+
+    def write(self, text):
+        if self.direct:
+            for c in text:
+                self.character(c)
+        else:
+            self.lines[self.row][self.column:self.column + len(text)] = text
+            self.display_line(self.row)
+        self.column += len(text)
+
+    def backlight(self, state):
+        if self.direct:
+            self.lcd.backlight(state)  # effective with the next transaction
+            self.command(DISPLAY_ON)
+        else:
+            try:
+                self.lcd.backlight(state)
+            except Exception as e:
+                print(e)
+            self.display_line(0)
+
+    def clear(self):
+        if self.direct:
+            self.lcd.clear()
+            self.transactions += 6 * TRANSACTIONS_PER_BYTE
+        else:
+            for row in range(ROWS):
+                self.lines[row] = [" "] * COLUMNS
+                self.display_line(row)
+
+
+class CountingGpio():
+    """GPIO adapter of Adafruit_CharLCD that counts the pin changes, each one is an I2C write of PCF8574_GPIO"""
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self.outputs = 0
+
+    def output(self, pin, value):
+        self.outputs += 1
+        self.gpio.output(pin, value)
+
+    def __getattr__(self, name):
+        return getattr(self.gpio, name)
+
+
+class AdafruitDriver():
+    move_cost = 1  # one byte each, the I2C writes per byte depend on the bits
+    char_cost = 1
+
+    def __init__(self, lcd):
+        self.lcd = lcd
+        self.gpio = CountingGpio(lcd.GPIO)
+        self.lcd.GPIO = self.gpio
+
+    @property
+    def transactions(self):
+        return self.gpio.outputs
+
+    def move(self, column, row):
+        self.lcd.setCursor(column, row)
+
+    def write(self, text):
+        self.lcd.message(text)
+
+    def clear(self):
+        self.lcd.clear()
+
+
+class FakeLcd():
+    move_cost = TRANSACTIONS_PER_BYTE
+    char_cost = TRANSACTIONS_PER_BYTE
+
+    def __init__(self, columns=COLUMNS, rows=ROWS):
+        self.cells = [[" "] * columns for _ in range(rows)]
+        self.column = 0
+        self.row = 0
+        self.transactions = 0
+
+    def move(self, column, row):
+        self.column = column
+        self.row = row
+        self.transactions += self.move_cost
+
+    def write(self, text):
+        for c in text:
+            self.cells[self.row][self.column] = c
+            self.column += 1
+        self.transactions += self.char_cost * len(text)
+
+    def backlight(self, state):
+        self.transactions += TRANSACTIONS_PER_BYTE
+
+    def clear(self):
+        self.cells = [[" "] * len(row) for row in self.cells]
+        self.transactions += 6 * TRANSACTIONS_PER_BYTE
+
+    def lines(self):
+        return ["".join(row) for row in self.cells]
+
+
+class Framebuffer():
+    def __init__(self, driver, columns=COLUMNS, rows=ROWS):
+        self.driver = driver
+        self.columns = columns
+        self.rows = rows
+        self.shown = None  # rows of characters on the display, None if unknown
+        self.stats = {
+            "renders": 0,
+            "transactions": 0,
+            "last_transactions": 0,
+            "characters": 0,
+        }
+
+    def invalidate(self):
+        """The content of the display is unknown, i.e. after an error or a clear."""
+        self.shown = None
+
+    def runs(self, old, new):
+        """(first column, last column) of the changed characters of a row, merged where this is cheaper."""
+        runs = []
+        for column in range(len(new)):
+            if (old is None) or (old[column] != new[column]):
+                if runs and ((column - runs[-1][1] - 1) * self.driver.char_cost <= self.driver.move_cost):
+                    runs[-1][1] = column  # rewrite the unchanged characters in between instead of moving the cursor
+                else:
+                    runs.append([column, column])
+        return runs
+
+    def render(self, lines):
+        """lines: one string or list of characters per row"""
+        lines = ["".join(line)[:self.columns].ljust(self.columns) for line in lines[:self.rows]]
+        start = self.driver.transactions
+        shown = self.shown
+        self.shown = None  # unknown until all runs are written, in case of an exception
+        for row, line in enumerate(lines):
+            for first, last in self.runs(shown[row] if shown is not None else None, line):
+                self.driver.move(first, row)
+                self.driver.write(line[first:last + 1])
+                self.stats["characters"] += last + 1 - first
+        self.shown = lines
+        transactions = self.driver.transactions - start
+        self.stats["renders"] += 1
+        self.stats["transactions"] += transactions
+        self.stats["last_transactions"] = transactions
+        return transactions
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+def main():
+    import random
+    lcd = FakeLcd()
+    framebuffer = Framebuffer(lcd)
+    lines = ["Bq  123 17 Oct 12:34", "+12.3 65.4%  +5.9 NO", "+12.1 66.0%  +5.8 SO", " +3.2 80.1%  +0.1 ||"]
+    print("first render", framebuffer.render(lines), "transactions")
+    assert lcd.lines() == lines
+    lines[0] = lines[0][:17] + " " + lines[0][18:]  # blinking colon
+    print("colon", framebuffer.render(lines), "transactions")
+    lines[1] = "+12.4 65.6%  +6.0 NW"
+    print("north", framebuffer.render(lines), "transactions")
+    full = 4 * (I2cDriver.move_cost + COLUMNS * I2cDriver.char_cost)
+    for _ in range(1000):
+        row = random.randrange(ROWS)
+        line = list(lines[row])
+        for _ in range(random.randrange(5)):
+            line[random.randrange(COLUMNS)] = random.choice("0123456789 ")
+        lines[row] = "".join(line)
+        transactions = framebuffer.render(lines)
+        assert lcd.lines() == lines
+        assert transactions <= full
+    print(framebuffer.get_stats(), "instead of", full, "transactions per render")
+
+
+if __name__ == '__main__':
+    main()
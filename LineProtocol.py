@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+"""
+Line protocol serializer for the five measurements of the database: DHT22, DS18B20, RD200, ventilation, switches.
+
+Responsibility:
+- create the line protocol of one point without the detour via influxdb_client.Point
+- produce exactly what Point.to_line_protocol() produces for the same data (fields sorted, ".0" trimmed, lower case booleans)
+- fields with a value of None or NaN are omitted, like Point does
+- the timestamp is passed in as integer seconds, so one timestamp can be taken per tick for all points
+
+Architecture:
+- the tag prefixes are computed once per key and cached
+- the same functions are used by Database for writing and for exporting, thus both produce byte-identical lines
+- LineBuffer collects lines in a reusable buffer and writes them in chunks into a file
+- parse_line reads the lines back, i.e. of an export file (see Replay)
+- main is a micro-benchmark against the Point path
+"""
+
+import math
+
+
+def x2float(x):
+    try:
+        x = float(x)
+    except:
+        x = float("NaN")
+    return x
+
+
+def format_float(value):
+    """Returns None for values that are omitted."""
+    if value is None:
+        return None
+    value = x2float(value)
+    if not math.isfinite(value):
+        return None
+    s = repr(value)
+    if s.endswith(".0"):
+        s = s[:-2]  # same as Point
+    return s
+
+
+def format_bool(value):
+    return "true" if value else "false"
+
+
+def escape_tag_value(value):
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+prefix_cache = {}
+def get_prefix(measurement, key):
+    prefix = prefix_cache.get((measurement, key))
+    if prefix is None:
+        prefix = "{},key={} ".format(measurement, escape_tag_value(key))
+        prefix_cache[(measurement, key)] = prefix
+    return prefix
+
+
+def join_fields(prefix, fields, timestamp):
+    """fields is a list of (name, formatted value) in alphabetical order of the names."""
+    return "{}{} {}".format(prefix, ",".join(name + "=" + value for name, value in fields if value is not None), timestamp)
+
+
+def line_DHT22(key, temperature, rH, dewpoint, aH, lim, error, timestamp):
+    return join_fields(get_prefix("DHT22", key), [
+        ("aH", format_float(aH)),
+        ("dewpoint", format_float(dewpoint)),
+        ("error", format_bool(error)),
+        ("lim", format_float(lim)),
+        ("rH", format_float(rH)),
+        ("temperature", format_float(temperature)),
+    ], timestamp)
+
+
+def line_DS18B20(key, temperature, error, timestamp):
+    return join_fields(get_prefix("DS18B20", key), [
+        ("error", format_bool(error)),
+        ("temperature", format_float(temperature)),
+    ], timestamp)
+
+
+def line_RD200(radon, error, timestamp):
+    return join_fields("RD200 ", [
+        ("error", format_bool(error)),
+        ("radon", format_float(radon)),
+    ], timestamp)
+
+
+def line_ventilation(ventilation, timestamp):
+    return join_fields("ventilation ", [
+        ("dewpoint_granted", format_bool(ventilation["dewpoint_granted"])),
+        ("external_temp_granted", format_bool(ventilation["external_temp_granted"])),
+        ("heater_request", format_bool(ventilation["heater_request"])),
+        ("humidity_request", format_bool(ventilation["humidity_request"])),
+        ("internal_temp_granted", format_bool(ventilation["internal_temp_granted"])),
+        ("radon_request", format_bool(ventilation["radon_request"])),
+    ], timestamp)
+
+
+def line_switches(switches, timestamp):
+    return join_fields("switches ", [
+        ("heater_on", format_bool(switches["heater_on"])),
+        ("in_fan_on", format_bool(switches["in_fan_on"])),
+        ("out_fan_on", format_bool(switches["out_fan_on"])),
+    ], timestamp)
+
+
+def split_unescaped(text, separator, maxsplit=-1):
+    """Split at the separators that are not escaped by a backslash and not within double quotes."""
+    if ("\\" not in text) and ('"' not in text):
+        return text.split(separator, maxsplit)  # fast path, i.e. all lines written by this module
+    parts = []
+    start = 0
+    quoted = False
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == '"':
+            quoted = not quoted
+        elif (c == separator) and not quoted and (maxsplit < 0 or len(parts) < maxsplit):
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def unescape(text):
+    return text.replace("\\ ", " ").replace("\\,", ",").replace("\\=", "=").replace("\\\\", "\\")
+
+
+def parse_value(text):
+    if text in ["t", "T", "true", "True", "TRUE"]:
+        return True
+    if text in ["f", "F", "false", "False", "FALSE"]:
+        return False
+    if text.startswith('"'):
+        return text[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    if text.endswith("i") or text.endswith("u"):
+        return int(text[:-1])
+    return float(text)
+
+
+def parse_line(line):
+    """(measurement, tags, fields, timestamp) of one line, the timestamp as integer in the precision of the line."""
+    head, field_set, timestamp = split_unescaped(line.strip(), " ", 2)
+    measurement, *tag_set = split_unescaped(head, ",")
+    tags = {}
+    for tag in tag_set:
+        key, value = split_unescaped(tag, "=", 1)
+        tags[unescape(key)] = unescape(value)
+    fields = {}
+    for field in split_unescaped(field_set, ","):
+        key, value = split_unescaped(field, "=", 1)
+        fields[unescape(key)] = parse_value(value)
+    return unescape(measurement), tags, fields, int(timestamp)
+
+
+class LineBuffer():
+    """Reusable buffer, collects lines and writes them in chunks of chunk_size lines into a file."""
+    def __init__(self, f, chunk_size=1000):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.lines = []
+
+    def append(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.lines.append("")  # trailing newline
+            self.f.write("\n".join(self.lines))
+            self.lines.clear()
+        self.f.flush()
+
+
+def main():
+    import timeit
+    from datetime import datetime, timezone
+    from influxdb_client import Point, WritePrecision
+
+    ventilation = {
+        "radon_request": True,
+        "humidity_request": False,
+        "heater_request": False,
+        "dewpoint_granted": True,
+        "internal_temp_granted": True,
+        "external_temp_granted": None,
+    }
+    switches = {"out_fan_on": True, "in_fan_on": True, "heater_on": False}
+
+    def tick_point():
+        t = datetime.now(timezone.utc).replace(microsecond=0)
+        lines = []
+        for key in ["ext", "NO", "SO", "SW", "NW"]:
+            lines.append(Point("DHT22").tag("key", key).field("temperature", x2float(12.3)).field("rH", x2float(65.4))
+                .field("dewpoint", x2float(5.9)).field("aH", x2float(7.1)).field("lim", x2float(None)).field("error", False)
+                .time(t).to_line_protocol(precision=WritePrecision.S))
+        for key in ["Ak", "Aw", "FL", "ZL", "AL"]:
+            lines.append(Point("DS18B20").tag("key", key).field("temperature", x2float(4.0)).field("error", False)
+                .time(t).to_line_protocol(precision=WritePrecision.S))
+        lines.append(Point("RD200").field("radon", x2float(123)).field("error", False).time(t).to_line_protocol(precision=WritePrecision.S))
+        point = Point("ventilation").time(t)
+        for field in ventilation:
+            point.field(field, True if ventilation[field] else False)
+        lines.append(point.to_line_protocol(precision=WritePrecision.S))
+        point = Point("switches").time(t)
+        for field in switches:
+            point.field(field, True if switches[field] else False)
+        lines.append(point.to_line_protocol(precision=WritePrecision.S))
+        return lines
+
+    def tick_line_protocol():
+        t = int(datetime.now(timezone.utc).timestamp())
+        lines = []
+        for key in ["ext", "NO", "SO", "SW", "NW"]:
+            lines.append(line_DHT22(key, 12.3, 65.4, 5.9, 7.1, None, False, t))
+        for key in ["Ak", "Aw", "FL", "ZL", "AL"]:
+            lines.append(line_DS18B20(key, 4.0, False, t))
+        lines.append(line_RD200(123, False, t))
+        lines.append(line_ventilation(ventilation, t))
+        lines.append(line_switches(switches, t))
+        return lines
+
+    a = tick_point()
+    b = tick_line_protocol()
+    if a[0].rsplit(" ", 1)[1] == b[0].rsplit(" ", 1)[1]:  # same second
+        assert a == b, "\n".join(a + b)
+        print("output is identical")
+    for line in b:
+        print(line)
+
+    n = 2000
+    t_point = timeit.timeit(tick_point, number=n) / n
+    t_line_protocol = timeit.timeit(tick_line_protocol, number=n) / n
+    print("Point:         {:8.1f} µs per tick".format(t_point * 1e6))
+    print("line protocol: {:8.1f} µs per tick".format(t_line_protocol * 1e6))
+    print("speedup:       {:8.1f}x".format(t_point / t_line_protocol))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""
+Embedded storage backend, the controller can run and persist its data without the InfluxDB service.
+
+Responsibility:
+- one SQLite file per measurement in LOCAL_DIR, in WAL mode (readers do not block the writer and vice versa)
+- one row per point, one column per field, append-only, indexed by time (and key)
+- fast queries of recent time windows, i.e. for the last hour
+- optionally forward all points to a second backend (i.e. Database for the InfluxDB and Grafana)
+
+Architecture:
+- implements the Storage interface
+- the rows are inserted by a BatchWriter in one transaction per flush, thus the write functions do not block
+- the connection for writing is only used by the thread of the BatchWriter, queries open their own connection
+- main is for demonstration
+"""
+
+import os
+import sqlite3
+import time
+from Storage import Storage
+from BatchWriter import BatchWriter
+
+
+LOCAL_DIR = r"/home/taupunkt/local"
+
+# measurement -> (tag column or None, field columns)
+SCHEMA = {
+    "DHT22": ("key", ["temperature", "rH", "dewpoint", "aH", "lim", "error"]),
+    "DS18B20": ("key", ["temperature", "error"]),
+    "RD200": (None, ["radon", "error"]),
+    "ventilation": (None, ["radon_request", "humidity_request", "heater_request", "dewpoint_granted", "internal_temp_granted", "external_temp_granted"]),
+    "switches": (None, ["out_fan_on", "in_fan_on", "heater_on"]),
+}
+BOOLEAN_FIELDS = {"error"} | set(SCHEMA["ventilation"][1]) | set(SCHEMA["switches"][1])  # stored as 0.0 / 1.0
+
+
+def columns(measurement):
+    tag, fields = SCHEMA[measurement]
+    return ["time"] + ([tag] if tag else []) + fields
+
+
+class LocalStore(Storage):
+    def __init__(self, directory=LOCAL_DIR, forward=None):
+        self.directory = directory
+        self.forward = forward
+        os.makedirs(self.directory, exist_ok=True)
+        for measurement in SCHEMA:
+            connection = self.connect(measurement)
+            tag, fields = SCHEMA[measurement]
+            connection.execute("CREATE TABLE IF NOT EXISTS points ({})".format(
+                ", ".join(["time INTEGER NOT NULL"] + (["{} TEXT NOT NULL".format(tag)] if tag else []) + ["{} REAL".format(f) for f in fields])))
+            connection.execute("CREATE INDEX IF NOT EXISTS points_time ON points (time{})".format(", " + tag if tag else ""))
+            connection.commit()
+            connection.close()
+        self.connections = None  # created by the thread of the writer
+        self.writer = BatchWriter(self.insert, self.drop, flush_interval=5.0)
+        self.writer.start()
+
+    def connect(self, measurement):
+        connection = sqlite3.connect(os.path.join(self.directory, "{}.sqlite".format(measurement)), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # fsync on checkpoint only, a power loss can lose the last transactions
+        return connection
+
+    def insert(self, records):
+        """Called by the batch writer with (measurement, row) records."""
+        if self.connections is None:
+            self.connections = {measurement: self.connect(measurement) for measurement in SCHEMA}
+        rows = {}
+        for measurement, row in records:
+            rows.setdefault(measurement, []).append(row)
+        for measurement in rows:
+            connection = self.connections[measurement]
+            with connection:  # one transaction
+                connection.executemany("INSERT INTO points VALUES ({})".format(", ".join("?" * len(columns(measurement)))), rows[measurement])
+
+    def drop(self, records):
+        print("ERROR: {} points could not be stored locally".format(len(records)))
+
+    def put(self, measurement, row):
+        self.writer.put((measurement, row))
+
+    def write_DHT22(self, key, temperature, rH, dewpoint, aH, lim, error, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time())  # same timestamp for the local and the forwarded point
+        self.put("DHT22", (timestamp, key, temperature, rH, dewpoint, aH, lim, bool(error)))
+        if self.forward is not None:
+            self.forward.write_DHT22(key, temperature, rH, dewpoint, aH, lim, error, timestamp)
+
+    def write_DS18B20(self, key, temperature, error, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time())  # same timestamp for the local and the forwarded point
+        self.put("DS18B20", (timestamp, key, temperature, bool(error)))
+        if self.forward is not None:
+            self.forward.write_DS18B20(key, temperature, error, timestamp)
+
+    def write_RD200(self, radon, error, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time())  # same timestamp for the local and the forwarded point
+        self.put("RD200", (timestamp, radon, bool(error)))
+        if self.forward is not None:
+            self.forward.write_RD200(radon, error, timestamp)
+
+    def write_ventilation(self, ventilation, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time())  # same timestamp for the local and the forwarded point
+        self.put("ventilation", (timestamp,) + tuple(bool(ventilation[f]) for f in SCHEMA["ventilation"][1]))
+        if self.forward is not None:
+            self.forward.write_ventilation(ventilation, timestamp)
+
+    def write_switches(self, switches, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time())  # same timestamp for the local and the forwarded point
+        self.put("switches", (timestamp,) + tuple(bool(switches[f]) for f in SCHEMA["switches"][1]))
+        if self.forward is not None:
+            self.forward.write_switches(switches, timestamp)
+
+    def query_recent(self, measurement, seconds, key=None):
+        tag, fields = SCHEMA[measurement]
+        names = columns(measurement)
+        query = "SELECT {} FROM points WHERE time >= ?".format(", ".join(names))
+        parameters = [int(time.time()) - seconds]
+        if (tag is not None) and (key is not None):
+            query += " AND {} = ?".format(tag)
+            parameters.append(key)
+        query += " ORDER BY time"
+        connection = sqlite3.connect(os.path.join(self.directory, "{}.sqlite".format(measurement)))
+        try:
+            result = []
+            for row in connection.execute(query, parameters):
+                values = dict(zip(names, row))
+                for field in fields:
+                    if field in BOOLEAN_FIELDS:
+                        values[field] = bool(values[field])
+                result.append(values)
+            return result
+        finally:
+            connection.close()
+
+    def get_stats(self):
+        stats = self.writer.get_stats()
+        if self.forward is not None:
+            stats["forward"] = self.forward.get_stats()
+        return stats
+
+    def close(self):
+        self.writer.stop()
+        if self.connections is not None:
+            for connection in self.connections.values():
+                connection.close()
+        if self.forward is not None:
+            self.forward.close()
+
+
+def main():
+    import tempfile
+    store = LocalStore(tempfile.mkdtemp())
+    for i in range(10):
+        store.write_DHT22("NO", 12.3 + i / 10, 65.4, 5.9, 7.1, 83.0, False)
+        store.write_DS18B20("FL", None, True)
+    store.write_switches({"out_fan_on": True, "in_fan_on": True, "heater_on": False})
+    store.writer.stop()
+    for measurement in ["DHT22", "DS18B20", "switches"]:
+        for values in store.query_recent(measurement, 60):
+            print(measurement, values)
+    print(store.get_stats())
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Size-bounded, thread-safe cache of computed values, used by Formulas.
+
+Responsibility:
+- keep at most `maxsize` values, evict the least recently used value when a new one is stored
+- count hits, misses, and evictions
+- optionally warm up with precomputed (key, value) pairs, i.e. from a table
+
+Architecture:
+- OrderedDict in order of use, protected by a lock; the sensor timers and the export share the caches
+- the value is computed outside of the lock, two threads that miss the same key compute it both (same result)
+- main is for demonstration
+"""
+
+import threading
+from collections import OrderedDict
+
+
+MAXSIZE = 10000
+
+
+class LruCache():
+    def __init__(self, maxsize=MAXSIZE):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+    def get(self, key, compute):
+        """The cached value of key, compute(key) is called and its result stored on a miss."""
+        with self.lock:
+            if key in self.values:
+                self.values.move_to_end(key)
+                self.stats["hits"] += 1
+                return self.values[key]
+            self.stats["misses"] += 1
+        value = compute(key)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            while len(self.values) > self.maxsize:
+                self.values.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def warm_up(self, items):
+        """Store precomputed (key, value) pairs, not counted as misses."""
+        for key, value in items:
+            self.put(key, value)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.values)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self.values)
+        stats["maxsize"] = self.maxsize
+        return stats
+
+
+def main():
+    cache = LruCache(3)
+    for key in [1, 2, 3, 1, 4, 2, 1]:
+        print(key, cache.get(key, lambda k: k * k), list(cache.values))
+    print(cache.get_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ Optional in future:
 
 Responsibility:
 - Calculate the fan power switches
+- the thresholds and the rules are configured in Rules.json and evaluated by Rules (names as used below)
 
 - calculate the fan settings on change of the radon value with hysteresis between RADON_BQ_FAN_ON and RADON_BQ_FAN_OFF
 -- if no radon value is available in case of errors, ventilation is not requested
@@ -39,6 +40,15 @@ Responsibility:
 -- if no external temperature is available in case of errors, ventilation is disallowed
 -- if the external temperature falls below MIN_EXTERNAL_TEMP, ventilation is disallowed
 
+Architecture:
+- the callbacks of the sensors (RD200, DHT22, DS18B20) and on_time of the View are called by different threads
+- the state is an immutable ModelState; a callback takes the current snapshot, calculates the changes (copy-on-write),
+  and publishes the new snapshot with one atomic swap of the reference; the ventilation and the switches of a
+  snapshot are calculated by the same evaluation of the rules, thus a fan decision is always based on a consistent state
+- the rule engine evaluates only the rules whose inputs changed and records which rule flipped each switch
+  (get_switch_causes)
+- the callbacks (writers) are serialized by a lock, readers take snapshot() without lock and never block a writer
+
 Optional in future:
 - controll the out-fan and in-fan power switches independently
 - calculate the fan settings on change of the out-fan-off from the differential preassure monitor
@@ -49,391 +59,308 @@ Optional in future:
    in order to prevent exhaust gas to be pulled in through the chimney
 """
 
+import threading
 import time
-from Database import Database
+from Storage import create_storage
+from ModelState import ModelState
+from Rules import Rules
 from Formulas import get_lim, get_absolute_humidity
 
 
-RADON_BQ_FAN_ON = 150  # if the Radon Bq value is >= this limit, the ventilation shall start (if other conditons allow)
-RADON_BQ_FAN_OFF = 75  # if the Radon Bq value is <= this limit, the ventilation shall stop
-
-HUMIDITY_FAN_ON =  67.5  # if the relative humidity is >= this limit, the ventilation shall start (if other conditons allow)
-HUMIDITY_FAN_OFF = 62.5  # if the relative humidity is <= this limit, the ventilation shall stop
-
-DEWPOINT_FAN_ON =   3  # if the dewpoint difference is >= this limit, the ventilation may start (if other conditons allow)
-DEWPOINT_FAN_OFF =  1  # if the dewpoint difference is <= this limit, the ventilation has to stop
-
-MIN_INTERNAL_TEMP_ON  = 7.6  # ventilation is allowed >= this internal temperature
-MIN_INTERNAL_TEMP_OFF = 7.4  # no ventilation is allowed <= this internal temperature
-
-MIN_EXTERNAL_TEMP_ON  =  -9.9  # ventilation is allowed >= this external temperature
-MIN_EXTERNAL_TEMP_OFF = -10.1  # no ventilation is allowed <= this external temperature
-
-FORTLUFT_TEMP_HEATER_ON  = 2.5 # heater on when "Fortluft" is below 2.5°C
-FORTLUFT_TEMP_HEATER_OFF = 3.5 # heater off when "Fortluft" is above 3.5°C
-
 class Model():
-    def __init__(self, view, verbose=False):
+    def __init__(self, view, db=None, verbose=False, rules=None):
         self.verbose = verbose
         self.view = view
         self.view.model = self
+        self.lock = threading.RLock()  # serializes the writers, readers take a snapshot without lock
+
+        self.state = ModelState.create(
+            # RD200 / radon sensor
+            radon={"Bq": None, "error": None},
+
+            # DHT22 / dewpoint sensors
+            dewpoints={
+                "ext": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
+                "NO": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
+                "SO": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
+                "SW": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
+                "NW": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
+            },
+            internal={"temperature": None, "humidity": None, "dewpoint_min": None, "dewpoint_max": None, "error": None, "key": None},
+            external={"temperature": None, "humidity": None, "dewpoint": None, "error": None},
+            dp_communication_errors=["ext", "NO", "SO", "SW", "NW"],
+
+            # DS18B20 / air stream temperature sensors
+            air_stream={
+                "Ak": {"temperature": None, "error": None},
+                "Aw": {"temperature": None, "error": None},
+                "FL": {"temperature": None, "error": None},
+                "ZL": {"temperature": None, "error": None},
+                "AL": {"temperature": None, "error": None},
+            },
+            as_communication_errors=["Ak", "Aw", "FL", "ZL", "AL"],
+
+            ventilation={
+                "radon_request": None,
+                "humidity_request": None,
+                "heater_request": None,
+                "dewpoint_granted": None,
+                "internal_temp_granted": None,
+                "external_temp_granted": None,
+            },
+            switches={
+                "out_fan_on": None,
+                "in_fan_on": None,
+                "heater_on": None,
+            },
+        )
+        self.rules = rules if rules is not None else Rules()
+        self.rules.seed(self.rule_inputs_dp(self.state.internal, self.state.external))
+        self.rules.seed({"FL_temperature": self.state.air_stream["FL"]["temperature"]})
+        self.show_west = True
+        self.db = db if db is not None else create_storage()  # see Storage.STORAGE_BACKEND
+        self.t_next_write = None  # next time to write ventilatoin and switches to the db, at last once a minute
 
-        # RD200 / radon sensor
-        self.radon = {"Bq": None, "error": None}
-
-        # DHT22 / dewpoint sensors
-        self.dewpoints = {
-            "ext": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
-            "NO": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
-            "SO": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
-            "SW": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
-            "NW": {"temperature": None, "humidity": None, "dewpoint": None, "error": None},
-        }
-        self.internal = {"temperature": None, "humidity": None, "dewpoint_min": None, "dewpoint_max": None, "error": None, "key": None}
-        self.external = {"temperature": None, "humidity": None, "dewpoint": None, "error": None}
-        self.dp_communication_errors = ["ext", "NO", "SO", "SW", "NW"]
-
-        # DS18B20 / air stream temperature sensors
-        self.air_stream = {
-            "Ak": {"temperature": None, "error": None},
-            "Aw": {"temperature": None, "error": None},
-            "FL": {"temperature": None, "error": None},
-            "ZL": {"temperature": None, "error": None},
-            "AL": {"temperature": None, "error": None},
+    def snapshot(self):
+        """The current state, immutable and consistent (see ModelState); never blocks."""
+        return self.state
+
+    def get_switch_causes(self):
+        """Per switch the rules that flipped it the last time, see Rules.get_cause"""
+        with self.lock:
+            return {switch: self.rules.get_cause(switch) for switch in self.state.switches}
+
+    def rule_inputs_dp(self, internal, external):
+        return {
+            "internal_humidity": internal["humidity"],
+            "internal_temperature": internal["temperature"],
+            "internal_dewpoint_min": internal["dewpoint_min"],
+            "internal_dewpoint_max": internal["dewpoint_max"],
+            "external_dewpoint": external["dewpoint"],
+            "external_temperature": external["temperature"],
         }
-        self.as_communication_errors = ["Ak", "Aw", "FL", "ZL", "AL"]
 
-        self.show_west = True
-        self.ventilation = {
-            "radon_request": None,
-            "humidity_request": None,
-            "heater_request": None,
-            "dewpoint_granted": None,
-            "internal_temp_granted": None,
-            "external_temp_granted": None,
-        }
-        self.switches = {
-            "out_fan_on": None,
-            "in_fan_on": None,
-            "heater_on": None,
-        }
-        self.db = Database()
-        self.t_next_write = None  # next time to write ventilatoin and switches to the db, at last once a minute
+    def publish(self, old, rule_inputs, **changes):
+        """
+        Evaluate the rules with the inputs and publish a new state with the changes, the ventilation, and the
+        switches; thus the ventilation and the switches of a snapshot always belong together. The lock must be held.
+        """
+        self.rules.update(rule_inputs)
+        changes["ventilation"] = {name: self.rules.get(name) for name in old.ventilation}
+        changes["switches"] = {name: self.rules.get(name) for name in old.switches}
+        new = old.replace(**changes)
+        self.state = new  # atomic swap of the reference
+        return new
+
+    def stop(self):
+        self.db.close()  # flush the points queued for the database
 
     def on_time(self):
-        if self.show_west:
-            north = "NW"
-            south = "SW"
-            self.show_west = False
-        else:
-            north = "NO"
-            south = "SO"
-            self.show_west = True
-        self.view.on_change_north(
-            self.dewpoints[north]["temperature"],
-            self.dewpoints[north]["humidity"],
-            self.dewpoints[north]["dewpoint"],
-            north)
-        self.view.on_change_south(
-            self.dewpoints[south]["temperature"],
-            self.dewpoints[south]["humidity"],
-            self.dewpoints[south]["dewpoint"],
-            south)
-        if self.t_next_write is not None:
-            # at least one time ventilation and switches have been calculated
-            if time.time() >= self.t_next_write:
-                self.t_next_write = time.time() + 57.5  # will sync to roughly 1 minute as on_time is called every 5 seconds
-                self.db.write_ventilation(self.ventilation)
-                self.db.write_switches(self.switches)
+        with self.lock:
+            state = self.state
+            if self.show_west:
+                north = "NW"
+                south = "SW"
+                self.show_west = False
+            else:
+                north = "NO"
+                south = "SO"
+                self.show_west = True
+            self.view.on_change_north(
+                state.dewpoints[north]["temperature"],
+                state.dewpoints[north]["humidity"],
+                state.dewpoints[north]["dewpoint"],
+                north)
+            self.view.on_change_south(
+                state.dewpoints[south]["temperature"],
+                state.dewpoints[south]["humidity"],
+                state.dewpoints[south]["dewpoint"],
+                south)
+            if self.t_next_write is not None:
+                # at least one time ventilation and switches have been calculated
+                if time.time() >= self.t_next_write:
+                    self.t_next_write = time.time() + 57.5  # will sync to roughly 1 minute as on_time is called every 5 seconds
+                    timestamp = int(time.time())  # one timestamp for all points of this tick
+                    self.db.write_ventilation(state.ventilation, timestamp)
+                    self.db.write_switches(state.switches, timestamp)
 
     def on_update_radon(self, Bq, error):
-        self.db.write_RD200(Bq, error)  # will be written every 10 minutes due to RD200 module
-        if self.radon["Bq"] != Bq:
-            self.radon["Bq"] = Bq
-            self.view.on_change_radon(Bq)
-        if self.radon["error"] != error:
-            self.radon["error"] = error
-            self.on_change_communication_errors()
-
-        radon_request = self.ventilation["radon_request"]  # default for hyteresis
-        if error:                                          # error handling
-            radon_request = False
-        elif Bq >= RADON_BQ_FAN_ON:                        # hyteresis high
-            radon_request = True
-        elif Bq <= RADON_BQ_FAN_OFF:                       # hyteresis low
-            radon_request = False
-        if self.ventilation["radon_request"] != radon_request:
-            self.ventilation["radon_request"] = radon_request
-            self.on_change_ventilation()
+        with self.lock:
+            old = self.state
+            self.db.write_RD200(Bq, error)  # will be written every 10 minutes due to RD200 module
+            radon = None if error else Bq  # no value in case of errors
+            new = self.publish(old, {"radon": radon}, radon={"Bq": Bq, "error": error})
+            if old.radon["Bq"] != Bq:
+                self.view.on_change_radon(Bq)
+            if old.radon["error"] != error:
+                self.on_change_communication_errors(new)
+            if old.ventilation != new.ventilation:
+                self.on_change_ventilation(old, new)
 
     def on_update_dewpoints(self, averaged):
-        self.dewpoints = averaged
-
-        # select internal minimum dewpoint
-        min_internal_temperature = None
-        max_internal_humidity = None
-        min_internal_dewpoint = None
-        max_internal_dewpoint = None
-        communication_errors = []
-        for key in averaged:
-            temperature = averaged[key]["temperature"]
-            rH = averaged[key]["humidity"]
-            aH = None
-            lim = None
-            if temperature is not None:
-                lim = get_lim(temperature)
-                if rH is not None:
-                    aH = get_absolute_humidity(temperature, rH)
-            self.db.write_DHT22(  # will be written every 20 seconds due to Dewpoint module
-                key=key,
-                temperature=temperature,
-                rH=rH,
-                dewpoint=averaged[key]["dewpoint"],
-                aH=aH,
-                lim=lim,
-                error=averaged[key]["error"],
-            )
-            if averaged[key]["dewpoint"] is not None:  # if dewpoint is present, also temperature and humidity are present
-                if "ext" != key:
-                    if min_internal_temperature is None:
-                        min_internal_temperature = averaged[key]["temperature"]
-                    elif min_internal_temperature > averaged[key]["temperature"]:
-                        min_internal_temperature = averaged[key]["temperature"]
-
-                    if max_internal_humidity is None:
-                        max_internal_humidity = averaged[key]["humidity"]
-                    elif max_internal_humidity < averaged[key]["humidity"]:
-                        max_internal_humidity = averaged[key]["humidity"]
-
-                    if min_internal_dewpoint is None:
-                        min_internal_dewpoint = averaged[key]["dewpoint"]
-                    elif min_internal_dewpoint > averaged[key]["dewpoint"]:
-                        min_internal_dewpoint = averaged[key]["dewpoint"]
-
-                    if max_internal_dewpoint is None:
-                        max_internal_dewpoint = averaged[key]["dewpoint"]
-                    elif max_internal_dewpoint < averaged[key]["dewpoint"]:
-                        max_internal_dewpoint = averaged[key]["dewpoint"]
-
-            else:
-                communication_errors.append(key)
-        internal = {
-            "temperature": min_internal_temperature,
-            "humidity": max_internal_humidity,
-            "dewpoint_min": min_internal_dewpoint,
-            "dewpoint_max": max_internal_dewpoint,
-            "error": min_internal_dewpoint is not None,  # if dewpoint is present, also temperature and humidity are present
-            "key": "in",
-        }
-
-        # collect external data
-        external = {
-            "temperature": averaged["ext"]["temperature"],
-            "humidity": averaged["ext"]["humidity"],
-            "dewpoint": averaged["ext"]["dewpoint"],
-            "error": averaged["ext"]["error"],
-        }
-
-        # callback if data changed
-        if (self.internal != internal) or (self.external != external):
+        with self.lock:
+            old = self.state
+
+            # select internal minimum dewpoint
+            min_internal_temperature = None
+            max_internal_humidity = None
+            min_internal_dewpoint = None
+            max_internal_dewpoint = None
+            communication_errors = []
+            timestamp = int(time.time())  # one timestamp for all points of this tick
+            for key in averaged:
+                temperature = averaged[key]["temperature"]
+                rH = averaged[key]["humidity"]
+                aH = None
+                lim = None
+                if temperature is not None:
+                    lim = get_lim(temperature)
+                    if rH is not None:
+                        aH = get_absolute_humidity(temperature, rH)
+                self.db.write_DHT22(  # will be written every 20 seconds due to Dewpoint module
+                    key=key,
+                    temperature=temperature,
+                    rH=rH,
+                    dewpoint=averaged[key]["dewpoint"],
+                    aH=aH,
+                    lim=lim,
+                    error=averaged[key]["error"],
+                    timestamp=timestamp,
+                )
+                if averaged[key]["dewpoint"] is not None:  # if dewpoint is present, also temperature and humidity are present
+                    if "ext" != key:
+                        if min_internal_temperature is None:
+                            min_internal_temperature = averaged[key]["temperature"]
+                        elif min_internal_temperature > averaged[key]["temperature"]:
+                            min_internal_temperature = averaged[key]["temperature"]
+
+                        if max_internal_humidity is None:
+                            max_internal_humidity = averaged[key]["humidity"]
+                        elif max_internal_humidity < averaged[key]["humidity"]:
+                            max_internal_humidity = averaged[key]["humidity"]
+
+                        if min_internal_dewpoint is None:
+                            min_internal_dewpoint = averaged[key]["dewpoint"]
+                        elif min_internal_dewpoint > averaged[key]["dewpoint"]:
+                            min_internal_dewpoint = averaged[key]["dewpoint"]
+
+                        if max_internal_dewpoint is None:
+                            max_internal_dewpoint = averaged[key]["dewpoint"]
+                        elif max_internal_dewpoint < averaged[key]["dewpoint"]:
+                            max_internal_dewpoint = averaged[key]["dewpoint"]
+
+                else:
+                    communication_errors.append(key)
+            internal = {
+                "temperature": min_internal_temperature,
+                "humidity": max_internal_humidity,
+                "dewpoint_min": min_internal_dewpoint,
+                "dewpoint_max": max_internal_dewpoint,
+                "error": min_internal_dewpoint is not None,  # if dewpoint is present, also temperature and humidity are present
+                "key": "in",
+            }
+
+            # collect external data
+            external = {
+                "temperature": averaged["ext"]["temperature"],
+                "humidity": averaged["ext"]["humidity"],
+                "dewpoint": averaged["ext"]["dewpoint"],
+                "error": averaged["ext"]["error"],
+            }
+
+            # the averaged data is copied into the snapshot, the caller may change it afterwards
+            changes = {"dewpoints": averaged, "dp_communication_errors": communication_errors}
             diff_internal = []
             diff_external = []
-            for key in internal:
-                if (key not in self.internal) or (self.internal[key] != internal[key]):
-                    diff_internal.append(key)
-            for key in external:
-                if (key not in self.external) or (self.external[key] != external[key]):
-                    diff_external.append(key)
-            self.internal = internal
-            self.external = external
-            self.on_change_dp(diff_internal, diff_external)
-        if self.dp_communication_errors != communication_errors:
-            self.dp_communication_errors = communication_errors
-            self.on_change_communication_errors()
+            if (old.internal != internal) or (old.external != external):
+                for key in internal:
+                    if (key not in old.internal) or (old.internal[key] != internal[key]):
+                        diff_internal.append(key)
+                for key in external:
+                    if (key not in old.external) or (old.external[key] != external[key]):
+                        diff_external.append(key)
+                changes["internal"] = internal
+                changes["external"] = external
+                self.on_change_dp(internal, external, diff_internal, diff_external)
+
+            new = self.publish(old, self.rule_inputs_dp(internal, external), **changes)
+            if old.ventilation != new.ventilation:
+                self.on_change_ventilation(old, new)
+            if "humidity" in diff_external:  # view only relevant changes
+                self.on_change_external_humidity(new.external["humidity"])
+            if old.dp_communication_errors != new.dp_communication_errors:
+                self.on_change_communication_errors(new)
 
     def on_update_air_stream_temperatures(self, averaged):
-        # update communcation errors
-        communication_errors = []
-        for key in averaged:
-            self.db.write_DS18B20(  # will be written every 20 seconds due to DS18B20 module
-                key=key,
-                temperature=averaged[key]["temperature"],
-                error=averaged[key]["error"],
-            )
-            if averaged[key]["error"]:
-                communication_errors.append(key)
-        if self.as_communication_errors != communication_errors:
-            self.as_communication_errors = communication_errors
-            self.on_change_communication_errors()
-
-        # update ventilation (which is only dependant on the Fortluft temperature)
-        # When the Fortluft temperature drops close to the freezing point, the heater request is switched on,
-        # when the Fortluft temperature recovers, the heater request is switched off.
-        # A heater request does not mean the heater is actually switched on.
-        # The heater request is only fulfilled if also the in_fan is on.
-        if self.air_stream["FL"]["temperature"] != averaged["FL"]["temperature"]:
-            heater_request = self.ventilation["heater_request"] # default for hysteresis
-            if averaged["FL"]["temperature"] is None:                          # error handling
-                heater_request = False
-            elif averaged["FL"]["temperature"] >= FORTLUFT_TEMP_HEATER_OFF:    # hyteresis high
-                heater_request = False
-            elif averaged["FL"]["temperature"] <= FORTLUFT_TEMP_HEATER_ON:     # hysteresis low
-                heater_request = True
-
-            if self.ventilation["heater_request"] != heater_request:
-                self.ventilation["heater_request"] = heater_request
-                self.on_change_ventilation()
-
-        for key1 in self.air_stream:
-            for key2 in self.air_stream[key1]:
-                if self.air_stream[key1][key2] != averaged[key1][key2]:
-                    self.air_stream[key1][key2] = averaged[key1][key2]
-
-    def on_change_dp(self, diff_internal, diff_external):
+        with self.lock:
+            old = self.state
+            # update communcation errors
+            communication_errors = []
+            timestamp = int(time.time())  # one timestamp for all points of this tick
+            for key in averaged:
+                self.db.write_DS18B20(  # will be written every 20 seconds due to DS18B20 module
+                    key=key,
+                    temperature=averaged[key]["temperature"],
+                    error=averaged[key]["error"],
+                    timestamp=timestamp,
+                )
+                if averaged[key]["error"]:
+                    communication_errors.append(key)
+
+            # update ventilation (which is only dependant on the Fortluft temperature)
+            # When the Fortluft temperature drops close to the freezing point, the heater request is switched on,
+            # when the Fortluft temperature recovers, the heater request is switched off.
+            # A heater request does not mean the heater is actually switched on.
+            # The heater request is only fulfilled if also the in_fan is on.
+            air_stream = {key1: {key2: averaged[key1][key2] for key2 in old.air_stream[key1]} for key1 in old.air_stream}
+            new = self.publish(old, {"FL_temperature": averaged["FL"]["temperature"]}, air_stream=air_stream, as_communication_errors=communication_errors)
+            if old.as_communication_errors != new.as_communication_errors:
+                self.on_change_communication_errors(new)
+            if old.ventilation != new.ventilation:
+                self.on_change_ventilation(old, new)
+
+    def on_change_dp(self, internal, external, diff_internal, diff_external):
         if self.verbose:
             if diff_internal:
-                print("internal", self.internal, diff_internal)
+                print("internal", internal, diff_internal)
             if diff_external:
-                print("external", self.external, diff_external)
+                print("external", external, diff_external)
 
-        # ventilation and view relevant changes
-        ventilation_is_changed = False
-        if "humidity" in diff_internal:
-            ventilation_is_changed |= self.on_change_internal_humidity(self.internal["humidity"])
+        # view relevant changes, the ventilation is calculated by the rules
         if ("dewpoint_min" in diff_internal) or ("dewpoint_max" in diff_internal) or ("dewpoint" in diff_external):
-            ventilation_is_changed |= self.on_change_dewpoint(self.internal["dewpoint_min"], self.internal["dewpoint_max"], self.external["dewpoint"])
-        if "temperature" in diff_internal:
-            ventilation_is_changed |= self.on_change_internal_temperature(self.internal["temperature"])
+            self.view.on_change_external_dewpoint(external["dewpoint"])
         if "temperature" in diff_external:
-            ventilation_is_changed |= self.on_change_external_temperature(self.external["temperature"])
-        if ventilation_is_changed:
-            self.on_change_ventilation()
-
-        # view only relevant changes
-        if "humidity" in diff_external:
-            self.on_change_external_humidity(self.external["humidity"])
-
-    def on_change_internal_humidity(self, internal_humidity):
-        humidity_request = self.ventilation["humidity_request"]         # default for hyteresis
-        if internal_humidity is None:                                   # error handling
-            humidity_request = False
-        elif internal_humidity >= HUMIDITY_FAN_ON:                      # hyteresis high
-            humidity_request = True
-        elif internal_humidity <= HUMIDITY_FAN_OFF:                     # hyteresis low
-            humidity_request = False
-
-        ventilation_is_changed = False
-        if self.ventilation["humidity_request"] != humidity_request:
-            self.ventilation["humidity_request"] = humidity_request
-            ventilation_is_changed = True
-        return ventilation_is_changed
-
-    def on_change_dewpoint(self, internal_dewpoint_min, internal_dewpoint_max, external_dewpoint):
-        self.view.on_change_external_dewpoint(external_dewpoint)
-        dewpoint_granted = self.ventilation["dewpoint_granted"]         # default for hyteresis
-        if (internal_dewpoint_min is None) or (internal_dewpoint_max is None) or (external_dewpoint is None):  # error handling
-            dewpoint_granted = False
-        else:
-            diff_dewpoint_max = internal_dewpoint_max - external_dewpoint
-            diff_dewpoint_min = internal_dewpoint_min - external_dewpoint
-            if diff_dewpoint_max >= DEWPOINT_FAN_ON:                    # hyteresis high based on highest dewpoint
-                dewpoint_granted = True
-            if diff_dewpoint_min <= DEWPOINT_FAN_OFF:                   # hyteresis low based on loweest dewpoint
-                dewpoint_granted = False
-
-        ventilation_is_changed = False
-        if self.ventilation["dewpoint_granted"] != dewpoint_granted:
-            self.ventilation["dewpoint_granted"] = dewpoint_granted
-            ventilation_is_changed = True
-        return ventilation_is_changed
-
-    def on_change_internal_temperature(self, internal_temperature):
-        internal_temp_granted = self.ventilation["internal_temp_granted"]  # default for hysteresis
-        if internal_temperature is None:                                   # error handling
-            internal_temp_granted = False
-        elif internal_temperature >= MIN_INTERNAL_TEMP_ON:                 # hyteresis high
-            internal_temp_granted = True
-        elif internal_temperature <= MIN_INTERNAL_TEMP_OFF:                # hyteresis low
-            internal_temp_granted = False
-
-        ventilation_is_changed = False
-        if self.ventilation["internal_temp_granted"] != internal_temp_granted:
-            self.ventilation["internal_temp_granted"] = internal_temp_granted
-            ventilation_is_changed = True
-        return ventilation_is_changed
-
-    def on_change_external_temperature(self, external_temperature):
-        self.view.on_change_external_temperature(external_temperature)
-        external_temp_granted = self.ventilation["external_temp_granted"]  # default for hysteresis
-        if external_temperature is None:                                   # error handling
-            external_temp_granted = False
-        elif external_temperature >= MIN_EXTERNAL_TEMP_ON:                 # hyteresis high
-            external_temp_granted = True
-        elif external_temperature <= MIN_EXTERNAL_TEMP_OFF:                # hyteresis low
-            external_temp_granted = False
-
-        ventilation_is_changed = False
-        if self.ventilation["external_temp_granted"] != external_temp_granted:
-            self.ventilation["external_temp_granted"] = external_temp_granted
-            ventilation_is_changed = True
-        return ventilation_is_changed
-
-    def on_change_ventilation(self):
-        self.db.write_ventilation(self.ventilation)
+            self.view.on_change_external_temperature(external["temperature"])
+
+    def on_change_ventilation(self, old, new):
+        timestamp = int(time.time())  # one timestamp for all points of this change
+        self.db.write_ventilation(new.ventilation, timestamp)
         self.t_next_write = time.time() + 57.5  # will sync to roughly 1 minute as on_time is called every 5 seconds
-        if self.ventilation["radon_request"] or self.ventilation["humidity_request"]:
-            # request by at least one of radon or humidity
-            if self.ventilation["dewpoint_granted"] \
-            and self.ventilation["internal_temp_granted"] \
-            and self.ventilation["external_temp_granted"]:
-                # dewpoint difference, internal and exteranl temperatures are above the limits
-                out_fan_on = True
-                in_fan_on = True
-                heater_on = True if self.ventilation["heater_request"] else False
-            else:
-                # at minimum one of dewpoint difference, internal or exteranl temperatures is below the limits
-                out_fan_on = False
-                in_fan_on = False
-                heater_on = False
-        else:
-            # no request by neitehr radon nor humidity
-            out_fan_on = False
-            in_fan_on = False
-            heater_on = False
-
-        # calculate changes for power switch settings
-        switches_changed = False
-        if self.switches["out_fan_on"] != out_fan_on:
-            self.switches["out_fan_on"] = out_fan_on
-            switches_changed = True
-        if self.switches["in_fan_on"] != in_fan_on:
-            self.switches["in_fan_on"] = in_fan_on
-            switches_changed = True
-        if self.switches["heater_on"] != heater_on:
-            self.switches["heater_on"] = heater_on
-            switches_changed = True
         if self.verbose:
-            print(self.ventilation)
-            print(self.switches)
-        if switches_changed:
-            self.db.write_switches(self.switches)
-            self.view.on_change_switches(self.switches)
+            print(new.ventilation)
+            print(new.switches)
+            for switch in new.switches:
+                if old.switches[switch] != new.switches[switch]:
+                    print(switch, new.switches[switch], "by", self.rules.get_cause(switch)["rules"])
+        if old.switches != new.switches:
+            self.db.write_switches(new.switches, timestamp)
+            self.view.on_change_switches(new.switches)
 
     def on_change_external_humidity(self, external_humidity):
         self.view.on_change_external_humidity(external_humidity)
 
-    def on_change_communication_errors(self):
-        if self.radon["error"] or len(self.dp_communication_errors) or len(self.as_communication_errors):
+    def on_change_communication_errors(self, state):
+        if state.radon["error"] or len(state.dp_communication_errors) or len(state.as_communication_errors):
             self.view.on_change_communication_error(True)
         else:
             self.view.on_change_communication_error(False)
         if self.verbose:
-            if self.radon["error"]:
+            if state.radon["error"]:
                 print("radon communication errors")
-            if self.dp_communication_errors:
-                print("dewpoint communication errors", self.dp_communication_errors)
-            if self.as_communication_errors:
-                print("air stream communication errors", self.as_communication_errors)
+            if state.dp_communication_errors:
+                print("dewpoint communication errors", list(state.dp_communication_errors))
+            if state.as_communication_errors:
+                print("air stream communication errors", list(state.as_communication_errors))
 
 
 def main():
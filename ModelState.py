@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Immutable snapshot of the state of the Model.
+
+Responsibility:
+- hold the data of the Model (sensor values, ventilation, switches, communication errors) as one immutable value
+- copy-on-write: replace() returns a new snapshot with the given fields replaced, the unchanged fields are shared
+- count the versions, each replace() increments the version
+
+Architecture:
+- a namedtuple of frozen values: dicts become read-only mappings (MappingProxyType of a copy), lists become tuples,
+  nested values are frozen as well; thus a snapshot can be handed to any thread (View, database, telemetry)
+- the Model publishes a new snapshot by one assignment of its reference (atomic in Python), readers take the
+  reference without a lock and never see a half-updated state
+- main is for demonstration
+"""
+
+from collections import namedtuple
+from types import MappingProxyType
+
+
+FIELDS = [
+    "radon",                    # RD200: {"Bq", "error"}
+    "dewpoints",                # DHT22: key -> {"temperature", "humidity", "dewpoint", "error"}
+    "internal",                 # combined internal DHT22 sensors
+    "external",                 # external DHT22 sensor
+    "dp_communication_errors",  # keys of the DHT22 sensors with errors
+    "air_stream",               # DS18B20: key -> {"temperature", "error"}
+    "as_communication_errors",  # keys of the DS18B20 sensors with errors
+    "ventilation",              # requests and grants
+    "switches",                 # fans and heater
+    "version",
+]
+
+
+def freeze(value):
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Mutable deep copy of a frozen value."""
+    if isinstance(value, MappingProxyType):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+class ModelState(namedtuple("ModelState", FIELDS)):
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, **fields):
+        return cls(**{field: freeze(fields.get(field)) for field in FIELDS if field != "version"}, version=0)
+
+    def replace(self, **changes):
+        """New snapshot with the given fields replaced."""
+        return self._replace(**{field: freeze(value) for field, value in changes.items()}, version=self.version + 1)
+
+
+def main():
+    import threading
+    import time
+
+    state = ModelState.create(ventilation={"radon_request": None}, switches={"out_fan_on": None, "in_fan_on": None})
+    inconsistent = 0
+
+    def writer():
+        nonlocal state
+        for i in range(100000):
+            on = (i % 2) == 0
+            state = state.replace(ventilation={"radon_request": on}, switches={"out_fan_on": on, "in_fan_on": on})
+
+    def reader():
+        nonlocal inconsistent
+        while thread.is_alive():
+            snapshot = state
+            if not (snapshot.ventilation["radon_request"] == snapshot.switches["out_fan_on"] == snapshot.switches["in_fan_on"]):
+                inconsistent += 1
+
+    thread = threading.Thread(target=writer)
+    start = time.monotonic()
+    thread.start()
+    reader()
+    print("version", state.version, "inconsistent snapshots", inconsistent, "{:.2f} s".format(time.monotonic() - start))
+    try:
+        state.switches["out_fan_on"] = True
+    except TypeError as e:
+        print("snapshots are immutable:", e)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,72 +6,80 @@ The RD200 has an update frequency of 10 minutes and a moving average of 60 minut
 The first value can be obtained 10 minutes after power on.
 
 Responsibility:
-- cyclicylly read the sensor every minute with an external application (in order to detect an update of the data with a maximum delay of 1 minute)
-- the return value shall be converted into a float number, if not possible, an error shall be set
+- read the sensor in order to detect an update of the data with a maximum delay of about 1 minute
+-- RD200Scheduler learns the phase of the 10 minute update cycle and polls densely only around the expected update
+-- until the phase is known or after the sync is lost, the sensor is read every minute
+- if no value can be read, an error shall be set
 - on change of either the Bq value or the error or a timeout of 10 minuts inform the client with a callback
 
 Architecture:
-- external application is executed as subprocess
-- the return value of the application is expected to be a single float value for the number of Bq, but in case of errors it can also be an error string
-- the external application can stall quite a while i.e. because of device failures, bad connection, or another device connected
-- For ths reason a timer cannot be used. We sahll avoid to start multiple processes in parallel.
+- the sensor is read in-process with RD200Client, which keeps the BLE connection open and reconnects with backoff
+  (formerly the external application radonreader was executed as subprocess for each read)
+- a read can stall quite a while i.e. because of device failures, bad connection, or another device connected,
+  RD200Client gives up after a hard timeout
+- For ths reason a periodic timer cannot be used. We sahll avoid to start multiple reads in parallel.
+  The next read is scheduled as one-shot job of the shared Scheduler when the previous read is done.
+- AsyncRuntime does not start RD200, it calls get_radon_value in its executor and on_poll on its event loop
+- the transport can be replaced, i.e. by the MockTransport of RD200Client to run without Bluetooth
 """
 
-import subprocess
 import threading
 import time
+from RD200Client import RD200Client, BluepyTransport
+from RD200Scheduler import RD200Scheduler
+from Scheduler import get_scheduler
 
 MAC_ADDRESS = "90:38:0C:58:96:D6"
 TYPE = 1  # 0 < 2022; 1 >= 2022
 
 
-class RD200(threading.Thread):
-    def __init__(self, on_update):
-        threading.Thread.__init__(self)
+class RD200():
+    def __init__(self, on_update, transport=None):
         self.on_update = on_update
+        if transport is None:
+            transport = BluepyTransport(MAC_ADDRESS, TYPE)
+        self.client = RD200Client(transport)
+        self.scheduler = RD200Scheduler()
         self.should_stop = threading.Event() # create an unset event on init
+        self.lock = threading.Lock()  # stop waits for a running read
+        self.job = None
         self.Bq = None
         self.error = None
-        self.t_next_read = time.time()
         self.t_next_send = time.time()
 
     def get_radon_value(self):
-        Bq = None
-        result = None
-        try:
-            command = "python radonreader/radon_reader.py -a {} -t {} -b -s".format(MAC_ADDRESS, TYPE).split()
-            result = subprocess.run(command, stdout=subprocess.PIPE)
-            Bq = float(result.stdout)
-        except Exception as e:
-            if result is not None:
-                print(result)
-            print(e)
-        return Bq
-
-    def run(self):
-        while not self.should_stop.is_set():
-            if time.time() >= self.t_next_read:
-                self.t_next_read += 60  # next desired read in 60 seconds
-                Bq = self.get_radon_value()
-                if Bq is None:
-                    error = True
-                else:
-                    error = False
-                if (self.Bq != Bq) or (self.error != error) or (time.time() >= self.t_next_send):
-                    self.t_next_send = time.time() + 570 # send next time in 9:30 (will sync to 10 minutes due to self.t_next_read)
-                    self.Bq = Bq
-                    self.error = error
-                    self.on_update(self.Bq, self.error)
-
-            t_sleep = self.t_next_read - time.time()
-            if t_sleep > 1:
-                t_sleep = 1  # do not wait longer than one second in order to stop asap
-            if t_sleep < 0:
-               t_sleep = 0  # avoid exception due to negative time
-            time.sleep(t_sleep)
+        return self.client.get_radon_value()
+
+    def read(self):
+        with self.lock:
+            if self.should_stop.is_set():
+                return
+            t_next_read = self.on_poll(self.get_radon_value())
+            self.job = get_scheduler().after(t_next_read - time.time(), self.read)
+
+    def on_poll(self, Bq):
+        """Result of a read, returns the time of the next read."""
+        self.scheduler.on_poll(time.time(), Bq)
+        if Bq is None:
+            error = True
+        else:
+            error = False
+        if (self.Bq != Bq) or (self.error != error) or (time.time() >= self.t_next_send):
+            self.t_next_send = time.time() + 570 # send next time in 9:30 (will sync to 10 minutes due to the polls)
+            self.Bq = Bq
+            self.error = error
+            self.on_update(self.Bq, self.error)
+        return self.scheduler.next_poll(time.time())
+
+    def start(self):
+        self.job = get_scheduler().after(0, self.read)
 
     def stop(self):
         self.should_stop.set()
+        with self.lock:
+            if self.job is not None:
+                self.job.cancel()
+            self.client.close()
 
 
 cnt = 0
@@ -90,10 +98,7 @@ def main():
     while cnt < updates:
         time.sleep(0.1)
     print(time.time(), "stop")
-    radon_reader.stop()  # tell it to stop
-    if radon_reader.is_alive():
-        print(time.time(), "is_alive -> join")
-        radon_reader.join()  # wait for termination
+    radon_reader.stop()  # waits for a running read
     print(time.time(), "done")
 
 
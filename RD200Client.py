@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+
+"""
+In-process BLE client of the RadonEye RD200, replaces the radonreader subprocess.
+
+Responsibility:
+- keep the BLE connection to the RD200 open between the reads
+- read the radon value by writing the request command and reading the response characteristic (same protocol as radonreader)
+- every connect and read has a hard timeout, a stuck device or bluepy-helper does not block the caller
+- after a failure, disconnect and reconnect with an exponential backoff from BACKOFF_MIN up to BACKOFF_MAX seconds
+
+Architecture:
+- the transport does the BLE communication: BluepyTransport (bluepy, as used by radonreader) or MockTransport (tests)
+- all calls of the transport are executed by one worker thread, thus there are never two BLE operations in parallel;
+  the caller waits for the result at most the timeout; while a stuck call is still running, further reads fail immediately
+- get_radon_value() returns the Bq value as float or None in case of an error (like the former subprocess call)
+- main is for demonstration
+"""
+
+import queue
+import random
+import struct
+import threading
+import time
+
+
+CONNECT_TIMEOUT = 20.0  # seconds
+READ_TIMEOUT = 10.0     # seconds
+BACKOFF_MIN = 5.0       # seconds
+BACKOFF_MAX = 300.0     # seconds
+
+# (service, write characteristic, read characteristic, request command) per device type, see radonreader
+UUIDS = {
+    0: ("00001523-1212-efde-1523-785feabcd123", "00001524-1212-efde-1523-785feabcd123", "00001525-1212-efde-1523-785feabcd123", 0x50),  # < 2022
+    1: ("00001523-0000-1000-8000-00805f9b34fb", "00001524-0000-1000-8000-00805f9b34fb", "00001525-0000-1000-8000-00805f9b34fb", 0x40),  # >= 2022
+}
+
+
+class BluepyTransport():
+    def __init__(self, mac_address, device_type):
+        self.mac_address = mac_address
+        self.device_type = device_type
+        self.peripheral = None
+        self.write_characteristic = None
+        self.read_characteristic = None
+
+    def connect(self):
+        from bluepy import btle  # imported on first use, not needed for the MockTransport
+        service_uuid, write_uuid, read_uuid, _ = UUIDS[self.device_type]
+        try:
+            self.disconnect()  # a connection left over by a read that timed out
+        except Exception as e:
+            print(e)
+        self.peripheral = btle.Peripheral(self.mac_address)
+        service = self.peripheral.getServiceByUUID(service_uuid)
+        self.write_characteristic = service.getCharacteristics(write_uuid)[0]
+        self.read_characteristic = service.getCharacteristics(read_uuid)[0]
+
+    def read(self):
+        """The radon value in Bq/m³."""
+        command = UUIDS[self.device_type][3]
+        self.write_characteristic.write(bytes([command]), withResponse=True)
+        data = self.read_characteristic.read()
+        if self.device_type == 0:
+            return struct.unpack("<f", data[2:6])[0] * 37  # pCi/L -> Bq/m³
+        return struct.unpack("<H", data[2:4])[0]
+
+    def disconnect(self):
+        if self.peripheral is not None:
+            peripheral = self.peripheral
+            self.peripheral = None
+            peripheral.disconnect()
+
+
+class MockTransport():
+    def __init__(self, values=(42,), failure_rate=0.0, hang=0.0, duration=0.1):
+        """values are returned one after the other (the last one repeated), hang is the duration of a stuck read"""
+        self.values = list(values)
+        self.failure_rate = failure_rate
+        self.hang = hang
+        self.duration = duration
+        self.connected = False
+        self.connects = 0
+        self.reads = 0
+
+    def connect(self):
+        time.sleep(self.duration)
+        self.connects += 1
+        self.connected = True
+
+    def read(self):
+        if not self.connected:
+            raise RuntimeError("not connected")
+        time.sleep(self.duration)
+        self.reads += 1
+        if self.hang:
+            time.sleep(self.hang)
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Device disconnected")
+        if len(self.values) > 1:
+            return self.values.pop(0)
+        return self.values[0]
+
+    def disconnect(self):
+        self.connected = False
+
+
+class RD200Client():
+    def __init__(self, transport, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX):
+        self.transport = transport
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.connected = False
+        self.backoff = 0.0
+        self.t_next_connect = 0.0  # monotonic time
+        self.requests = queue.Queue()
+        self.busy = threading.Event()  # set while the worker executes a call of the transport
+        self.stats = {
+            "reads": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "connects": 0,
+        }
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def work(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            function, response = request
+            try:
+                result = (function(), None)
+            except Exception as e:
+                result = (None, e)
+            self.busy.clear()
+            response.put(result)
+
+    def call(self, function, timeout):
+        """Execute function in the worker thread, raise TimeoutError if it does not return within timeout."""
+        if self.busy.is_set():
+            raise TimeoutError("previous BLE call is still running")
+        response = queue.Queue(maxsize=1)
+        self.busy.set()
+        self.requests.put((function, response))
+        try:
+            result, error = response.get(timeout=timeout)
+        except queue.Empty:
+            self.stats["timeouts"] += 1
+            raise TimeoutError("BLE call did not return within {} s".format(timeout))
+        if error is not None:
+            raise error
+        return result
+
+    def fail(self, e):
+        print(e)
+        self.stats["failures"] += 1
+        self.connected = False
+        self.backoff = min(self.backoff_max, max(self.backoff_min, self.backoff * 2))
+        self.t_next_connect = time.monotonic() + self.backoff
+        if not self.busy.is_set():
+            try:
+                self.call(self.transport.disconnect, self.connect_timeout)
+            except Exception as e:
+                print(e)
+
+    def get_radon_value(self):
+        if not self.connected:
+            if time.monotonic() < self.t_next_connect:
+                return None  # backoff
+            try:
+                self.call(self.transport.connect, self.connect_timeout)
+                self.connected = True
+                self.stats["connects"] += 1
+            except Exception as e:
+                self.fail(e)
+                return None
+        try:
+            Bq = float(self.call(self.transport.read, self.read_timeout))
+            self.stats["reads"] += 1
+            self.backoff = 0.0
+            return Bq
+        except Exception as e:
+            self.fail(e)
+            return None
+
+    def get_stats(self):
+        return dict(self.stats, connected=self.connected, backoff=self.backoff)
+
+    def close(self):
+        if self.connected and not self.busy.is_set():
+            try:
+                self.call(self.transport.disconnect, self.connect_timeout)
+            except Exception as e:
+                print(e)
+        self.connected = False
+        self.requests.put(None)
+
+
+def main():
+    transport = MockTransport(values=[120, 120, 135], failure_rate=0.2)
+    client = RD200Client(transport, read_timeout=1.0, backoff_min=0.5, backoff_max=2.0)
+    for i in range(20):
+        print(client.get_radon_value(), client.get_stats())
+        time.sleep(0.3)
+
+    transport.hang = 3.0  # stuck device
+    for i in range(5):
+        start = time.monotonic()
+        print(client.get_radon_value(), "{:.1f} s".format(time.monotonic() - start), client.get_stats())
+        time.sleep(0.5)
+    transport.hang = 0.0
+    time.sleep(3.0)
+    print(client.get_radon_value(), client.get_stats())
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
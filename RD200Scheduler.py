@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+"""
+Poll scheduler that locks onto the 10 minute update cycle of the RD200.
+
+The RD200 updates its value every 10 minutes. Polling every minute detects an update within one minute,
+but nine out of ten BLE connections are wasted. This scheduler learns when the device updates and polls
+densely only around the expected update.
+
+Responsibility:
+- learn the phase of the update cycle: a changed value between two polls proves an update in between,
+  the intervals of several updates are intersected (projected by multiples of PERIOD) to narrow the phase
+- synced: poll the window of the expected update at most DENSE_INTERVAL apart, plus once at the end of the
+  window and once in the middle of the cycle (sparse), i.e. 2..3 polls per cycle instead of 10
+- the phase window is widened by DRIFT seconds per cycle without a new observation (clock drift)
+- not synced (start, lost sync): poll every DENSE_INTERVAL seconds, as before
+- sync is lost if an update is observed outside of the expected window or the window became wider than LOST_WIDTH
+- values of None (errors) and unchanged values do not carry phase information
+
+Architecture:
+- passive object, used by the thread of RD200: next_poll() tells when to poll, on_poll() reports the result
+- times are seconds since epoch, as used by RD200
+- main is a simulation that compares the number of polls and the detection latency with polling every minute
+"""
+
+import math
+
+
+PERIOD = 600            # seconds between two updates of the RD200
+DENSE_INTERVAL = 60     # seconds between two polls when not synced, and maximum distance of polls in the window
+MARGIN = 5              # seconds, the poll at the end of the window is done this much after the window
+MIN_WIDTH = 10          # seconds, narrower windows are not split by an additional poll
+DRIFT = 1               # seconds per cycle the window is widened on each side without a new observation
+LOST_WIDTH = PERIOD / 2 # seconds, a wider window is regarded as lost sync
+
+
+class RD200Scheduler():
+    def __init__(self, period=PERIOD, dense_interval=DENSE_INTERVAL, margin=MARGIN, min_width=MIN_WIDTH, drift=DRIFT, lost_width=LOST_WIDTH):
+        self.period = period
+        self.dense_interval = dense_interval
+        self.margin = margin
+        self.min_width = min_width
+        self.drift = drift
+        self.lost_width = lost_width
+        self.t_lo = None  # the last observed update happened between t_lo and t_hi
+        self.t_hi = None
+        self.synced = False
+        self.last_poll = None
+        self.last_value = None
+        self.last_value_poll = None  # time of the last poll with a valid value
+        self.stats = {
+            "polls": 0,
+            "updates": 0,
+            "syncs": 0,
+            "lost": 0,
+        }
+
+    def window(self, k):
+        """Expected window of the update k cycles after the last observed update, widened by the drift."""
+        widen = self.drift * abs(k)
+        return self.t_lo + k * self.period - widen, self.t_hi + k * self.period + widen
+
+    def observe(self, lo, hi):
+        """An update happened between lo and hi."""
+        self.stats["updates"] += 1
+        if self.t_lo is not None:
+            k = round(((lo + hi) / 2 - (self.t_lo + self.t_hi) / 2) / self.period)
+            w_lo, w_hi = self.window(k)
+            new_lo = max(lo, w_lo)
+            new_hi = min(hi, w_hi)
+            if new_lo <= new_hi:
+                self.t_lo, self.t_hi = new_lo, new_hi
+                if not self.synced:
+                    self.synced = True
+                    self.stats["syncs"] += 1
+                return
+            if self.synced:
+                print("RD200 update outside of the expected window, lost sync")
+                self.synced = False
+                self.stats["lost"] += 1
+        self.t_lo, self.t_hi = lo, hi
+
+    def on_poll(self, t, value):
+        """Result of the poll at time t, value is None in case of an error."""
+        self.stats["polls"] += 1
+        self.last_poll = t
+        if value is None:
+            return
+        if (self.last_value is not None) and (value != self.last_value):
+            self.observe(self.last_value_poll, t)
+        self.last_value = value
+        self.last_value_poll = t
+
+    def cycle_polls(self, k):
+        """Poll times of the cycle with the update k cycles after the last observed update."""
+        w_lo, w_hi = self.window(k)
+        width = w_hi - w_lo
+        polls = []
+        if width > self.min_width:
+            n = max(2, math.ceil(width / self.dense_interval))
+            polls += [w_lo + width * i / n for i in range(1, n)]
+        polls.append(w_hi + self.margin)
+        polls.append(w_hi + self.margin + self.period / 2)  # sparse poll, detects updates outside of the window
+        return polls
+
+    def next_poll(self, now):
+        if self.last_poll is None:
+            return now
+        if self.synced:
+            k = math.floor((now - self.t_hi) / self.period)
+            w_lo, w_hi = self.window(k + 1)
+            if w_hi - w_lo > self.lost_width:
+                print("RD200 update window too wide, lost sync")
+                self.synced = False
+                self.stats["lost"] += 1
+            else:
+                for j in [k - 1, k, k + 1, k + 2]:
+                    for t in self.cycle_polls(j):
+                        if t > now:
+                            return t
+        return max(now, self.last_poll + self.dense_interval)
+
+    def get_stats(self):
+        return dict(self.stats, synced=self.synced, width=None if self.t_lo is None else self.t_hi - self.t_lo)
+
+
+def simulate(hours, fixed, phase=123.4, jump_at=None, change_probability=0.8):
+    """Simulated RD200, returns the number of polls and the detection latencies of the changes."""
+    import random
+    random.seed(1)
+    scheduler = RD200Scheduler()
+    value = 100
+    updates = []  # (time, value)
+    t_end = hours * 3600
+    t = phase
+    while t < t_end:
+        if (jump_at is not None) and (t > jump_at):
+            t += 234.5  # power cut: the device starts a new cycle
+            jump_at = None
+        if random.random() < change_probability:
+            value += random.choice([-1, 1])
+            updates.append((t, value))
+        t += PERIOD
+
+    def device_value(t):
+        current = 100
+        for t_update, v in updates:
+            if t_update > t:
+                break
+            current = v
+        return current
+
+    polls = 0
+    latencies = []
+    detected = 100
+    pending = list(updates)
+    now = 0.0
+    while now < t_end:
+        current = device_value(now)
+        polls += 1
+        if current != detected:
+            while pending and pending[0][0] <= now:
+                t_update, _ = pending.pop(0)
+                if not pending or pending[0][0] > now:
+                    latencies.append(now - t_update)
+            detected = current
+        if fixed:
+            now += DENSE_INTERVAL
+        else:
+            scheduler.on_poll(now, current)
+            now = scheduler.next_poll(now)
+    return polls, latencies, scheduler
+
+
+def main():
+    for name, jump_at in [("steady", None), ("power cut after 12 h", 12 * 3600)]:
+        polls_fixed, latencies_fixed, _ = simulate(24, True, jump_at=jump_at)
+        polls, latencies, scheduler = simulate(24, False, jump_at=jump_at)
+        print(name)
+        print("    every minute: {:4d} polls, latency mean {:5.1f} s, max {:5.1f} s".format(polls_fixed, sum(latencies_fixed) / len(latencies_fixed), max(latencies_fixed)))
+        print("    phase locked: {:4d} polls, latency mean {:5.1f} s, max {:5.1f} s".format(polls, sum(latencies) / len(latencies), max(latencies)))
+        print("    ", scheduler.get_stats())
+
+
+if __name__ == '__main__':
+    main()
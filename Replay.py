@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+
+"""
+Replay of the stored sensor history through the decisions of the Model, to backtest changed thresholds.
+
+Responsibility:
+- read the history of DHT22, DS18B20, and RD200 from the files of LocalStore or from an export file of Database
+  (line protocol), optionally limited to a time window
+- exact mode: feed the history tick by tick into the real Model with the rules of Rules.json,
+  the storage and the view are replaced by stubs
+- fast mode: evaluate the same rules vectorised over the whole history with Rules.evaluate_columns
+  (years of 20 s data in seconds)
+- thresholds of Rules.json can be overridden by name, i.e. DEWPOINT_FAN_ON=4
+- report: hours with the fans and the heater on, switch toggles, hours with radon or internal humidity at or above
+  the ON thresholds (exceedances) and the hours of those with the fans off
+
+Architecture:
+- History holds the columns of the three measurements as numpy arrays, one row per tick, NaN for None;
+  a DHT22 value counts only if temperature, humidity, and dewpoint are present (as delivered by Dewpoint)
+- the ticks of the three measurements are merged into one time line of steps, ticks of the same second in the
+  order RD200, DHT22, DS18B20
+- both modes calculate the switches per step, the report is calculated from these columns by the same function
+- fast mode: each step is one update of the rules; the inputs are calculated from the history like the Model does,
+  the rules are evaluated by Rules (the vectorised evaluation is defined next to the scalar one)
+- main is for demonstration with synthetic data and for the replay of real data
+"""
+
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+import numpy as np
+from Storage import Storage
+from Model import Model
+from Rules import Rules, NONE
+from LineProtocol import parse_line
+from LocalStore import LOCAL_DIR
+
+
+ORDER = ["RD200", "DHT22", "DS18B20"]  # order of ticks of the same second
+KEYS = {
+    "DHT22": ["ext", "NO", "SO", "SW", "NW"],
+    "DS18B20": ["Ak", "Aw", "FL", "ZL", "AL"],
+    "RD200": [None],
+}
+FIELDS = {
+    "DHT22": ["temperature", "rH", "dewpoint", "error"],
+    "DS18B20": ["temperature", "error"],
+    "RD200": ["radon", "error"],
+}
+SWITCHES = ["out_fan_on", "in_fan_on", "heater_on"]
+
+
+class History():
+    def __init__(self, rows):
+        """rows: (measurement, key) -> 2-D array with the columns time and FIELDS of the measurement"""
+        self.tables = {measurement: self.tabulate(measurement, rows) for measurement in ORDER}
+
+    def tabulate(self, measurement, rows):
+        """{"time": ticks, key: {field: column}}, a sensor without a row in a tick has an error"""
+        parts = {key: rows[(measurement, key)] for key in KEYS[measurement] if (measurement, key) in rows}
+        times = np.unique(np.concatenate([part[:, 0] for part in parts.values()] + [np.empty(0)])).astype(np.int64)
+        table = {"time": times}
+        for key in KEYS[measurement]:
+            table[key] = {field: np.full(len(times), np.nan) for field in FIELDS[measurement]}
+            table[key]["error"][:] = 1.0
+            if key in parts:
+                index = np.searchsorted(times, parts[key][:, 0])
+                for i, field in enumerate(FIELDS[measurement]):
+                    table[key][field][index] = parts[key][:, i + 1]
+        if measurement == "DHT22":
+            for key in KEYS[measurement]:
+                columns = table[key]
+                invalid = np.isnan(columns["temperature"]) | np.isnan(columns["rH"]) | np.isnan(columns["dewpoint"])
+                for field in ["temperature", "rH", "dewpoint"]:
+                    columns[field][invalid] = np.nan
+                columns["error"][invalid] = 1.0
+        return table
+
+    def __len__(self):
+        return sum(len(self.tables[measurement]["time"]) for measurement in ORDER)
+
+
+def read_local(directory=LOCAL_DIR, start=None, stop=None):
+    """History from the SQLite files of LocalStore, start and stop in seconds since epoch."""
+    rows = {}
+    for measurement in ORDER:
+        path = os.path.join(directory, "{}.sqlite".format(measurement))
+        if not os.path.isfile(path):
+            continue
+        connection = sqlite3.connect(path)
+        try:
+            for key in KEYS[measurement]:
+                query = "SELECT time, {} FROM points WHERE time >= ? AND time < ?".format(", ".join(FIELDS[measurement]))
+                parameters = [start if start is not None else 0, stop if stop is not None else 2**62]
+                if key is not None:
+                    query += " AND key = ?"
+                    parameters.append(key)
+                result = connection.execute(query + " ORDER BY time", parameters).fetchall()
+                if result:
+                    rows[(measurement, key)] = np.array(result, dtype=float)  # None becomes NaN
+        finally:
+            connection.close()
+    return History(rows)
+
+
+def read_export(export_file, start=None, stop=None):
+    """History from an export file of Database (line protocol, precision seconds)."""
+    collected = {}
+    with open(export_file) as f:
+        for line in f:
+            if not line.strip() or not line.startswith(tuple(ORDER)):
+                continue
+            measurement, tags, fields, timestamp = parse_line(line)
+            if measurement not in FIELDS:
+                continue
+            if ((start is not None) and (timestamp < start)) or ((stop is not None) and (timestamp >= stop)):
+                continue
+            collected.setdefault((measurement, tags.get("key")), []).append([timestamp] + [fields.get(field) for field in FIELDS[measurement]])
+    return History({part: np.array(values, dtype=float) for part, values in collected.items()})
+
+
+def synthetic(days, seed=1, start=None):
+    """History of days with plausible values every 20 seconds (RD200 every 10 minutes) and some sensor errors."""
+    from Formulas import get_dewpoint_array, round_array
+    rng = np.random.default_rng(seed)
+    if start is None:
+        start = int(datetime(2024, 10, 1, tzinfo=timezone.utc).timestamp())
+    times = start + 20 * np.arange(days * 24 * 60 * 3)
+    day = 2 * np.pi * times / 86400
+    year = 2 * np.pi * (times - start) / (365 * 86400)  # 0 in autumn
+    noise = rng.normal(0, 1, len(times) + 2160)
+    weather = np.convolve(noise, np.ones(2160) / np.sqrt(2160), "valid")[:len(times)]  # changes within about half a day
+    external = 9 + 9 * np.sin(year + np.pi) + 4 * np.sin(day) + 2 * weather
+    rows = {}
+    for i, key in enumerate(KEYS["DHT22"]):
+        if key == "ext":
+            t = external + rng.normal(0, 0.1, len(times))
+            h = np.clip(80 - 2 * (t - 2) + rng.normal(0, 2, len(times)), 20, 100)
+        else:
+            t = 10 + 0.2 * i + 2 * np.sin(year + np.pi) + 0.3 * np.sin(day) + 0.1 * weather + rng.normal(0, 0.05, len(times))
+            h = np.clip(64 + 3 * np.sin(year + i) + 1.5 * weather + rng.normal(0, 0.5, len(times)), 20, 100)
+        t, h = round_array(t, 1), round_array(h, 1)
+        error = rng.random(len(times)) < 0.002
+        dewpoint = round_array(get_dewpoint_array(t, h), 1)
+        t[error], h[error], dewpoint[error] = np.nan, np.nan, np.nan
+        rows[("DHT22", key)] = np.column_stack([times, t, h, dewpoint, error])
+    for i, key in enumerate(KEYS["DS18B20"]):
+        t = round_array(external + i - 1 + rng.normal(0, 0.1, len(times)), 1)
+        error = rng.random(len(times)) < 0.001
+        t[error] = np.nan
+        rows[("DS18B20", key)] = np.column_stack([times, t, error])
+    radon_times = times[::30] + 7  # own clock of the RD200
+    radon = np.clip(120 + 60 * np.sin(2 * np.pi * radon_times / (5 * 86400)) + np.cumsum(rng.normal(0, 3, len(radon_times))), 5, None)
+    radon = np.round(radon)
+    error = rng.random(len(radon_times)) < 0.01
+    radon[error] = np.nan
+    rows[("RD200", None)] = np.column_stack([radon_times, radon, error])
+    return History(rows)
+
+
+def timeline(history):
+    """Times of the steps and the step of each tick per measurement."""
+    times = np.concatenate([history.tables[measurement]["time"] for measurement in ORDER])
+    rank = np.concatenate([np.full(len(history.tables[measurement]["time"]), i) for i, measurement in enumerate(ORDER)])
+    order = np.lexsort((rank, times))
+    step = np.empty(len(times), dtype=np.int64)
+    step[order] = np.arange(len(times))
+    positions = {}
+    offset = 0
+    for measurement in ORDER:
+        n = len(history.tables[measurement]["time"])
+        positions[measurement] = step[offset:offset + n]
+        offset += n
+    return times[order], positions
+
+
+def spread(n, positions, values, fill):
+    """Values of the ticks at positions on the time line of n steps, held until the next tick."""
+    index = np.full(n, -1, dtype=np.int64)
+    index[positions] = np.arange(len(positions))
+    np.maximum.accumulate(index, out=index)
+    return np.where(index >= 0, values[np.maximum(index, 0)], fill)
+
+
+def internal_inputs(table):
+    """Inputs of the rules per DHT22 tick, as calculated by Model.on_update_dewpoints."""
+    internal = [key for key in KEYS["DHT22"] if key != "ext"]
+    temperature = np.fmin.reduce([table[key]["temperature"] for key in internal])  # NaN only if all are NaN
+    humidity = np.fmax.reduce([table[key]["rH"] for key in internal])
+    dewpoint_min = np.fmin.reduce([table[key]["dewpoint"] for key in internal])
+    dewpoint_max = np.fmax.reduce([table[key]["dewpoint"] for key in internal])
+    return {
+        "internal_humidity": humidity,
+        "internal_temperature": temperature,
+        "internal_dewpoint_min": dewpoint_min,
+        "internal_dewpoint_max": dewpoint_max,
+        "external_dewpoint": table["ext"]["dewpoint"],
+        "external_temperature": table["ext"]["temperature"],
+    }
+
+
+def rule_inputs(history):
+    """input of the rules -> (measurement, value per tick), as the Model calculates them"""
+    inputs = {name: ("DHT22", values) for name, values in internal_inputs(history.tables["DHT22"]).items()}
+    rd200 = history.tables["RD200"][None]
+    inputs["radon"] = ("RD200", np.where(rd200["error"] > 0, np.nan, rd200["radon"]))  # no value in case of errors
+    inputs["FL_temperature"] = ("DS18B20", history.tables["DS18B20"]["FL"]["temperature"])
+    return inputs
+
+
+def replay_fast(history, thresholds=None):
+    """Switches per step, calculated vectorised with the rules of Rules.json."""
+    rules = Rules(thresholds=thresholds)
+    Model(ReplayView(), db=NullStorage(), rules=rules)  # seeds the inputs of the rules like in the live system
+    steps, positions = timeline(history)
+    n = len(steps)
+    inputs = rule_inputs(history)
+    columns = {}
+    updated = {}
+    for name, (measurement, ticks) in inputs.items():
+        columns[name] = spread(n, positions[measurement], ticks, np.nan)  # the seeded values are None
+        updated[name] = np.zeros(n, dtype=bool)
+        updated[name][positions[measurement]] = True
+    states = rules.evaluate_columns(columns, updated)
+    radon = columns["radon"]
+    humidity = columns["internal_humidity"]
+    return steps, {switch: states[switch] for switch in SWITCHES}, radon, humidity, rules.thresholds
+
+
+class NullStorage(Storage):
+    def write_DHT22(self, key, temperature, rH, dewpoint, aH, lim, error, timestamp=None):
+        pass
+
+    def write_DS18B20(self, key, temperature, error, timestamp=None):
+        pass
+
+    def write_RD200(self, radon, error, timestamp=None):
+        pass
+
+    def write_ventilation(self, ventilation, timestamp=None):
+        pass
+
+    def write_switches(self, switches, timestamp=None):
+        pass
+
+    def query_recent(self, measurement, seconds, key=None):
+        return []
+
+
+class ReplayView():
+    def __init__(self):
+        self.model = None
+
+    def on_change_radon(self, Bq):
+        pass
+
+    def on_change_north(self, temperature, humidity, dewpoint, location):
+        pass
+
+    def on_change_south(self, temperature, humidity, dewpoint, location):
+        pass
+
+    def on_change_external_temperature(self, temperature):
+        pass
+
+    def on_change_external_humidity(self, humidity):
+        pass
+
+    def on_change_external_dewpoint(self, dewpoint):
+        pass
+
+    def on_change_switches(self, switches):
+        pass
+
+    def on_change_communication_error(self, status):
+        pass
+
+
+def value(x):
+    return None if np.isnan(x) else float(x)
+
+
+def replay_exact(history, thresholds=None):
+    """Switches per step, calculated by the real Model."""
+    rules = Rules(thresholds=thresholds)
+    model = Model(ReplayView(), db=NullStorage(), rules=rules)
+    steps, positions = timeline(history)
+    n = len(steps)
+    source = np.empty(n, dtype=np.int8)
+    tick = np.empty(n, dtype=np.int64)
+    for i, measurement in enumerate(ORDER):
+        source[positions[measurement]] = i
+        tick[positions[measurement]] = np.arange(len(positions[measurement]))
+    switches = {switch: np.full(n, NONE, dtype=np.int8) for switch in SWITCHES}
+    radon = np.full(n, np.nan)
+    humidity = np.full(n, np.nan)
+    rd200 = history.tables["RD200"][None]
+    dht22 = history.tables["DHT22"]
+    ds18b20 = history.tables["DS18B20"]
+    for k in range(n):
+        i = tick[k]
+        if source[k] == 0:
+            error = bool(rd200["error"][i])
+            model.on_update_radon(None if error else value(rd200["radon"][i]), error)
+        elif source[k] == 1:
+            model.on_update_dewpoints({key: {
+                "temperature": value(dht22[key]["temperature"][i]),
+                "humidity": value(dht22[key]["rH"][i]),
+                "dewpoint": value(dht22[key]["dewpoint"][i]),
+                "error": bool(dht22[key]["error"][i]),
+            } for key in KEYS["DHT22"]})
+        else:
+            model.on_update_air_stream_temperatures({key: {
+                "temperature": value(ds18b20[key]["temperature"][i]),
+                "error": bool(ds18b20[key]["error"][i]),
+            } for key in KEYS["DS18B20"]})
+        state = model.snapshot()
+        for switch in SWITCHES:
+            if state.switches[switch] is not None:
+                switches[switch][k] = 1 if state.switches[switch] else 0
+        if (state.radon["Bq"] is not None) and not state.radon["error"]:
+            radon[k] = state.radon["Bq"]
+        if state.internal["humidity"] is not None:
+            humidity[k] = state.internal["humidity"]
+    return steps, switches, radon, humidity, rules.thresholds
+
+
+def report(steps, switches, radon, humidity, thresholds):
+    hours = np.diff(steps, append=steps[-1:]) / 3600  # a step lasts until the next step
+    fans_off = switches["out_fan_on"] != 1
+    with np.errstate(invalid="ignore"):
+        radon_high = radon >= thresholds["RADON_BQ_FAN_ON"]
+        humidity_high = humidity >= thresholds["HUMIDITY_FAN_ON"]
+    result = {
+        "from": datetime.fromtimestamp(int(steps[0])).strftime("%Y-%m-%d %H:%M") if len(steps) else None,
+        "to": datetime.fromtimestamp(int(steps[-1])).strftime("%Y-%m-%d %H:%M") if len(steps) else None,
+        "hours": float(hours.sum()),
+        "steps": len(steps),
+    }
+    for switch in SWITCHES:
+        state = switches[switch]
+        result[switch + "_hours"] = float(hours[state == 1].sum())
+        result[switch + "_toggles"] = int(((state[1:] != state[:-1]) & (state[:-1] != NONE)).sum())
+    result["radon_exceedance_hours"] = float(hours[radon_high].sum())
+    result["radon_exceedance_fans_off_hours"] = float(hours[radon_high & fans_off].sum())
+    result["humidity_exceedance_hours"] = float(hours[humidity_high].sum())
+    result["humidity_exceedance_fans_off_hours"] = float(hours[humidity_high & fans_off].sum())
+    return result
+
+
+def replay(history, thresholds=None, exact=False):
+    return report(*(replay_exact if exact else replay_fast)(history, thresholds))
+
+
+def print_reports(reports):
+    """reports: list of (title, report), printed side by side"""
+    print("{:36s}".format("") + "".join("{:>18s}".format(title) for title, _ in reports))
+    for name in reports[0][1]:
+        cells = []
+        for _, result in reports:
+            v = result[name]
+            cells.append("{:18.1f}".format(v) if isinstance(v, float) else "{:>18}".format(str(v)))
+        print("{:36s}".format(name) + "".join(cells))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay of the sensor history through the decisions of the Model")
+    parser.add_argument('--local', metavar="DIR", nargs="?", const=LOCAL_DIR, help="read the history from the files of LocalStore (default dir: {})".format(LOCAL_DIR))
+    parser.add_argument('--export', metavar="FILE", help="read the history from an export file of Database.py --export-bucket")
+    parser.add_argument('--synthetic', metavar="DAYS", type=int, help="replay synthetic data of DAYS days")
+    parser.add_argument('--from', dest="start", type=lambda s: datetime.strptime(s, '%Y-%m-%d').timestamp(), help="local date 'yyyy-mm-dd'")
+    parser.add_argument('--to', dest="stop", type=lambda s: datetime.strptime(s, '%Y-%m-%d').timestamp(), help="local date 'yyyy-mm-dd', exclusive")
+    parser.add_argument('--set', metavar="NAME=VALUE", action="append", default=[], help="override a threshold of Rules.json, i.e. DEWPOINT_FAN_ON=4")
+    parser.add_argument('--exact', action='store_true', help="replay through the Model tick by tick instead of the vectorised rules")
+    parser.add_argument('--compare', action='store_true', help="replay in both modes, compare the results and the durations")
+    args = parser.parse_args()
+
+    start = int(args.start) if args.start is not None else None
+    stop = int(args.stop) if args.stop is not None else None
+    t_start = time.monotonic()
+    if args.local:
+        history = read_local(args.local, start, stop)
+    elif args.export:
+        history = read_export(args.export, start, stop)
+    elif args.synthetic:
+        history = synthetic(args.synthetic)
+    else:
+        parser.print_help()
+        return
+    print("{} ticks loaded in {:.1f} s".format(len(history), time.monotonic() - t_start))
+    if 0 == len(history):
+        return
+
+    overrides = {}
+    for assignment in args.set:
+        name, text = assignment.split("=", 1)
+        overrides[name.strip()] = float(text)
+
+    reports = []
+    for title, thresholds in [("Rules.json", None)] + ([("overrides", overrides)] if overrides else []):
+        modes = [False, True] if args.compare else [args.exact]
+        results = []
+        for exact in modes:
+            t_start = time.monotonic()
+            result = replay(history, thresholds, exact=exact)
+            print("{} {} replay in {:.2f} s".format(title, "exact" if exact else "fast", time.monotonic() - t_start))
+            results.append(result)
+        if args.compare:
+            print("fast and exact replay are {}".format("identical" if results[0] == results[1] else "DIFFERENT"))
+        reports.append((title, results[-1]))
+    print_reports(reports)
+
+
+if __name__ == '__main__':
+    main()
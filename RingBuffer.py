@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+Fixed size window of samples for moving averages.
+
+Responsibility:
+- keep the last `capacity` samples, a sample of None marks an error and is not regarded in the statistics
+- mean of the valid samples, bit-identical to the former average of the sample lists (sum of the valid samples from
+  the oldest to the newest, divided by their number); None if the window does not contain any valid sample
+- variance, min, and max of the valid samples of the window in O(1) per sample, independent of the window size
+
+Architecture:
+- the samples are stored in an array of floats, None is stored as NaN
+- the mean is summed up on each call in O(capacity), the windows are small (3 samples per minute); a running sum would
+  differ in the last bits, which changes the rounded averages and thus the dewpoints and the hysteresis decisions
+- running sum and sum of squares for the variance; both are recomputed once per `capacity` samples to avoid the
+  drift of the floating point sums
+- min and max are tracked with monotonic queues (amortized O(1))
+- not thread-safe, each buffer is only used by the thread of its sensor
+- main is for demonstration
+"""
+
+import math
+from array import array
+from collections import deque
+
+
+class RingBuffer():
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self.samples = array("d", [math.nan] * capacity)
+        self.index = 0          # position of the next sample
+        self.pushed = 0         # total number of samples, including None
+        self.count = 0          # number of valid samples in the window
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.min_queue = deque()  # (sample number, value), values increasing
+        self.max_queue = deque()  # (sample number, value), values decreasing
+
+    def push(self, value):
+        old = self.samples[self.index]
+        if not math.isnan(old):
+            self.count -= 1
+            self.sum -= old
+            self.sum_sq -= old * old
+
+        if value is None:
+            self.samples[self.index] = math.nan
+        else:
+            value = float(value)
+            self.samples[self.index] = value
+            self.count += 1
+            self.sum += value
+            self.sum_sq += value * value
+            while self.min_queue and self.min_queue[-1][1] >= value:
+                self.min_queue.pop()
+            self.min_queue.append((self.pushed, value))
+            while self.max_queue and self.max_queue[-1][1] <= value:
+                self.max_queue.pop()
+            self.max_queue.append((self.pushed, value))
+
+        self.pushed += 1
+        oldest = self.pushed - self.capacity  # sample number of the oldest sample in the window
+        while self.min_queue and self.min_queue[0][0] < oldest:
+            self.min_queue.popleft()
+        while self.max_queue and self.max_queue[0][0] < oldest:
+            self.max_queue.popleft()
+
+        self.index += 1
+        if self.index == self.capacity:
+            self.index = 0
+            self.resync()
+
+    def resync(self):
+        valid = [v for v in self.samples if not math.isnan(v)]
+        self.count = len(valid)
+        self.sum = math.fsum(valid)
+        self.sum_sq = math.fsum(v * v for v in valid)
+
+    def mean(self):
+        total = 0.0
+        count = 0
+        for i in range(self.index, self.index + self.capacity):  # oldest first
+            value = self.samples[i % self.capacity]
+            if value == value:  # not NaN
+                total += value
+                count += 1
+        if count:
+            return total / count
+        return None
+
+    def variance(self):
+        """Population variance of the valid samples."""
+        if self.count:
+            mean = self.sum / self.count
+            return max(0.0, self.sum_sq / self.count - mean * mean)
+        return None
+
+    def min(self):
+        if self.min_queue:
+            return self.min_queue[0][1]
+        return None
+
+    def max(self):
+        if self.max_queue:
+            return self.max_queue[0][1]
+        return None
+
+    def values(self):
+        """The samples of the window, oldest first, None for errors."""
+        return [None if math.isnan(v) else v for v in (self.samples[self.index:] + self.samples[:self.index])]
+
+
+def main():
+    import random
+    buffer = RingBuffer(5)
+    for i in range(20):
+        buffer.push(None if 0 == random.randrange(4) else round(random.uniform(10, 20), 1))
+        values = buffer.values()
+        valid = [v for v in values if v is not None]
+        assert buffer.min() == (min(valid) if valid else None)
+        assert buffer.max() == (max(valid) if valid else None)
+        total = 0.0
+        for v in valid:
+            total += v
+        assert buffer.mean() == (total / len(valid) if valid else None)
+        print(values, buffer.mean(), buffer.min(), buffer.max(), buffer.variance())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""
+Downsampling of the raw 20 s sensor values into 1 minute, 1 hour, and 1 day aggregates.
+
+Responsibility:
+- for each level of LEVELS, each measurement and field of FIELDS, and each sensor key
+-- aggregate min, mean, and max of the values within the time window of the level
+-- the time windows are aligned to UTC, the aggregate gets the start time of its window as timestamp
+- announce an aggregate as line protocol as soon as its window is complete (the first value of the next window arrives)
+- values of None (errors) are not aggregated, a window without any value is not announced
+- each level is written into its own bucket with its own retention (see Database)
+
+Architecture:
+- passive, thread-safe object; add() is called by Database for each written point (live) or each exported record (backfill)
+- the caller registers an emit function uppon instantiation, it is called with the level name and the line
+- flush() announces the incomplete windows, i.e. at the end of a backfill
+- values that are older than the current window of a level are ignored (no out-of-order support)
+- with a state file the open windows survive a restart: they are saved atomically at the latest SAVE_INTERVAL
+  seconds (of the timestamps) after the last save and by save() on shutdown, and loaded on instantiation;
+  a loaded window is continued or announced when the first value of a later window arrives,
+  thus after a crash at most the values of the last SAVE_INTERVAL seconds are missing in the open windows
+- main is for demonstration
+"""
+
+import os
+import json
+import threading
+from LineProtocol import format_float, get_prefix
+
+
+# name, seconds per window, retention of the bucket in seconds (0 = infinite)
+LEVELS = [
+    ("1m", 60, 90 * 24 * 60 * 60),
+    ("1h", 60 * 60, 5 * 365 * 24 * 60 * 60),
+    ("1d", 24 * 60 * 60, 0),
+]
+
+SAVE_INTERVAL = 60  # seconds between two saves of the open windows
+
+FIELDS = {
+    "DHT22": ["aH", "dewpoint", "rH", "temperature"],
+    "DS18B20": ["temperature"],
+}
+
+
+class Aggregate():
+    def __init__(self, start):
+        self.start = start
+        self.values = {}  # field -> [min, sum, max, count]
+
+    def add(self, fields):
+        for field, value in fields.items():
+            if value is None:
+                continue
+            aggregate = self.values.get(field)
+            if aggregate is None:
+                self.values[field] = [value, value, value, 1]
+            else:
+                if value < aggregate[0]:
+                    aggregate[0] = value
+                aggregate[1] += value
+                if value > aggregate[2]:
+                    aggregate[2] = value
+                aggregate[3] += 1
+
+    def line(self, measurement, key):
+        fields = []
+        for field in sorted(self.values):
+            v_min, v_sum, v_max, count = self.values[field]
+            fields.append("{}_max={}".format(field, format_float(v_max)))
+            fields.append("{}_mean={}".format(field, format_float(round(v_sum / count, 2))))
+            fields.append("{}_min={}".format(field, format_float(v_min)))
+        return "{}{} {}".format(get_prefix(measurement, key), ",".join(fields), self.start)
+
+
+class Rollup():
+    def __init__(self, emit, levels=LEVELS, fields=FIELDS, state_file=None, save_interval=SAVE_INTERVAL):
+        self.emit = emit
+        self.levels = levels
+        self.fields = fields
+        self.state_file = state_file
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.windows = {}  # (level name, measurement, key) -> Aggregate
+        self.t_next_save = None
+        if self.state_file is not None:
+            self.load()
+
+    def load(self):
+        if os.path.isfile(self.state_file):
+            try:
+                with open(self.state_file) as f:
+                    for name, measurement, key, start, values in json.load(f):
+                        aggregate = Aggregate(start)
+                        aggregate.values = values
+                        self.windows[(name, measurement, key)] = aggregate
+            except Exception as e:
+                print(e)
+
+    def save(self):
+        """Persist the open windows, i.e. on shutdown. The windows stay open."""
+        with self.lock:
+            if (self.state_file is None) or (self.t_next_save is None):
+                return  # nothing added since the load, i.e. a tool like Database.py --export-bucket
+            self.save_windows()
+
+    def save_windows(self):
+        """Called with the lock held."""
+        state = [[name, measurement, key, aggregate.start, aggregate.values] for (name, measurement, key), aggregate in self.windows.items()]
+        with open(self.state_file + ".tmp", "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+    def add(self, measurement, key, values, timestamp):
+        """values is a dict field -> value, fields not listed in FIELDS are ignored."""
+        if measurement not in self.fields:
+            return
+        fields = {field: values.get(field) for field in self.fields[measurement]}
+        completed = []
+        with self.lock:
+            for name, seconds, _ in self.levels:
+                start = timestamp - (timestamp % seconds)
+                aggregate = self.windows.get((name, measurement, key))
+                if (aggregate is None) or (aggregate.start < start):
+                    if (aggregate is not None) and aggregate.values:
+                        completed.append((name, aggregate.line(measurement, key)))
+                    aggregate = Aggregate(start)
+                    self.windows[(name, measurement, key)] = aggregate
+                elif aggregate.start > start:
+                    continue  # out of order
+                aggregate.add(fields)
+            if self.state_file is not None:
+                if self.t_next_save is None:
+                    self.t_next_save = timestamp + self.save_interval
+                elif timestamp >= self.t_next_save:
+                    self.t_next_save = timestamp + self.save_interval
+                    try:
+                        self.save_windows()
+                    except Exception as e:
+                        print(e)
+        for name, line in completed:
+            self.emit(name, line)
+
+    def flush(self):
+        completed = []
+        with self.lock:
+            for (name, measurement, key), aggregate in self.windows.items():
+                if aggregate.values:
+                    completed.append((name, aggregate.line(measurement, key)))
+            self.windows = {}
+        for name, line in completed:
+            self.emit(name, line)
+
+
+def main():
+    import tempfile
+
+    def emit(name, line):
+        if name != "1m":
+            print(name, line)
+
+    state_file = os.path.join(tempfile.mkdtemp(), "rollup.json")
+    rollup = Rollup(emit, state_file=state_file)
+    t = 1700000000 - (1700000000 % 86400)
+    for i in range(3 * 180):  # three hours of 20 s values
+        if i == 200:
+            rollup.save()  # shutdown and restart in the middle of the second hour
+            rollup = Rollup(emit, state_file=state_file)
+        rollup.add("DHT22", "NO", {"temperature": 10 + (i % 30) / 10, "rH": 60.0, "dewpoint": None, "aH": 6.0}, t + i * 20)
+        rollup.add("DS18B20", "FL", {"temperature": 3.0 + (i % 5), "error": False}, t + i * 20)
+    rollup.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+"""
+Rule engine that calculates the ventilation requests and grants and the switches of the Model.
+
+Responsibility:
+- load the thresholds and the rules from Rules.json, thresholds can be overridden (i.e. by Replay)
+- compile the rules into a flat evaluation plan in the order of their dependencies
+- on update of the inputs: evaluate only the rules whose inputs or dependencies changed
+- record the cause of each change: the rules with thresholds that changed and caused it, with their inputs
+- evaluate a whole sequence of updates at once with numpy (evaluate_columns, i.e. for Replay), with the same results
+  as update() for each update of the sequence
+
+Rules:
+- "hysteresis": one input, "rising": true if the input is >= "on", false if it is <= "off";
+  "falling": false if the input is >= "off", true if it is <= "on"; otherwise unchanged; false if the input is None
+- "difference": true if high[0] - high[1] is >= "on", then false if low[0] - low[1] is <= "off" (thus off wins);
+  otherwise unchanged; false if any input is None
+- "any", "all": combination of other rules, None counts as false
+- all rules start as None, a combination is evaluated the first time any rule changes
+
+Architecture:
+- the inputs are seeded with the initial values of the caller (seed), an input that was never set counts as changed
+- the dependency graph maps each input and rule to the rules that use it; a rule is evaluated when one of its
+  dependencies changed in the current update, thus a rule is never evaluated twice per update
+- each type of rule is defined by a pair of functions next to each other: the scalar evaluation (used by update)
+  and the vectorised evaluation over columns of inputs (used by evaluate_columns), NaN stands for None
+- not thread-safe, the Model calls it with its lock held
+- main is for demonstration
+"""
+
+import json
+import time
+from collections import deque
+import numpy as np
+
+
+CONFIG_FILE = r"Rules.json"
+HISTORY_SIZE = 100  # changes of the rules kept for get_history()
+
+NONE = -1  # value None in the columns of evaluate_columns, otherwise 0 (false) and 1 (true)
+
+COMBINATIONS = {
+    "any": (any, np.logical_or.reduce),
+    "all": (all, np.logical_and.reduce),
+}
+
+
+def load_config(config_file=CONFIG_FILE):
+    with open(config_file) as f:
+        return json.load(f)
+
+
+def hysteresis(get, name, rising, on, off):
+    def evaluate(previous):
+        value = get(name)
+        if value is None:                     # error handling
+            return False, "no value"
+        if rising:
+            if value >= on[1]:                # hyteresis high
+                return True, on[0]
+            if value <= off[1]:               # hyteresis low
+                return False, off[0]
+        else:
+            if value >= off[1]:               # hyteresis high
+                return False, off[0]
+            if value <= on[1]:                # hysteresis low
+                return True, on[0]
+        return previous, None
+    return evaluate
+
+
+def hysteresis_array(name, rising, on, off):
+    def evaluate(columns):
+        value = columns[name]
+        result = np.full(len(value), NONE, dtype=np.int8)
+        with np.errstate(invalid="ignore"):
+            if rising:
+                result[value <= off[1]] = 0
+                result[value >= on[1]] = 1    # checked first
+            else:
+                result[value <= on[1]] = 1
+                result[value >= off[1]] = 0   # checked first
+        result[np.isnan(value)] = 0
+        return result
+    return evaluate
+
+
+def difference(get, high, low, on, off):
+    def evaluate(previous):
+        values = [get(name) for name in high + low]
+        if None in values:                    # error handling
+            return False, "no value"
+        result, reason = previous, None
+        if values[0] - values[1] >= on[1]:    # hyteresis high based on the high difference
+            result, reason = True, on[0]
+        if values[2] - values[3] <= off[1]:   # hyteresis low based on the low difference
+            result, reason = False, off[0]
+        return result, reason
+    return evaluate
+
+
+def difference_array(high, low, on, off):
+    def evaluate(columns):
+        high_difference = columns[high[0]] - columns[high[1]]
+        low_difference = columns[low[0]] - columns[low[1]]
+        result = np.full(len(high_difference), NONE, dtype=np.int8)
+        with np.errstate(invalid="ignore"):
+            result[high_difference >= on[1]] = 1
+            result[low_difference <= off[1]] = 0  # off wins
+        result[np.isnan(high_difference) | np.isnan(low_difference)] = 0
+        return result
+    return evaluate
+
+
+def combination(get, function, names):
+    def evaluate(previous):
+        return bool(function(get(name) for name in names)), None
+    return evaluate
+
+
+def combination_array(function, names):
+    def evaluate(states):
+        return function([states[name] == 1 for name in names]).astype(np.int8)
+    return evaluate
+
+
+def hold(decisions, initial):
+    """Decisions 0 / 1 or NONE (keep the previous value) -> values, starting with initial."""
+    index = np.where(decisions != NONE, np.arange(len(decisions)), -1)
+    np.maximum.accumulate(index, out=index)
+    return np.where(index >= 0, decisions[np.maximum(index, 0)], initial).astype(np.int8)
+
+
+def to_state(value):
+    return NONE if value is None else int(value)
+
+
+class Rules():
+    def __init__(self, config=None, thresholds=None, history_size=HISTORY_SIZE):
+        """config: content of Rules.json (default: loaded from CONFIG_FILE), thresholds: overrides by name"""
+        if config is None:
+            config = load_config()
+        self.thresholds = dict(config["thresholds"])
+        for name, value in (thresholds or {}).items():
+            if name not in self.thresholds:
+                raise ValueError("unknown threshold '{}'".format(name))
+            self.thresholds[name] = value
+        self.rules = config["rules"]
+        self.values = {name: None for name in self.rules}
+        self.inputs = {}  # name -> value, an input that was never set is missing
+        self.evaluated = set()  # combinations that have been evaluated at least once
+        self.causes = {}  # rule -> cause of its last change
+        self.history = deque(maxlen=history_size)
+        self.stats = {
+            "updates": 0,
+            "evaluations": 0,
+            "changes": 0,
+        }
+        self.plan, self.dependents = self.compile()
+
+    def threshold(self, name):
+        if name not in self.thresholds:
+            raise ValueError("unknown threshold '{}'".format(name))
+        return (name, self.thresholds[name])
+
+    def dependencies(self, rule):
+        if rule["type"] == "hysteresis":
+            return [rule["input"]]
+        if rule["type"] == "difference":
+            return list(dict.fromkeys(rule["high"] + rule["low"]))
+        return list(rule["of"])
+
+    def compile(self):
+        """
+        Flat plan of (name, is combination, dependencies, evaluate, evaluate_array) in the order of the dependencies.
+        """
+        get_input = self.inputs.get
+        get_value = self.values.get
+        steps = {}
+        for name, rule in self.rules.items():
+            kind = rule["type"]
+            if kind == "hysteresis":
+                if rule["direction"] not in ["rising", "falling"]:
+                    raise ValueError("rule '{}': unknown direction '{}'".format(name, rule["direction"]))
+                arguments = (rule["direction"] == "rising", self.threshold(rule["on"]), self.threshold(rule["off"]))
+                evaluate = hysteresis(get_input, rule["input"], *arguments)
+                evaluate_array = hysteresis_array(rule["input"], *arguments)
+            elif kind == "difference":
+                arguments = (rule["high"], rule["low"], self.threshold(rule["on"]), self.threshold(rule["off"]))
+                evaluate = difference(get_input, *arguments)
+                evaluate_array = difference_array(*arguments)
+            elif kind in COMBINATIONS:
+                for dependency in rule["of"]:
+                    if dependency not in self.rules:
+                        raise ValueError("rule '{}': unknown rule '{}'".format(name, dependency))
+                evaluate = combination(get_value, COMBINATIONS[kind][0], rule["of"])
+                evaluate_array = combination_array(COMBINATIONS[kind][1], rule["of"])
+            else:
+                raise ValueError("rule '{}': unknown type '{}'".format(name, kind))
+            steps[name] = (name, kind in COMBINATIONS, self.dependencies(rule), evaluate, evaluate_array)
+
+        dependents = {}
+        for name, _, dependencies, _, _ in steps.values():
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(name)
+
+        # topological order (Kahn), the order of the config is kept where possible
+        pending = {name: len([d for d in steps[name][2] if d in steps]) for name in steps}
+        ready = [name for name in steps if 0 == pending[name]]
+        plan = []
+        while ready:
+            name = ready.pop(0)
+            plan.append(steps[name])
+            for dependent in dependents.get(name, []):
+                pending[dependent] -= 1
+                if 0 == pending[dependent]:
+                    ready.append(dependent)
+        if len(plan) != len(steps):
+            raise ValueError("cyclic rules: {}".format(sorted(name for name in pending if pending[name])))
+        return plan, dependents
+
+    def seed(self, inputs):
+        """Initial values of the inputs, without evaluation."""
+        self.inputs.update(inputs)
+
+    def update(self, inputs, timestamp=None):
+        """Apply the inputs, returns the changed rules as dict name -> value."""
+        if timestamp is None:
+            timestamp = time.time()
+        self.stats["updates"] += 1
+        dirty = set()
+        for name, value in inputs.items():
+            if (name not in self.inputs) or (self.inputs[name] != value):
+                dirty.add(name)
+        self.inputs.update(inputs)
+        changed = {}
+        for name, is_combination, dependencies, evaluate, _ in self.plan:
+            if dirty.isdisjoint(dependencies):
+                if not (is_combination and changed and (name not in self.evaluated)):
+                    continue
+            previous = self.values[name]
+            value, reason = evaluate(previous)
+            self.stats["evaluations"] += 1
+            if is_combination:
+                self.evaluated.add(name)
+            if value != previous:
+                self.values[name] = value
+                changed[name] = value
+                dirty.add(name)
+                self.stats["changes"] += 1
+                if is_combination:
+                    rules = {}
+                    for dependency in dependencies:
+                        if dependency in changed:
+                            rules.update(self.causes[dependency]["rules"])
+                else:
+                    rules = {name: {"value": value, "reason": reason, "inputs": {d: self.inputs.get(d) for d in dependencies}}}
+                self.causes[name] = {"time": timestamp, "value": value, "rules": rules}
+                self.history.append((timestamp, name, value, sorted(rules)))
+        return changed
+
+    def evaluate_columns(self, columns, updated):
+        """
+        Vectorised update() for a sequence of updates, starting from the seeded inputs and the current values;
+        the object is not changed. Row i of the columns are the inputs after update i (NaN for None, the seeded
+        value before the first update of an input), updated[input] marks the updates that contain the input.
+        Returns rule -> column of values (NONE, 0, 1) after each update.
+        """
+        n = len(next(iter(columns.values())))
+        dirty = {}
+        for name, column in columns.items():
+            # same condition as in update(): an input is changed if it was never set or differs from its last value
+            seed = self.inputs.get(name)
+            previous = np.concatenate([[np.nan if seed is None else seed], column[:-1]])
+            dirty[name] = updated[name] & ~((column == previous) | (np.isnan(column) & np.isnan(previous)))
+            if (name not in self.inputs) and updated[name].any():
+                dirty[name][np.argmax(updated[name])] = True
+
+        states = {}
+        first_change = n  # the first update in which any rule changed
+        for name, is_combination, dependencies, _, evaluate_array in self.plan:
+            if is_combination:
+                continue
+            decisions = evaluate_array(columns)
+            evaluated = np.zeros(n, dtype=bool)
+            for dependency in dependencies:
+                evaluated |= dirty[dependency]
+            decisions[~evaluated] = NONE
+            initial = to_state(self.values[name])
+            states[name] = hold(decisions, initial)
+            change = np.flatnonzero(states[name] != np.concatenate([[initial], states[name][:-1]]))
+            if len(change):
+                first_change = min(first_change, change[0])
+        for name, is_combination, dependencies, _, evaluate_array in self.plan:
+            if is_combination:
+                # once evaluated, a combination is re-evaluated whenever a dependency changes, thus it always
+                # equals its function of the current values of the dependencies
+                states[name] = evaluate_array(states)
+                if name not in self.evaluated:
+                    states[name][:first_change] = to_state(self.values[name])
+        return states
+
+    def get(self, name):
+        return self.values[name]
+
+    def get_cause(self, name):
+        """
+        Cause of the last change of the rule: the rules with thresholds that changed in the same update and led to
+        it, with their value, the threshold (reason), and their inputs. Empty rules for the initial evaluation.
+        """
+        return self.causes.get(name)
+
+    def get_history(self):
+        """(time, rule, value, causing rules) of the last changes, oldest first"""
+        return list(self.history)
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+def main():
+    rules = Rules()
+    print("plan:", [step[0] for step in rules.plan])
+    rules.seed({"internal_humidity": None, "internal_temperature": None, "internal_dewpoint_min": None,
+                "internal_dewpoint_max": None, "external_dewpoint": None, "external_temperature": None, "FL_temperature": None})
+    print(rules.update({"internal_temperature": 10.0, "external_temperature": 5.0,
+                        "internal_dewpoint_min": 6.0, "internal_dewpoint_max": 7.0, "external_dewpoint": 2.0, "FL_temperature": 5.0}))
+    print(rules.update({"radon": 160}))
+    print("out_fan_on:", rules.get_cause("out_fan_on"))
+    print(rules.update({"radon": 100}), "(hysteresis)")
+    print(rules.update({"FL_temperature": 2.0}))
+    print("heater_on:", rules.get_cause("heater_on"))
+    print(rules.update({"external_dewpoint": 5.5}))
+    print("out_fan_on:", rules.get_cause("out_fan_on"))
+    print(rules.get_stats())
+
+    # the same sequence of updates at once
+    rules = Rules()
+    rules.seed({"internal_humidity": None, "internal_temperature": None, "internal_dewpoint_min": None,
+                "internal_dewpoint_max": None, "external_dewpoint": None, "external_temperature": None, "FL_temperature": None})
+    updates = [{"internal_temperature": 10.0, "external_temperature": 5.0, "internal_dewpoint_min": 6.0,
+                "internal_dewpoint_max": 7.0, "external_dewpoint": 2.0, "FL_temperature": 5.0},
+               {"radon": 160}, {"radon": 100}, {"FL_temperature": 2.0}, {"external_dewpoint": 5.5}]
+    columns, updated = {}, {}
+    for name in ["internal_humidity", "internal_temperature", "internal_dewpoint_min", "internal_dewpoint_max", "external_dewpoint", "external_temperature", "FL_temperature", "radon"]:
+        updated[name] = np.array([name in update for update in updates])
+        column = []
+        for update in updates:
+            column.append(update.get(name, column[-1] if column else np.nan))  # held until the next update
+        columns[name] = np.array(column, dtype=float)
+    states = rules.evaluate_columns(columns, updated)
+    print({name: states[name].tolist() for name in ["radon_request", "heater_on", "out_fan_on"]})
+
+
+if __name__ == '__main__':
+    main()
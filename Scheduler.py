@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""
+One scheduler for all periodic and delayed tasks of the process, replaces the timer threads and sleep loops of the components.
+
+Responsibility:
+- periodic jobs: every `interval` seconds
+- aligned periodic jobs: at the multiples of `interval` seconds of the wall clock, like the former TimeSyncedTimer
+  (i.e. interval 20: at hh:mm:00, hh:mm:20, hh:mm:40)
+- one-shot jobs: once after `delay` seconds
+- jobs can be cancelled, a job is never executed twice in parallel (a run that is due while the previous run is
+  still executing is skipped)
+- count the runs, skipped runs, late runs (started more than LATE seconds after their due time), and wakeups
+
+Architecture:
+- one scheduler thread waits on a heap of jobs ordered by their due time on the monotonic clock, it only wakes up
+  when a job is due or the heap changed; there is no polling
+- aligned jobs compute their due time from the wall clock, thus they stay aligned if the wall clock is adjusted
+- the jobs are executed by two pools of worker threads, thus a blocking job (i.e. a sensor read) does not delay
+  the other jobs:
+-- blocking jobs (default): the workers are created on demand, at most WORKERS; the sensor reads are the blocking
+   jobs of the process (DHT22 and DS18B20 at the same 20 s instant and a long RD200 poll), as a job is never executed
+   twice in parallel they cannot exhaust the pool
+-- short jobs (blocking=False, i.e. the 1 s tick of the View and the refresh of the switches) have their own worker
+   (SHORT_WORKERS)
+- thus the process has one scheduler thread plus up to WORKERS + SHORT_WORKERS workers instead of the one or two
+  threads in total that were the goal: the sensor reads block for seconds (DHT22 up to its 10 s deadline, the RD200
+  poll), executed by one thread they would delay each other and the 1 s tick of the View by seconds
+- exceptions of a job are printed, the job stays scheduled
+- get_scheduler() provides the scheduler that is shared by all components of the process, it is started on first use;
+  stop() joins the scheduler thread before the workers are shut down and resets the shared scheduler, thus the next
+  get_scheduler() starts a new one
+- main is for demonstration
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+WORKERS = 3         # upper bound of the workers for blocking jobs (the sensor reads), created on demand
+SHORT_WORKERS = 1   # workers for short jobs
+LATE = 0.1          # seconds, a run that starts later than this after its due time is counted as late
+ALIGNED_LATE = 0.002  # seconds, aligned jobs run this late, thus the wall clock has surely passed the multiple of the interval
+
+
+class Job():
+    def __init__(self, scheduler, function, interval, aligned, name, blocking):
+        self.scheduler = scheduler
+        self.function = function
+        self.interval = interval  # None for one-shot jobs
+        self.aligned = aligned
+        self.blocking = blocking
+        self.name = name
+        self.due = None           # monotonic time
+        self.wall_due = None      # wall clock time of an aligned job
+        self.running = False
+        self.cancelled = False
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+
+class Scheduler(threading.Thread):
+    def __init__(self, workers=WORKERS, short_workers=SHORT_WORKERS):
+        threading.Thread.__init__(self, name="Scheduler", daemon=True)
+        self.condition = threading.Condition()
+        self.heap = []  # (due, sequence number, job)
+        self.sequence = itertools.count()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Job")
+        self.short_executor = ThreadPoolExecutor(max_workers=short_workers, thread_name_prefix="ShortJob")
+        self.should_stop = threading.Event() # create an unset event on init
+        self.stats = {
+            "runs": 0,
+            "skipped": 0,
+            "late": 0,
+            "max_delay": 0.0,  # seconds between the due time and the start of a run
+            "wakeups": 0,
+        }
+
+    def every(self, interval, function, aligned=False, delay=None, name=None, blocking=True):
+        """
+        Execute function every interval seconds. An aligned job starts at the next multiple of interval of the wall
+        clock, otherwise the first run is after delay seconds (default: interval).
+        blocking=False: a short job that is executed by the workers for short jobs.
+        """
+        job = Job(self, function, interval, aligned, name or function.__name__, blocking)
+        with self.condition:
+            if aligned:
+                now = time.time()
+                job.wall_due = now + interval - (now % interval)
+                self.push(job, time.monotonic() + job.wall_due - now + ALIGNED_LATE)
+            else:
+                self.push(job, time.monotonic() + (interval if delay is None else delay))
+        return job
+
+    def after(self, delay, function, name=None, blocking=True):
+        """Execute function once after delay seconds."""
+        job = Job(self, function, None, False, name or function.__name__, blocking)
+        with self.condition:
+            self.push(job, time.monotonic() + max(0.0, delay))
+        return job
+
+    def cancel(self, job):
+        with self.condition:
+            job.cancelled = True  # removed from the heap when it is due
+            self.condition.notify()
+
+    def push(self, job, due):
+        """The condition must be held by the caller."""
+        job.due = due
+        heapq.heappush(self.heap, (due, next(self.sequence), job))
+        self.condition.notify()
+
+    def next_due(self, job, now):
+        if job.aligned:
+            wall_now = time.time()
+            job.wall_due += job.interval
+            if (job.wall_due <= wall_now) or (job.wall_due > wall_now + 2 * job.interval):
+                job.wall_due = wall_now + job.interval - (wall_now % job.interval)  # missed runs or wall clock adjusted
+            return now + job.wall_due - wall_now + ALIGNED_LATE
+        due = job.due + job.interval
+        if due <= now:
+            due = now + job.interval  # missed runs are not caught up
+        return due
+
+    def run(self):
+        with self.condition:
+            while not self.should_stop.is_set():
+                while self.heap and self.heap[0][2].cancelled:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    self.condition.wait()
+                    self.stats["wakeups"] += 1
+                    continue
+                now = time.monotonic()
+                due, _, job = self.heap[0]
+                if due > now:
+                    self.condition.wait(due - now)
+                    self.stats["wakeups"] += 1
+                    continue
+                heapq.heappop(self.heap)
+                self.dispatch(job)
+                if job.interval is not None:
+                    self.push(job, self.next_due(job, now))
+
+    def dispatch(self, job):
+        if job.running:
+            self.stats["skipped"] += 1
+            print("job '{}' is still running, skipped".format(job.name))
+            return
+        job.running = True
+        self.stats["runs"] += 1
+        (self.executor if job.blocking else self.short_executor).submit(self.execute, job, job.due)
+
+    def execute(self, job, due):
+        delay = time.monotonic() - due
+        with self.condition:
+            if delay > LATE:
+                self.stats["late"] += 1
+            if delay > self.stats["max_delay"]:
+                self.stats["max_delay"] = delay
+        try:
+            job.function()
+        except Exception as e:
+            print("job '{}':".format(job.name), e)
+        finally:
+            job.running = False
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, jobs=len([entry for entry in self.heap if not entry[2].cancelled]))
+
+    def stop(self):
+        global scheduler
+        self.should_stop.set()
+        with self.condition:
+            self.condition.notify()
+        if self.is_alive() and (threading.current_thread() is not self):
+            self.join()  # no dispatch after the shutdown of the workers
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.short_executor.shutdown(wait=False, cancel_futures=True)
+        with scheduler_lock:
+            if scheduler is self:
+                scheduler = None
+
+
+scheduler = None
+scheduler_lock = threading.Lock()
+def get_scheduler():
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = Scheduler()
+            scheduler.start()
+        return scheduler
+
+
+def main():
+    from datetime import datetime
+
+    def show(msg):
+        print(datetime.now().strftime("%H:%M:%S.%f"), msg)
+
+    s = get_scheduler()
+    s.every(1, lambda: show("aligned 1 s"), aligned=True)
+    s.every(5, lambda: show("aligned 5 s"), aligned=True)
+    job = s.every(0.7, lambda: show("every 0.7 s"), delay=0)
+    s.after(3, job.cancel)
+    s.after(4, lambda: time.sleep(3), name="blocking")
+    s.after(4, lambda: time.sleep(3), name="blocking too")  # due at the same time, runs in parallel
+    time.sleep(12)
+    print(s.get_stats())
+    s.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Health of a sensor, decides whether a sensor is worth the bus time of a read.
+
+Responsibility:
+- count the reads, the failed reads, and the consecutive failed reads of a sensor
+- a sensor that failed FAILURES_BEFORE_BACKOFF times in a row is regarded as dead and only tried again after a
+  backoff time, the backoff doubles with each further failure from BACKOFF_MIN up to BACKOFF_MAX seconds
+- one successful read makes the sensor healthy again
+- expose the health as dictionary (get_stats)
+
+Architecture:
+- passive, thread-safe object, one per sensor, used by the thread that reads the sensor
+- times are measured with the monotonic clock
+- main is for demonstration
+"""
+
+import threading
+import time
+
+
+FAILURES_BEFORE_BACKOFF = 3  # consecutive failed reads
+BACKOFF_MIN = 60.0           # seconds
+BACKOFF_MAX = 60.0 * 60.0    # seconds
+
+
+class SensorHealth():
+    def __init__(self, name, failures_before_backoff=FAILURES_BEFORE_BACKOFF, backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX):
+        self.name = name
+        self.failures_before_backoff = failures_before_backoff
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.reads = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.skipped = 0
+        self.last_error = None
+        self.last_success = None  # monotonic time
+        self.next_attempt = 0.0   # monotonic time
+        self.last_latency = None
+
+    def get_state(self):
+        if self.consecutive_failures == 0:
+            return "ok"
+        if self.consecutive_failures < self.failures_before_backoff:
+            return "degraded"
+        return "dead"
+
+    def should_read(self, now=None):
+        """False while a dead sensor is in its backoff time, the skipped read is counted."""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if now < self.next_attempt:
+                self.skipped += 1
+                return False
+            return True
+
+    def success(self, latency=None, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.consecutive_failures >= self.failures_before_backoff:
+                print("sensor '{}' is back after {} failed reads".format(self.name, self.consecutive_failures))
+            self.reads += 1
+            self.consecutive_failures = 0
+            self.last_success = now
+            self.next_attempt = 0.0
+            self.last_latency = latency
+
+    def failure(self, error, latency=None, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            self.reads += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            self.last_latency = latency
+            excess = self.consecutive_failures - self.failures_before_backoff
+            if excess >= 0:
+                backoff = min(self.backoff_max, self.backoff_min * (2 ** min(excess, 32)))
+                self.next_attempt = now + backoff
+                if excess == 0:
+                    print("sensor '{}' failed {} times in a row, next try in {:.0f} s".format(self.name, self.consecutive_failures, backoff))
+
+    def get_stats(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            return {
+                "state": self.get_state(),
+                "reads": self.reads,
+                "failures": self.failures,
+                "consecutive_failures": self.consecutive_failures,
+                "skipped": self.skipped,
+                "last_error": self.last_error,
+                "last_latency": self.last_latency,
+                "seconds_since_success": None if self.last_success is None else now - self.last_success,
+                "next_attempt_in": max(0.0, self.next_attempt - now),
+            }
+
+
+def main():
+    health = SensorHealth("NW", backoff_min=20.0)
+    now = 0.0
+    for tick in range(40):
+        now = tick * 20.0
+        if health.should_read(now):
+            if tick < 30:
+                health.failure("DHT sensor not found, check wiring", now=now)
+            else:
+                health.success(now=now)
+        print(tick, health.get_stats(now))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+Simulated DHT22 device, a replacement of adafruit_dht.DHT22 to test the timing of DHT22 without GPIO.
+
+Responsibility:
+- same interface as adafruit_dht.DHT22: the properties temperature and humidity, exit()
+- a read takes `duration` seconds, a failed read takes `failure_duration` seconds
+- a read fails with "Try again" (checksum / timing error) with the probability `failure_rate`
+- a non present sensor (`present=False`) "receives" [0x00, 0x00, 0x00, 0x00, 0x00]
+- like the library, a new transfer is only done if the last one is older than 2 seconds, otherwise the
+  values of the last transfer are returned
+
+Architecture:
+- passive object, the transfer is done in the thread that reads the property
+- create_simulated_device(key, pin) can be given to DHT22 as create_device
+- main is for demonstration
+"""
+
+import random
+import time
+
+
+class SimulatedDHT22():
+    def __init__(self, pin, temperature=12.0, humidity=65.0, duration=0.3, failure_rate=0.0, failure_duration=2.0, present=True):
+        self.pin = pin
+        self.base_temperature = temperature
+        self.base_humidity = humidity
+        self.duration = duration
+        self.failure_rate = failure_rate
+        self.failure_duration = failure_duration
+        self.present = present
+        self.last_transfer = None
+        self.values = (None, None)
+        self.transfers = 0
+
+    def measure(self):
+        now = time.monotonic()
+        if (self.last_transfer is not None) and (now - self.last_transfer < 2.0):
+            return
+        self.last_transfer = now
+        self.transfers += 1
+        if not self.present:
+            time.sleep(self.duration)
+            self.values = (0.0, 0.0)
+        elif random.random() < self.failure_rate:
+            time.sleep(self.failure_duration)
+            raise RuntimeError("Checksum did not validate. Try again.")
+        else:
+            time.sleep(self.duration)
+            self.values = (
+                round(self.base_temperature + random.uniform(-0.2, 0.2), 1),
+                round(self.base_humidity + random.uniform(-1.0, 1.0), 1),
+            )
+
+    @property
+    def temperature(self):
+        self.measure()
+        return self.values[0]
+
+    @property
+    def humidity(self):
+        self.measure()
+        return self.values[1]
+
+    def exit(self):
+        pass
+
+
+def create_simulated_device(key, pin):
+    return SimulatedDHT22(pin)
+
+
+def main():
+    from DHT22 import DHT22
+
+    devices = {
+        "ext": SimulatedDHT22(24, temperature=5.0, humidity=80.0, duration=0.5),
+        "NO": SimulatedDHT22(17, duration=0.3),
+        "SO": SimulatedDHT22(27, duration=0.4, failure_rate=0.5, failure_duration=4.0),  # flaky
+        "SW": SimulatedDHT22(22, duration=0.3),
+        "NW": SimulatedDHT22(23, duration=12.0),  # hangs longer than the deadline
+    }
+
+    def callback(data):
+        print("{:.2f} s".format(time.monotonic() - start), {key: (v["temperature"], v["humidity"], v["error"]) for key, v in data.items()})
+
+    dht = DHT22(callback, offset_correction=False, create_device=lambda key, pin: devices[key])
+    dht.job.cancel()  # the ticks are triggered below
+    for parallel in [False, True]:
+        dht.parallel = parallel
+        print("parallel" if parallel else "sequential")
+        for i in range(3):
+            start = time.monotonic()
+            dht.update_data()
+            time.sleep(2)
+    for key, health in dht.get_health().items():
+        print(key, health)
+    dht.exit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""
+Interface of the storage backends that persist the data of the Model.
+
+Backends:
+- "influxdb": Database, the InfluxDB service on the Raspberry Pi (default, used by Grafana)
+- "local": LocalStore, an embedded SQLite store that needs no external service
+- "local+influxdb": LocalStore that additionally forwards all points to the InfluxDB
+
+Responsibility:
+- define the write functions for the five measurements DHT22, DS18B20, RD200, ventilation, switches
+- define a query for the recent values of a measurement
+- create the configured backend, fall back to the local backend if the InfluxDB is not configured
+
+Architecture:
+- Storage is an abstract base class, a backend that misses a write function or the query fails on instantiation
+- the write functions must not block the caller (the sensor threads)
+- timestamps are integer seconds since epoch (UTC), None means now
+"""
+
+import os
+from abc import ABC, abstractmethod
+
+
+STORAGE_BACKEND = "influxdb"
+TOKEN_FILE = r"/home/taupunkt/influxdb.python.token"
+
+
+class Storage(ABC):
+    @abstractmethod
+    def write_DHT22(self, key, temperature, rH, dewpoint, aH, lim, error, timestamp=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_DS18B20(self, key, temperature, error, timestamp=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_RD200(self, radon, error, timestamp=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_ventilation(self, ventilation, timestamp=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_switches(self, switches, timestamp=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def query_recent(self, measurement, seconds, key=None):
+        """
+        Values of the last seconds, oldest first, as list of dicts with "time" (integer seconds), "key" (if the
+        measurement has one), and the fields of the measurement.
+        """
+        raise NotImplementedError
+
+    def get_stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def create_storage(backend=STORAGE_BACKEND, token_file=TOKEN_FILE):
+    if ("influxdb" in backend) and not os.path.isfile(token_file):
+        print("token file '{}' missing, using the local storage only".format(token_file))
+        backend = "local"
+
+    if backend == "influxdb":
+        from Database import Database
+        return Database(token_file=token_file)
+    elif backend == "local":
+        from LocalStore import LocalStore
+        return LocalStore()
+    elif backend == "local+influxdb":
+        from Database import Database
+        from LocalStore import LocalStore
+        return LocalStore(forward=Database(token_file=token_file))
+    raise ValueError("unknown storage backend '{}'".format(backend))
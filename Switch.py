@@ -1,10 +1,12 @@
 import threading
-import queue
 import time
 import gpiod
 from rpi_rf_gpiod import RFDevice
+from Scheduler import get_scheduler
 
 GPIO = 17
+REPEAT_INTERVAL = 60  # seconds, the current state is transmitted again in case a transmission was not received
+COALESCE_DELAY = 0.02  # seconds, changes of several switches within this time are transmitted as one burst
 
 """
 intended to be used with https://www.amazon.de/gp/product/B0BZJBPTB7
@@ -18,6 +20,15 @@ how to get the code:
 - execute ./433Utils/RPi_utils/RFSniffer
 - press the on button of the remote control and note down the on_code
 - press the off button of the remote control and note down the off_code
+
+architecture:
+- RpiRfGpiod is the one thread that transmits the codes of all switches, it sleeps on a condition until a switch
+  requests a transmission, thus a change is transmitted immediately
+- changes of several switches at the same time (i.e. fans and heater by one decision of the model) are collected
+  for COALESCE_DELAY seconds and transmitted as one burst; only the latest state of a switch is transmitted
+- one job of the shared Scheduler requests the refresh of the states of all started switches every REPEAT_INTERVAL seconds;
+  with scheduled=False the caller calls refresh (i.e. AsyncRuntime)
+- stop wakes the thread, the pending codes (i.e. the final off) are transmitted before it ends
 """
 
 
@@ -42,93 +53,136 @@ class RpiRfGpiod(threading.Thread, metaclass=Singleton):
         self.rfdevice.tx_repeat = 4
         self.gpio.request(consumer="rpi-rf_send", type=gpiod.LINE_REQ_DIR_OUT)
         self.should_stop = threading.Event() # create an unset event on init
-        self.q = queue.Queue()
-
-    def put(self, code):
-        self.q.put(code)
+        self.condition = threading.Condition()
+        self.pending = {}  # switch -> code, in order of the requests
+        self.switches = []  # started switches, refreshed every REPEAT_INTERVAL seconds
+        self.job = None
+        self.stats = {
+            "bursts": 0,
+            "transmissions": 0,
+            "failures": 0,
+        }
+
+    def request(self, switch, code):
+        with self.condition:
+            self.pending[switch] = code  # an older pending code of the switch is replaced
+            self.condition.notify()
+
+    def refresh(self):
+        with self.condition:
+            for switch in self.switches:
+                self.pending[switch] = switch.get_code()
+            self.condition.notify()
+
+    def add(self, switch):
+        with self.condition:
+            if switch not in self.switches:
+                self.switches.append(switch)
+
+    def remove(self, switch):
+        with self.condition:
+            if switch in self.switches:
+                self.switches.remove(switch)
+
+    def transmit(self, code):
+        repetitions = 0
+        while repetitions < self.max_repetitions:
+            t_start = time.time()
+            result = self.rfdevice.tx_code(code)
+            t_end = time.time()
+            if result:
+                if self.verbose:
+                    print(int(time.time()), repetitions, result, code, t_end - t_start)
+                break
+            else:
+                if self.verbose:
+                    print(int(time.time()), repetitions, result, code, t_end - t_start)
+                time.sleep(0.1)
+                repetitions += 1
+        self.stats["transmissions"] += 1
+        if repetitions == self.max_repetitions:
+            self.stats["failures"] += 1
+            print("ERROR: final timeout", code)
 
     def run(self):
-        while not self.should_stop.is_set() or not self.q.empty():
-            code = self.q.get()
-            repetitions = 0
-            while repetitions < self.max_repetitions:
-                t_start = time.time()
-                result = self.rfdevice.tx_code(code)
-                t_end = time.time()
-                if result:
-                    if self.verbose:
-                        print(int(time.time()), repetitions, result, code, t_end - t_start)
-                    break
-                else:
-                    if self.verbose:
-                        print(int(time.time()), repetitions, result, code, t_end - t_start)
-                    time.sleep(0.1)
-                    repetitions += 1
-            if repetitions == self.max_repetitions:
-                print("ERROR: final timeout", code)
-
-    def start(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.should_stop.is_set():
+                    self.condition.wait()
+                if not self.pending:
+                    break  # stopped, nothing left to transmit
+            time.sleep(COALESCE_DELAY)  # collect the other changes of the same event
+            with self.condition:
+                burst = list(self.pending.values())
+                self.pending = {}
+            self.stats["bursts"] += 1
+            for code in burst:
+                self.transmit(code)
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def start(self, scheduled=True):
         if 0 == RpiRfGpiod.total_running:
             threading.Thread.start(self)
+            if scheduled:
+                self.job = get_scheduler().every(REPEAT_INTERVAL, self.refresh, blocking=False)  # only queues the codes
         RpiRfGpiod.total_running += 1
 
     def stop(self):
         if RpiRfGpiod.total_running:
             RpiRfGpiod.total_running -= 1
         if 0 == RpiRfGpiod.total_running:
-            self.should_stop.set()
+            if self.job is not None:
+                self.job.cancel()
+            with self.condition:
+                self.should_stop.set()
+                self.condition.notify()
 
 
-class Switch(threading.Thread):
+class Switch():
     def __init__(self, on_code, off_code, verbose=False):
-        threading.Thread.__init__(self)
         self.on_code = on_code
         self.off_code = off_code
         self.verbose = verbose
         self.is_on = False
-        self.should_stop = threading.Event() # create an unset event on init
+        self.started = False
         self.rpi_rf_gpiod = RpiRfGpiod(verbose=verbose)
 
     def on(self):
         if not self.is_on:
             self.is_on = True
-            self.t_next_transmission = time.time() # transmit asap
             if self.verbose:
-                print(int(self.t_next_transmission), f"on({self.on_code})")
+                print(int(time.time()), f"on({self.on_code})")
+            if self.started:
+                self.transmit()  # transmit asap
 
     def off(self):
         if self.is_on:
             self.is_on = False
-            self.t_next_transmission = time.time() # transmit asap
             if self.verbose:
-                print(int(self.t_next_transmission), f"off({self.off_code})")
+                print(int(time.time()), f"off({self.off_code})")
+            if self.started:
+                self.transmit()  # transmit asap
+
+    def get_code(self):
+        return self.on_code if self.is_on else self.off_code
 
     def transmit(self):
-        self.rpi_rf_gpiod.put(self.on_code if self.is_on else self.off_code)
+        self.rpi_rf_gpiod.request(self, self.get_code())
 
-    def run(self):
-        self.t_next_transmission = time.time()
-        while not self.should_stop.is_set():
-            if time.time() >= self.t_next_transmission:
-                self.t_next_transmission += 60  # next desired transmission in 60 seconds
-                self.transmit()
-
-            t_sleep = self.t_next_transmission - time.time()
-            if t_sleep > 0.1:
-                t_sleep = 0.1  # do not wait longer than 100 ms in order to transmit or stop asap
-            if t_sleep < 0:
-               t_sleep = 0  # avoid exception due to negative time
-            time.sleep(t_sleep)
-        self.transmit() # take care switch is off at the end
-
-    def start(self):
-        self.rpi_rf_gpiod.start()
-        threading.Thread.start(self)
+    def start(self, scheduled=True):
+        self.started = True
+        self.rpi_rf_gpiod.add(self)
+        self.rpi_rf_gpiod.start(scheduled)
+        self.transmit()
 
     def stop(self):
         self.is_on = False
-        self.t_next_transmission = time.time() # transmit asap
-        self.should_stop.set()
+        if self.started:
+            self.started = False
+            self.rpi_rf_gpiod.remove(self)
+            self.transmit() # take care switch is off at the end
         self.rpi_rf_gpiod.stop()
 
 
@@ -160,6 +214,7 @@ def main():
     switch_heater.stop()
     switch_out_fan.stop()
     switch_in_fan.stop()
+    print(switch_heater.rpi_rf_gpiod.get_stats())
 
 
 if __name__ == '__main__':
@@ -8,7 +8,11 @@ Responsibilities:
 - output on the switches
 
 Architecture:
-- implemented in a thread that tries to update the LCD content once a second
+- a job of the shared Scheduler updates the LCD content once a second, aligned to the second of the wall clock;
+  it is a short job, thus it is not delayed by the blocking sensor reads
+- the LCD is written through a Framebuffer, only the changed characters are sent over I2C
+- with start(scheduled=False) the caller drives the ticks (i.e. AsyncRuntime): it changes the lines and copies them
+  with get_lines on its event loop, and writes the copies with update(lines) in an executor
 """
 
 VARIANT_ADAFRUIT = 1
@@ -24,20 +28,23 @@ if VARIANT == VARIANT_ADAFRUIT:
     from PCF8574 import PCF8574_GPIO
     from Adafruit_LCD2004 import Adafruit_CharLCD
 elif VARIANT == VARIANT_RPI_GPIO_I2C_LCD:
-    from RPi_GPIO_i2c_LCD import lcd
+    from Framebuffer import I2cDriver
+from Framebuffer import Framebuffer, AdafruitDriver
 from Leds import Leds
 from Switch import Switch
+from Scheduler import get_scheduler
 
 
 PCF8574_address = 0x27  # I2C address of the PCF8574 chip.
 PCF8574A_address = 0x3F  # I2C address of the PCF8574A chip.
 
 
-class View(threading.Thread):
+class View():
     def __init__(self):
-        threading.Thread.__init__(self)
         self.model = None
+        self.framebuffer = None
         self.should_stop = threading.Event() # create an unset event on init
+        self.job = None
         if VARIANT == VARIANT_ADAFRUIT:
             self.mcp = None
             self.lcd = None
@@ -91,12 +98,18 @@ class View(threading.Thread):
                 print(e)
         elif VARIANT == VARIANT_RPI_GPIO_I2C_LCD:
             self.lcd.clear()
+        self.framebuffer.invalidate()
 
-    def update(self):
+    def get_lines(self):
         for i in [5, 11, 17]:
             self.line2[i] = " "
             self.line3[i] = " "
             self.line4[i] = " "
+        return ["".join(line) for line in [self.line1, self.line2, self.line3, self.line4]]
+
+    def update(self, lines=None):
+        if lines is None:
+            lines = self.get_lines()
 
         if VARIANT == VARIANT_ADAFRUIT:
             if self.lcd_needs_recovery:
@@ -104,25 +117,15 @@ class View(threading.Thread):
 
             if not self.lcd_needs_recovery:
                 try:
-                    self.lcd.setCursor(0,0)  # set cursor position
-                    self.lcd.message(self.line1)
-                    self.lcd.setCursor(0,1)  # set cursor position
-                    self.lcd.message(self.line2)
-                    self.lcd.setCursor(0,2)  # set cursor position
-                    self.lcd.message(self.line3)
-                    self.lcd.setCursor(0,3)  # set cursor position
-                    self.lcd.message(self.line4)
+                    self.framebuffer.render(lines)
                 except Exception as e:
                     print(e)
                     self.lcd_needs_recovery = True
         elif VARIANT == VARIANT_RPI_GPIO_I2C_LCD:
             try:
-                self.lcd.set("".join(c for c in self.line1), 1)
-                self.lcd.set("".join(c for c in self.line2), 2)
-                self.lcd.set("".join(c for c in self.line3), 3)
-                self.lcd.set("".join(c for c in self.line4), 4)
+                self.framebuffer.render(lines)
             except Exception as e:
-                print(e)
+                print(e)  # the framebuffer is invalid, the next update writes all characters
 
         self.leds.green(self.air_stream_on)
         if not self.communication_error:
@@ -219,9 +222,18 @@ class View(threading.Thread):
         if self.communication_error:
             self.communication_error_led_toggle = True
 
-    def run(self):
+    def tick(self):
+        if self.should_stop.is_set():
+            return
+        self.on_change_time()
+        if 0 == int(time.time()) % 5:
+            if self.model:
+                self.model.on_time()
+        self.update()
+
+    def start(self, scheduled=True):
         # switch the out fan off
-        self.switch_out_fan.start()
+        self.switch_out_fan.start(scheduled)
         self.switch_out_fan.off()
 
         # Create PCF8574 GPIO adapter.
@@ -241,28 +253,31 @@ class View(threading.Thread):
             self.backlight(True)
             self.lcd.begin(20,4)     # set number of LCD lines and columns
             self.lcd.clear()
+            self.framebuffer = Framebuffer(AdafruitDriver(self.lcd))
             self.update()
         elif VARIANT == VARIANT_RPI_GPIO_I2C_LCD:
-            self.lcd = lcd.HD44780(0x27)
+            self.lcd = I2cDriver(0x27)
             self.backlight(True)
             self.lcd.clear()
+            self.framebuffer = Framebuffer(self.lcd)
             self.update()
-        while not self.should_stop.is_set():
-            t_wakeup = int(time.time() + 1)
-            t_sleep = t_wakeup - time.time()
-            if t_sleep < 0:
-                t_sleep = 0  # avoid exception due to negative time
-            time.sleep(t_sleep)
-            self.on_change_time()
-            if 0 == int(time.time()) % 5:
-                if self.model:
-                    self.model.on_time()
-            self.update()
+        if scheduled:
+            self.job = get_scheduler().every(1, self.tick, aligned=True, blocking=False)
+
+    def get_stats(self):
+        """I2C transactions of the LCD updates"""
+        if self.framebuffer is None:
+            return None
+        return self.framebuffer.get_stats()
 
     def stop(self):
         self.should_stop.set()
+        if self.job is not None:
+            self.job.cancel()
         if self.lcd is not None:
             self.lcd.clear()
+            if self.framebuffer is not None:
+                self.framebuffer.invalidate()
         self.backlight(False)
         self.leds.red(False)
         self.leds.green(False)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+"""
+Crash-safe write-ahead log for points that could not be written to the InfluxDB (replaces the former points.txt).
+
+Responsibility:
+- append records (line protocol strings) in O(1), independent of the size of the backlog
+- store the records in segment files of about SEGMENT_SIZE bytes, a new segment is started when the current one is full
+- fsync in batches, at the latest FSYNC_INTERVAL seconds after the last fsync (and on close)
+- persist a replay cursor (segment and byte offset) so a restart continues where the replay stopped
+- delete segments as soon as all their records are acknowledged
+- replay the records incrementally in batches in the background with a bounded rate
+
+Architecture:
+- WriteAheadLog is a passive, thread-safe object
+- WalReplayer is executed in a background (daemon) thread and calls a write function with a list of records,
+  it also triggers the timed fsync (sync_if_due), thus the tail of the log is synced even if no further records arrive
+- the write function raises in case of errors, the replay is then retried after RETRY_DELAY seconds, doubled with
+  each further failure up to MAX_RETRY_DELAY seconds
+- only the rejection of the records themselves is permanent (PERMANENT_STATUS: bad request, too large, unprocessable);
+  all other errors are retried without limit: connections errors, server errors, and also authorization (401, 403) and
+  missing buckets (404), as the records are fine and the log must not be emptied by an expired token
+- a batch that is rejected permanently MAX_ATTEMPTS times is moved into the dead-letter file (line protocol, can be
+  imported with Database.import_all) and acknowledged, thus it cannot block the records behind it
+- if the exception has the attribute records, only these records failed and the others have been written; the batch
+  is acknowledged, permanently rejected records are moved into the dead-letter file at once, the others are appended
+  to the log again
+- a record may be written twice after a crash between write and acknowledge, this is harmless for InfluxDB (same series and time)
+- main is for demonstration
+"""
+
+import os
+import json
+import threading
+import time
+
+
+SEGMENT_SIZE = 1024 * 1024  # bytes per segment file
+FSYNC_INTERVAL = 5.0        # seconds between two fsyncs
+SEGMENT_SUFFIX = ".wal"
+CURSOR_FILE = "cursor.json"
+DEAD_LETTER_FILE = "dead-letter.txt"
+
+REPLAY_BATCH_SIZE = 1000    # records per write
+REPLAY_RATE = 2000          # maximum records per second
+RETRY_DELAY = 30.0          # seconds to wait after a failed replay
+MAX_RETRY_DELAY = 600.0     # seconds, upper bound of the backoff
+MAX_ATTEMPTS = 3            # attempts of a batch that is rejected permanently
+PERMANENT_STATUS = [400, 413, 422]  # HTTP status of the rejection of the records themselves
+
+
+def is_permanent(e):
+    """True if the records are rejected and retrying will not help."""
+    return getattr(e, "status", None) in PERMANENT_STATUS  # i.e. influxdb_client.rest.ApiException
+
+
+class WriteAheadLog():
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, fsync_interval=FSYNC_INTERVAL):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+        if not self.segments:
+            self.segments = [0]
+        self.cursor = self.load_cursor()
+
+        self.f = open(self.segment_path(self.segments[-1]), "ab")
+        self.size = self.f.tell()
+        self.unsynced = False
+        self.t_last_sync = time.monotonic()
+        if self.size:
+            with open(self.segment_path(self.segments[-1]), "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.roll()  # incomplete record after a crash, do not append to it
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, "{:08d}{}".format(segment, SEGMENT_SUFFIX))
+
+    def load_cursor(self):
+        cursor = (self.segments[0], 0)
+        path = os.path.join(self.directory, CURSOR_FILE)
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                cursor = (int(data["segment"]), int(data["offset"]))
+            except Exception as e:
+                print(e)
+        if cursor[0] < self.segments[0]:
+            cursor = (self.segments[0], 0)  # the segment of the cursor has already been deleted
+        return cursor
+
+    def save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"segment": self.cursor[0], "offset": self.cursor[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def sync(self):
+        if self.unsynced:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.unsynced = False
+        self.t_last_sync = time.monotonic()
+
+    def sync_if_due(self):
+        """fsync if there are unsynced records and FSYNC_INTERVAL has passed since the last fsync."""
+        with self.lock:
+            if self.unsynced and (time.monotonic() - self.t_last_sync >= self.fsync_interval):
+                self.sync()
+
+    def roll(self):
+        """Start a new segment. Called with the lock held."""
+        self.sync()
+        self.f.close()
+        self.segments.append(self.segments[-1] + 1)
+        self.f = open(self.segment_path(self.segments[-1]), "ab")
+        self.size = 0
+
+    def append(self, records):
+        with self.lock:
+            for record in records:
+                data = "{}\n".format(record).encode()
+                self.f.write(data)
+                self.size += len(data)
+                self.unsynced = True
+                if self.size >= self.segment_size:
+                    self.roll()
+            if time.monotonic() - self.t_last_sync >= self.fsync_interval:
+                self.sync()
+
+    def read(self, max_records):
+        """Returns the next records after the cursor and the position after them (use it with ack())."""
+        records = []
+        with self.lock:
+            self.f.flush()  # make the records of the current segment visible to the reader
+            segment, offset = self.cursor
+            while (len(records) < max_records) and (segment <= self.segments[-1]):
+                path = self.segment_path(segment)
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        f.seek(offset)
+                        while len(records) < max_records:
+                            line = f.readline()
+                            if not line.endswith(b"\n"):
+                                break  # end of segment or incomplete record
+                            offset += len(line)
+                            line = line.strip()
+                            if line:
+                                records.append(line.decode())
+                if (len(records) < max_records) and (segment < self.segments[-1]):
+                    segment, offset = segment + 1, 0  # segment is complete, continue with the next one
+                else:
+                    break
+        return records, (segment, offset)
+
+    def ack(self, position):
+        """All records before position have been written, persist the cursor and delete the segments."""
+        with self.lock:
+            self.cursor = position
+            if (position[0] == self.segments[-1]) and (position[1] == self.size) and self.size:
+                self.roll()  # everything has been replayed, start over with an empty segment
+                self.cursor = (self.segments[-1], 0)
+            while self.segments[0] < self.cursor[0]:
+                try:
+                    os.remove(self.segment_path(self.segments[0]))
+                except FileNotFoundError:
+                    pass
+                self.segments.pop(0)
+            self.save_cursor()
+
+    def dead_letter(self, records):
+        """Keep records that cannot be written in the dead-letter file."""
+        with self.lock:
+            with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as f:
+                f.write("".join("{}\n".format(record) for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def is_empty(self):
+        with self.lock:
+            return (self.cursor[0] == self.segments[-1]) and (self.cursor[1] >= self.size)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "segments": len(self.segments),
+                "cursor": self.cursor,
+                "unsynced": self.unsynced,
+            }
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self.f.close()
+
+
+class WalReplayer(threading.Thread):
+    def __init__(self, wal, write, batch_size=REPLAY_BATCH_SIZE, rate=REPLAY_RATE, retry_delay=RETRY_DELAY, max_retry_delay=MAX_RETRY_DELAY, max_attempts=MAX_ATTEMPTS, is_permanent=is_permanent):
+        threading.Thread.__init__(self, daemon=True)
+        self.wal = wal
+        self.write = write
+        self.batch_size = batch_size
+        self.rate = rate
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.failures = 0  # consecutive failed writes, for the backoff
+        self.max_attempts = max_attempts
+        self.is_permanent = is_permanent
+        self.attempts = 0  # permanent failures of the current batch
+        self.should_stop = threading.Event() # create an unset event on init
+        self.wakeup = threading.Event()
+        self.replayed = 0
+        self.dead_lettered = 0
+
+    def wake(self):
+        """Start the replay asap, i.e. when the database is known to be reachable again."""
+        self.wakeup.set()
+
+    def pause(self, seconds):
+        """Wait for seconds or a wakeup, the timed fsync of the log continues meanwhile."""
+        deadline = time.monotonic() + seconds
+        while not self.should_stop.is_set():
+            self.wal.sync_if_due()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.wakeup.wait(min(remaining, self.wal.fsync_interval)):
+                break
+        self.wakeup.clear()
+
+    def backoff(self):
+        self.failures += 1
+        self.pause(min(self.retry_delay * 2 ** min(self.failures - 1, 16), self.max_retry_delay))
+
+    def dead_letter(self, records):
+        self.wal.dead_letter(records)
+        self.dead_lettered += len(records)
+        print("{} records moved into the dead-letter file, {} in total".format(len(records), self.dead_lettered))
+
+    def run(self):
+        while not self.should_stop.is_set():
+            self.wal.sync_if_due()
+            records, position = self.wal.read(self.batch_size)
+            if not records:
+                if position != self.wal.cursor:
+                    self.wal.ack(position)  # skip empty lines
+                self.pause(self.retry_delay)
+                continue
+            t_start = time.monotonic()
+            try:
+                self.write(records)
+            except Exception as e:
+                print(e)
+                failed = getattr(e, "records", records)
+                if len(failed) < len(records):
+                    # the other records have been written, the failed ones are rejected or replayed again later
+                    if self.is_permanent(e):
+                        self.dead_letter(failed)
+                    else:
+                        self.wal.append(failed)
+                    self.wal.ack(position)
+                    self.replayed += len(records) - len(failed)
+                    self.attempts = 0
+                    self.backoff()
+                    continue
+                if self.is_permanent(e):
+                    self.attempts += 1
+                    if self.attempts >= self.max_attempts:
+                        self.dead_letter(records)
+                        self.wal.ack(position)
+                        self.attempts = 0
+                        continue
+                self.backoff()
+                continue
+            self.attempts = 0
+            self.failures = 0
+            self.wal.ack(position)
+            self.replayed += len(records)
+            t_sleep = len(records) / self.rate - (time.monotonic() - t_start)
+            if t_sleep > 0:
+                self.should_stop.wait(t_sleep)  # bounded rate, do not flood the database
+
+    def stop(self, timeout=None):
+        self.should_stop.set()
+        self.wakeup.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+def main():
+    import tempfile
+    directory = tempfile.mkdtemp()
+    wal = WriteAheadLog(directory, segment_size=1000, fsync_interval=1.0)
+    for i in range(100):
+        wal.append(["test,key=NO temperature={} {}".format(i, 1700000000 + i)])
+    print(wal.get_stats(), os.listdir(directory))
+
+    class ClientError(Exception):
+        status = 400
+
+    failures = [2]
+    def write(records):
+        if failures[0]:
+            failures[0] -= 1
+            raise Exception("database not reachable")
+        if any("temperature=42 " in record for record in records):
+            raise ClientError("bad record")
+        print("write", len(records), records[0], "..", records[-1])
+
+    replayer = WalReplayer(wal, write, batch_size=30, rate=100, retry_delay=0.2)
+    replayer.start()
+    time.sleep(3)
+    wal.append(["test,key=NO temperature=100 1700000100"])
+    time.sleep(1.5)  # no further records, the replayer syncs the tail
+    replayer.stop()
+    print(replayer.replayed, replayer.dead_lettered, wal.get_stats(), os.listdir(directory))
+    wal.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,35 @@
 import sys
-import time
 import signal
 from Model import Model
 from View import View
 from Controller import Controller
+from Scheduler import get_scheduler
+from AsyncRuntime import AsyncRuntime
 
 
 view = None
+model = None
 controller = None
 
 
 def signal_handler(sig, frame):
     global view
+    global model
     global controller
     print('Terminated with Ctrl+C!')
     if view:
         view.stop()
     if controller:
         controller.stop()
+    if model:
+        model.stop()
+    get_scheduler().stop()
     sys.exit(0)
 
 
 def setup():
     global view
+    global model
     global controller
     signal.signal(signal.SIGINT, signal_handler)
     print('Terminate with Ctrl+C')
@@ -33,10 +40,22 @@ def setup():
     controller.start()
 
 
+def run_asyncio():
+    """One asyncio event loop instead of the jobs of the shared Scheduler, see AsyncRuntime"""
+    print('Terminate with Ctrl+C')
+    view = View()
+    model = Model(view)
+    controller = Controller(model)
+    AsyncRuntime(view, model, controller).run()
+
+
 def main():
+    if "--asyncio" in sys.argv[1:]:
+        run_asyncio()
+        return
     setup()
     while True:
-        time.sleep(1)
+        signal.pause()  # everything else is done by the jobs of the scheduler
 
 
 if __name__ == '__main__':